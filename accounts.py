@@ -0,0 +1,146 @@
+import time
+import logging
+import threading
+import ccxt
+from config import (
+    trade_info, ACCOUNTS_CONFIG, SYSTEM_CONFIG, RECOVERY_CONFIG, TRADE_INFO_FILE,
+    save_trade_info_to_file, load_trade_info_from_file
+)
+from utils import exchange
+import exposure
+import gateway
+from pnl_ledger import PnLLedger, ledger_path
+from equity import EquitySeries, series_paths
+
+
+class Account:
+    """
+    一個交易帳戶：自己的簽名客戶端、餘額帳本、trade_info、持倉匯總、收益帳本與權益曲線。
+    公共行情（ticker / OHLCV / 訂單簿）不經過帳戶客戶端，由 market_data 共用。
+    """
+
+    def __init__(self, name, client, info, book, state_file):
+        self.name = name
+        self.exchange = client
+        self.trade_info = info
+        self.exposure = book
+        self.state_file = state_file
+        self.pnl = PnLLedger(ledger_path(state_file), book, info)
+        self.equity = EquitySeries(*series_paths(state_file))
+        self.budget = None  # 分片模式下的全局投資額度（sharding.ShardBudget），None 時直接按 total_investment_limit 檢查
+        self.balance = {}
+        self.balance_time = 0.0
+        self._lock = threading.Lock()
+
+    def save(self):
+        """保存該帳戶的持倉數據與收益帳本"""
+        save_trade_info_to_file(self.trade_info, self.state_file)
+        self.pnl.save()
+
+    def record_realized(self, currency, profit, ts=None):
+        """已實現收益計入收益帳本，並同步 trade_info 中該幣種的收益欄位"""
+        self.pnl.record_realized(currency, profit, ts)
+        self.trade_info[currency].update(self.pnl.summary(currency))
+
+    def refresh_balance(self):
+        """從交易所刷新餘額帳本"""
+        balance = self.exchange.fetch_balance()
+        with self._lock:
+            self.balance = balance
+            self.balance_time = time.monotonic()
+        return balance
+
+    def free(self, currency, max_age=None):
+        """
+        可用餘額，帳本超過 max_age 秒未刷新時先刷新
+        """
+        max_age = SYSTEM_CONFIG['update_interval'] if max_age is None else max_age
+        if not self.balance or time.monotonic() - self.balance_time > max_age:
+            self.refresh_balance()
+        return float(self.balance.get(currency, {}).get('free', 0) or 0)
+
+    def adjust_free(self, currency, delta):
+        """下單後在本地帳本上預先扣減/增加可用餘額，直到下次刷新"""
+        with self._lock:
+            entry = self.balance.setdefault(currency, {'free': 0.0})
+            entry['free'] = float(entry.get('free') or 0) + delta
+
+    def mark_applied(self, currency, order):
+        """
+        訂單成交已更新到持倉後記錄到成交檢查點，重啟恢復時跳過該訂單
+        須在 save() 之前調用
+        """
+        if not order or not order.get('id') or currency not in self.trade_info:
+            return
+        with self._lock:
+            checkpoint = self.trade_info[currency].setdefault('fill_checkpoint', {'timestamp': None, 'order_ids': []})
+            timestamp = int(order.get('timestamp') or time.time() * 1000)
+            checkpoint['timestamp'] = max(checkpoint['timestamp'] or 0, timestamp)
+            if order['id'] not in checkpoint['order_ids']:
+                checkpoint['order_ids'].append(order['id'])
+                del checkpoint['order_ids'][:-RECOVERY_CONFIG['max_order_ids']]
+
+
+_accounts = {}
+_accounts_lock = threading.Lock()
+
+
+def _build_client(config):
+    """為子帳戶建立經由 gateway 的簽名客戶端，直接復用主客戶端已載入的市場資訊，不再重複 load_markets"""
+    client = gateway.wrap(ccxt.okx({
+        'apiKey': config['api_key'],
+        'secret': config['secret_key'],
+        'password': config['passphrase'],
+        'enableRateLimit': True,
+        'options': {
+            'defaultType': 'spot',
+            'adjustForTimeDifference': True,
+            'recvWindow': 60000,
+        },
+        'rateLimit': 300,
+        'timeout': 30000
+    }), scope=config['name'])
+    if exchange is not None and exchange.markets:
+        client.set_markets(exchange.markets, exchange.currencies)
+    return client
+
+
+def default_account():
+    """主帳戶：使用 utils.exchange 與 config.trade_info"""
+    account = _accounts.get('main')
+    if account is None:
+        with _accounts_lock:
+            account = _accounts.get('main')
+            if account is None:
+                account = Account('main', exchange, trade_info, exposure.default_book, TRADE_INFO_FILE)
+                _accounts['main'] = account
+    return account
+
+
+def load_accounts():
+    """載入主帳戶及 ACCOUNTS_CONFIG 中配置的所有子帳戶"""
+    default_account()
+    for config in ACCOUNTS_CONFIG:
+        if config['name'] in _accounts:
+            continue
+        if not all([config['api_key'], config['secret_key'], config['passphrase']]):
+            logging.error("子帳戶 %s 缺少API憑證，已跳過", config['name'])
+            continue
+        try:
+            info = load_trade_info_from_file(config['state_file'])
+            account = Account(config['name'], _build_client(config), info, exposure.ExposureBook(info), config['state_file'])
+            with _accounts_lock:
+                _accounts[config['name']] = account
+            logging.info("子帳戶 %s 已載入", config['name'])
+        except Exception as e:
+            logging.error("載入子帳戶 %s 失敗: %s", config['name'], e)
+    return list(_accounts.values())
+
+
+def all_accounts():
+    """返回已載入的所有帳戶"""
+    return list(_accounts.values()) or [default_account()]
+
+
+def get_account(name):
+    return _accounts.get(name)
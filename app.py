@@ -1,215 +1,231 @@
 import os
 import sys
-import ccxt
 import logging
 import threading
 import time
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, g
 from datetime import datetime, timedelta
 from config import *
-from utils import exchange
-from strategies.entry_strategy import open_position
-from utils import get_bollinger  # 新增這一行
-from main import trade_strategy
-
-
-# 確保日誌目錄存在
-if not os.path.exists('logs'):
-    os.makedirs('logs')
-
-# 設置日誌
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('logs/trading.log', mode='a', encoding='utf-8'),
-        logging.StreamHandler(sys.stdout)
-    ]
-)
-
-# 設置 Flask 的日誌
+from main import trade_strategy, run_all_accounts
+import profiler
+from log_setup import setup_logging, stats as logging_stats
+from market_data import get_tickers
+import exposure
+from accounts import load_accounts, default_account
+import recovery
+import fragments
+import scanner
+import scheduler
+import gateway
+import execution
+import equity
+import shadow
+import commands
+
+
+# 設置日誌（main.py 已初始化時直接復用）
+setup_logging()
+
+# 設置 Flask 的日誌（向根 logger 傳遞，由同一個日誌管道輸出）
 app = Flask(__name__)
 app.logger.setLevel(logging.INFO)
-for handler in logging.getLogger().handlers:
-    app.logger.addHandler(handler)
 
 # 初始化時的日誌
 logging.info("="*50)
 logging.info("交易系統啟動")
-logging.info(f"支援的貨幣: {', '.join(supported_currencies)}")
+logging.info("支援的貨幣: %s", ', '.join(supported_currencies))
 logging.info("="*50)
 
+# 請求級性能分析（未開啟時僅檢查計數器）
+@app.before_request
+def start_request_profile():
+    g.profile_session = profiler.begin('request', request.endpoint or request.path)
+
+@app.teardown_request
+def end_request_profile(exc=None):
+    profiler.end(g.pop('profile_session', None))
+
 # 緩存變量
 cached_trade_info = None
 cache_expiry_time = None
 CACHE_DURATION = timedelta(seconds=60)  # 緩存有效期為60秒
+CACHE_STALE_DURATION = timedelta(seconds=300)  # 過期後仍可先返回舊數據的時長，同時在後台刷新
+_refresh_lock = threading.Lock()  # 同一時間只有一個刷新在執行（single-flight）
+_reconcile_jobs = {}  # currency -> 餘額對帳任務 ID
 
 def get_trade_info():
-    """獲取最新的交易資訊，使用緩存機制降低請求頻率"""
-    global cached_trade_info, cache_expiry_time
-    # 如果緩存未過期，直接返回緩存的數據
-    if cached_trade_info and datetime.now() < cache_expiry_time:
-        logging.info("使用緩存的交易資訊")
-        return cached_trade_info['trade_info'], cached_trade_info['usdt_balance']
+    """
+    獲取最新的交易資訊，使用緩存機制降低請求頻率：
+    - 緩存有效：直接返回
+    - 緩存過期但未超過 CACHE_STALE_DURATION：立即返回舊數據，由一個後台線程刷新
+    - 沒有緩存或過舊：等待刷新；並發請求只有第一個執行刷新，其餘等待後直接使用其結果
+    一批並發請求最多觸發一次交易所刷新
+    """
+    now = datetime.now()
+    cached, expiry = cached_trade_info, cache_expiry_time
+    if cached and now < expiry:
+        return cached['trade_info'], cached['usdt_balance']
     
+    if cached and now < expiry + CACHE_STALE_DURATION:
+        if _refresh_lock.acquire(blocking=False):
+            try:
+                threading.Thread(target=_background_refresh, daemon=True).start()
+            except Exception as e:
+                # 線程未啟動時 _background_refresh 不會釋放鎖，否則之後再也不會刷新
+                _refresh_lock.release()
+                logging.error("啟動後台刷新失敗: %s", e)
+        return cached['trade_info'], cached['usdt_balance']
+    
+    with _refresh_lock:
+        # 等待期間其他請求可能已經刷新完成
+        if cached_trade_info and datetime.now() < cache_expiry_time:
+            return cached_trade_info['trade_info'], cached_trade_info['usdt_balance']
+        return _refresh_trade_info()
+
+def _background_refresh():
+    """後台刷新交易資訊，調用方已持有 _refresh_lock"""
+    try:
+        _refresh_trade_info()
+    finally:
+        _refresh_lock.release()
+
+def _reconcile_balance(currency, account):
+    """持倉記錄為空但交易所有餘額：交給交易引擎建立初始倉位（同一幣種的任務未完成前不重複提交）"""
+    job_id = _reconcile_jobs.get(currency)
+    if job_id:
+        job = commands.status(job_id)
+        if job and job['status'] in ('queued', 'running'):
+            return
+    _reconcile_jobs[currency] = commands.submit('reconcile_balance', currency, account.name)
+
+def _display_info(info):
+    """頁面顯示用的持倉副本：價格與收益欄位只寫在副本上，持倉狀態只由交易引擎修改"""
+    view = dict(info)
+    view['positions'] = [dict(position) for position in info['positions']]
+    return view
+
+def _refresh_trade_info():
+    """
+    從交易所刷新餘額與所有幣種價格並更新緩存（調用方須持有 _refresh_lock）
+    緩存的是持倉的顯示副本，請求處理線程不修改也不保存持倉
+    """
+    global cached_trade_info, cache_expiry_time
+    account = default_account()
+    trade_info = account.trade_info
     try:
-        if not exchange:
+        if not account.exchange:
             logging.error("交易所未初始化")
             return trade_info, 0.0
         
-        total_investment = 0.0
-        now = datetime.now()
-        today = now.strftime('%Y-%m-%d')
+        ledger = account.pnl
+        snapshot = {}
         
         # 獲取交易所的持倉數據
         try:
-            balance = exchange.fetch_balance()
+            balance = account.exchange.fetch_balance()
             usdt_balance = float(balance.get('USDT', {}).get('free', 0))
-            logging.info(f"USDT餘額: {usdt_balance}")
+            logging.info("USDT餘額: %s", usdt_balance)
         except Exception as e:
-            logging.error(f"獲取餘額失敗: {str(e)}")
+            logging.error("獲取餘額失敗: %s", e)
             usdt_balance = 0.0
         
+        # 所有幣種的價格一次批量獲取（行情緩存未過期時不產生請求）
+        tickers = get_tickers([f"{currency}/USDT" for currency in supported_currencies])
+        
         for currency in supported_currencies:
             try:
-                # 獲取當前價格（使用緩存機制）
-                ticker = exchange.fetch_ticker(f"{currency}/USDT")
-                price =  float(ticker['last']) 
-                if price is None:
-                    logging.error(f"無法獲取 {currency} 的價格，跳過該貨幣")
+                view = snapshot[currency] = _display_info(trade_info[currency])
+                ticker = tickers.get(f"{currency}/USDT")
+                if not ticker or ticker.get('last') is None:
+                    logging.error("無法獲取 %s 的價格，跳過該貨幣", currency)
                     continue
+                price = float(ticker['last'])
                 
-                trade_info[currency]['current_price'] = price
-                
-                # 初始化每日和每月收益
-                if 'daily_profit' not in trade_info[currency]:
-                    trade_info[currency]['daily_profit'] = 0.0
-                if 'monthly_profit' not in trade_info[currency]:
-                    trade_info[currency]['monthly_profit'] = 0.0
+                view['current_price'] = price
                 
                 # 獲取該幣種的持倉數量
                 currency_balance = float(balance.get(currency, {}).get('free', 0))
                 
-                # 更新持倉數據
-                if currency_balance > 0:
-                    if not trade_info[currency]['positions']:
-                        # 如果沒有持倉數據，則新增初始倉位
-                        position = {
-                            'amount': currency_balance,
-                            'entry_price': price,  # 記錄開倉時的價格
-                            'target_price':price * 1.03,
-                            'timestamp': datetime.now().timestamp() * 1000,  # 時間戳
-                            'current_value': currency_balance * price,
-                            'profit': 0.0  # 初始收益為 0
-                        }
-                        trade_info[currency]['positions'].append(position)
-                    else:
-                        # 如果已有持倉，檢查是否需要更新其他字段
-                        for position in trade_info[currency]['positions']:
-                            position['current_value'] = float(position['amount']) * price
-                            position['profit'] = position['current_value'] - (float(position['amount']) * float(position['entry_price']))
-                
-                # 更新 is_trading 狀態
-                if len(trade_info[currency]['positions']) > 0:
-                    trade_info[currency]['is_trading'] = True  # 如果有持倉，則設置為正在交易
-                else:
-                    trade_info[currency]['is_trading'] = False  # 如果沒有持倉，則設置為未交易
+                if currency_balance > 0 and not view['positions']:
+                    # 交易所有餘額但沒有持倉數據：由交易引擎按餘額建立初始倉位
+                    _reconcile_balance(currency, account)
+                for position in view['positions']:
+                    position['current_value'] = float(position['amount']) * price
+                    position['profit'] = position['current_value'] - (float(position['amount']) * float(position['entry_price']))
                 
-                # 計算該幣種的總投資額
-                currency_investment = sum(
-                    float(position['amount']) * float(position['entry_price'])
-                    for position in trade_info[currency]['positions']
-                )
-                total_investment += currency_investment
+                # 該幣種的總投資額（增量維護的匯總）
+                currency_investment = account.exposure.currency_exposure(currency)['invested']
                 
-                # 計算每日收益
-                daily_profit = sum(
-                    position['profit']
-                    for position in trade_info[currency]['positions']
-                    if isinstance(position['timestamp'], (int, float)) and
-                       datetime.fromtimestamp(position['timestamp'] / 1000).strftime('%Y-%m-%d') == today
-                )
-                trade_info[currency]['daily_profit'] = daily_profit
+                # 收益欄位直接讀取收益帳本的 日/月/累計 桶
+                ledger.mark(currency, price)
+                view.update(ledger.summary(currency))
                 
-                # 計算每月收益（簡化邏輯）
-                trade_info[currency]['monthly_profit'] = sum(p['profit'] for p in trade_info[currency]['positions'])
-                
-                logging.info(f"{currency} 投资额: {currency_investment:.2f} USDT, 当日收益: {daily_profit:.2f}")
+                logging.info("%s 投资额: %.2f USDT, 当日收益: %.2f", currency, currency_investment, view['daily_profit'])
             
             except Exception as e:
-                logging.error(f"更新 {currency} 資訊時出錯: {str(e)}")
+                logging.error("更新 %s 資訊時出錯: %s", currency, e)
                 continue
         
-        logging.info(f"總投資額: {total_investment:.2f} USDT")
-        
-        # 保存持倉數據到 JSON 文件
-        save_trade_info_to_file(trade_info)
+        total_investment = exposure.portfolio_invested()
+        logging.info("總投資額: %.2f USDT", total_investment)
         
         # 更新緩存
         cached_trade_info = {
-            'trade_info': trade_info,
+            'trade_info': snapshot,
             'usdt_balance': usdt_balance,
             'total_investment': total_investment
         }
         cache_expiry_time = datetime.now() + CACHE_DURATION
         
-        return trade_info, usdt_balance
+        return snapshot, usdt_balance
     
     except Exception as e:
-        logging.error(f"獲取交易資訊時出錯: {str(e)}")
+        logging.error("獲取交易資訊時出錯: %s", e)
         return trade_info, 0.0
     
+def calculate_total_asset_value(current_trade_info, usdt_balance):
+    """總資產 = 可用 USDT + 各幣種持倉單位數 × 最新價格（一次批量行情，單位數讀取持倉匯總）"""
+    tickers = get_tickers([f"{currency}/USDT" for currency in current_trade_info])
+    total_asset_value = usdt_balance
+    for currency, info in current_trade_info.items():
+        ticker = tickers.get(f"{currency}/USDT")
+        current_price = float(ticker['last']) if ticker and ticker.get('last') is not None else float_safe(info.get('current_price'))
+        total_asset_value += exposure.currency_exposure(currency)['units'] * current_price
+    return total_asset_value
+
 # 定義根路徑
 @app.route('/')
 def index():
     try:
         current_trade_info, usdt_balance = get_trade_info()
-        total_asset_value = usdt_balance  # 從可用 USDT 餘額開始
-
-        # 計算總資產價值
-        for currency, info in current_trade_info.items():
-            try:
-                ticker = exchange.fetch_ticker(f"{currency}/USDT")
-                current_price = float(ticker['last'])
-                for position in info['positions']:
-                    if isinstance(position, dict) and 'amount' in position:
-                        position_value = float(position['amount']) * current_price
-                        total_asset_value += position_value
-            except Exception as e:
-                logging.error(f"獲取 {currency} 價格失敗: {e}")
+        total_asset_value = calculate_total_asset_value(current_trade_info, usdt_balance)
 
-        # 計算每日、每月收益和年化收益率
-        daily_profit = sum(info.get('daily_profit', 0) for info in current_trade_info.values())
-        monthly_profit = sum(info.get('monthly_profit', 0) for info in current_trade_info.values())
-        days_passed = (datetime.now() - datetime(datetime.now().year, 1, 1)).days
-        annual_return = (daily_profit / total_asset_value * 365 / days_passed * 100) if total_asset_value > 0 else 0
+        # 每日、每月、累計收益與年化收益率（收益帳本預先匯總，O(1) 讀取）
+        ledger = default_account().pnl
 
-        # 計算總收益（從第一次交易開始累積）
-        total_profit = sum(info.get('total_profit', 0) for info in current_trade_info.values())
-
-        logging.info(f"渲染首頁 - 總資產: {total_asset_value:.2f} USDT")
+        logging.info("渲染首頁 - 總資產: %.2f USDT", total_asset_value)
 
+        # 摘要卡片與每個幣種的行片段按狀態版本緩存，只重新渲染有變化的部分
         return render_template('index.html',
-                             trade_info=current_trade_info,
-                             total_investment=total_asset_value, # 使用新的總資產價值
-                             total_profit=total_profit,         # 新增總收益
-                             annual_return=annual_return,
-                             usdt_balance=usdt_balance,
-                             daily_profit=daily_profit,
-                             monthly_profit=monthly_profit,
+                             summary_cards_html=fragments.summary_cards(
+                                 total_investment=total_asset_value,  # 使用新的總資產價值
+                                 total_profit=ledger.total(),         # 新增總收益
+                                 annual_return=ledger.annual_return(total_asset_value),
+                                 usdt_balance=usdt_balance,
+                                 daily_profit=ledger.daily(),
+                                 monthly_profit=ledger.monthly()),
+                             currency_rows_html=fragments.currency_rows(current_trade_info, default_account().exposure),
+                             execution_summary=execution.summary(),
                              max_positions=max_positions)
 
     except Exception as e:
         error_msg = f"首頁載入錯誤: {str(e)}"
         logging.error(error_msg)
         return render_template('index.html',
-                             trade_info=initialize_trade_info(),
-                             total_investment=0,
-                             total_profit=0,  # 新增總收益
-                             annual_return=0,
-                             usdt_balance=0,
-                             daily_profit=0,
-                             monthly_profit=0,
+                             summary_cards_html=fragments.summary_cards(
+                                 total_investment=0, total_profit=0, annual_return=0,
+                                 usdt_balance=0, daily_profit=0, monthly_profit=0),
+                             currency_rows_html='',
                              max_positions=max_positions,
                              error_message=error_msg)
 
@@ -223,31 +239,15 @@ def manage_positions(currency):
         if currency not in current_trade_info:
             return render_template('error.html', error_message=f"貨幣 {currency} 未找到"), 404
         
-        # 獲取該幣種的持倉資訊
-        positions = current_trade_info[currency]['positions']
-        
-        # 確保每個持倉都有必要的鍵
-        for position in positions:
-            if 'target_price' not in position or position['target_price'] is None:
-                position['target_price'] = 0.0  # 使用字符串表示未計算
-            else: 
-                position['target_price'] = float(position['entry_price'])*1.03
-            if 'profit' not in position:
-                position['profit'] = 0.0
-            if 'amount' not in position:
-                position['amount'] = 0.0
-        
-        # 計算總持倉和總收益
-        total_amount = sum(position.get('amount', 0) for position in positions)
-        total_profit = sum(position.get('profit', 0) for position in positions)
+        account = default_account()
+        info = current_trade_info[currency]
         
-        # 渲染倉位管理頁面
+        # 倉位表格與匯總按持倉版本緩存；總單位數與總收益讀取持倉匯總與收益帳本
         return render_template('manage_positions.html', 
                                currency=currency, 
-                               positions=positions,
-                               total_amount=total_amount, 
-                               total_profit=total_profit,
-                               trade_info=current_trade_info)
+                               position_rows_html=fragments.position_rows(currency, info, account.exposure),
+                               position_summary_html=fragments.position_summary(
+                                   currency, info, account.exposure, account.pnl.unrealized_pnl(currency)))
     except Exception as e:
         error_msg = f"倉位管理頁面載入錯誤: {str(e)}"
         logging.error(error_msg)
@@ -255,153 +255,37 @@ def manage_positions(currency):
 
 @app.route('/api/close_all_positions/<currency>', methods=['POST'])
 def close_all_positions(currency):
-    try:
-        # 獲取當前交易資訊
-        current_trade_info, _ = get_trade_info()
-        
-        # 檢查該幣種是否存在於交易資訊中
-        if currency not in current_trade_info:
-            return jsonify({'success': False, 'error': f"貨幣 {currency} 未找到"}), 404
-        
-        # 獲取該幣種的所有倉位
-        positions = current_trade_info[currency]['positions']
-        
-        # 檢查持倉數據是否為空
-        if not positions:
-            logging.error(f"{currency} 無持倉可賣出")
-            return jsonify({'success': False, 'error': f"{currency} 無持倉可賣出"}), 400
-        
-        # 計算總持倉量
-        total_amount = sum(position.get('amount', 0) for position in positions)
-        
-        # 檢查市場深度
-        try:
-            orderbook = exchange.fetch_order_book(f"{currency}/USDT")
-            best_bid = orderbook['bids'][0][0] if orderbook['bids'] else 0
-            best_ask = orderbook['asks'][0][0] if orderbook['asks'] else float('inf')
-
-            if best_ask - best_bid > 0.01 * best_bid:  # 如果買賣差價超過 1%
-                logging.warning(f"{currency} 買賣差價過大，跳過本次交易")
-                return jsonify({'success': False, 'error': f"{currency} 買賣差價過大"}), 400
-        except Exception as e:
-            logging.error(f"{currency} 檢查市場深度失敗: {str(e)}")
-            return jsonify({'success': False, 'error': str(e)}), 500
-        
-        # 檢查最小交易數量
-        try:
-            markets = exchange.load_markets()
-            market = markets.get(f"{currency}/USDT")
-            if market and total_amount < market['limits']['amount']['min']:
-                logging.warning(f"{currency} 交易量 {total_amount} 小於最小交易量 {market['limits']['amount']['min']}")
-                # 如果剩餘數量小於最小交易量，直接清空持倉並結束交易狀態
-                current_trade_info[currency]['positions'] = []
-                current_trade_info[currency]['is_trading'] = False
-                return jsonify({'success': True, 'message': f"{currency} 剩餘數量小於最小交易量，已清空持倉"})
-        except Exception as e:
-            logging.error(f"{currency} 檢查最小交易量失敗: {str(e)}")
-            return jsonify({'success': False, 'error': str(e)}), 500
-        
-        # 賣出所有倉位
-        try:
-            order = exchange.create_market_sell_order(f"{currency}/USDT", total_amount)
-            logging.info(f"{currency} 所有倉位已賣出: {order}")
-            
-            # 清空該幣種的持倉數據
-            current_trade_info[currency]['positions'] = []
-            current_trade_info[currency]['is_trading'] = False  # 結束交易狀態
-
-            save_trade_info_to_file(current_trade_info)  # 儲存到 JSON 文件
-            
-            return jsonify({'success': True})
-        
-        except ccxt.InsufficientFunds as e:
-            logging.error(f"{currency} 餘額不足: {str(e)}")
-            return jsonify({'success': False, 'error': str(e)}), 500
-        except ccxt.NetworkError as e:
-            logging.error(f"{currency} 網路錯誤: {str(e)}")
-            return jsonify({'success': False, 'error': str(e)}), 500
-        except ccxt.ExchangeError as e:
-            logging.error(f"{currency} 交易所錯誤: {str(e)}")
-            # 如果賣出失敗，檢查是否是因為剩餘數量小於最小交易量
-            if "Order amount should be greater than the minimum available amount" in str(e):
-                # 獲取當前價格
-                ticker = exchange.fetch_ticker(f"{currency}/USDT")
-                current_price = float(ticker['last'])
-                
-                # 計算剩餘單位數的價值
-                remaining_value = total_amount * current_price
-                
-                # 如果剩餘單位數的價值小於 0.05 USDT，則清空持倉並結束交易狀態
-                if remaining_value < 0.05:
-                    current_trade_info[currency]['positions'] = []
-                    current_trade_info[currency]['is_trading'] = False
-                    save_trade_info_to_file(trade_info)  # 儲存到 JSON 文件
-                    return jsonify({'success': True, 'message': f"{currency} 剩餘數量價值小於 0.05 USDT，已清空持倉"})
-                else:
-                    return jsonify({'success': False, 'error': f"{currency} 剩餘數量價值大於 0.05 USDT，無法清空持倉"})
-            return jsonify({'success': False, 'error': str(e)}), 500
-        except Exception as e:
-            logging.error(f"{currency} 賣出所有倉位失敗: {str(e)}")
-            return jsonify({'success': False, 'error': str(e)}), 500
-    
-    except Exception as e:
-        error_msg = f"關閉所有倉位錯誤: {str(e)}"
-        logging.error(error_msg)
-        return jsonify({'success': False, 'error': error_msg}), 500
+    """賣出所有倉位：放入命令隊列由交易引擎執行，立即返回任務 ID"""
+    if currency not in supported_currencies:
+        return jsonify({'success': False, 'error': f"貨幣 {currency} 未找到"}), 404
+    job_id = commands.submit('close_all', currency, decided_at=time.time())
+    return jsonify({'success': True, 'job_id': job_id, 'status_url': f"/api/jobs/{job_id}"}), 202
 
 @app.route('/start_trading/<currency>', methods=['POST'])
 def start_trading(currency):
-    try:
-        if currency not in trade_info:
-            error_msg = f"貨幣 {currency} 未找到"
-            logging.error(error_msg)
-            return jsonify({'success': False, 'error': error_msg}), 404
-        
-        # 獲取布林通道下軌價格
-        bollinger = get_bollinger(f"{currency}/USDT", timeframe='1h', period=20, deviation=2)
-        if not bollinger:
-            error_msg = f"無法獲取 {currency} 的布林通道數據"
-            logging.error(error_msg)
-            return jsonify({'success': False, 'error': error_msg}), 500
-        
-        lower_band = bollinger['lower']  # 布林通道下軌價格
-        
-        # 設置等待開倉狀態
-        trade_info[currency]['waiting_for_open'] = True
-        trade_info[currency]['is_trading'] = True
-        save_trade_info_to_file(trade_info)  # 儲存到 JSON 文件
-
-         # 嘗試立即開倉
-        ticker = exchange.fetch_ticker(f"{currency}/USDT")
-        price =  float(ticker['last']) 
-        if price <= lower_band:
-             current_price = price
-             success, error_msg = open_position(currency, current_price, first_position_amount)
-             if success:
-                  logging.info(f" {currency} 開始交易，並立即開倉成功")
-                  trade_info[currency]['waiting_for_open'] = False
-                  save_trade_info_to_file(trade_info)  # 儲存到 JSON 文件
-                  return jsonify({
-                        'success': True,
-                        'message': f"開始交易成功，並立即開倉。當前價格: {current_price:.4f}，布林通道下軌價格: {lower_band:.4f} USDT"
-                  })
-             else:
-                  logging.info(f" {currency} 開始交易，但無法立即開倉: {error_msg}")
-                  return jsonify({
-                        'success': True,
-                        'message': f"開始交易成功，等待合適的開倉條件。當前價格: {current_price:.4f}，布林通道下軌價格: {lower_band:.4f} USDT"
-                 })
-
-        logging.info(f" {currency} 開始交易，等待合適的開倉條件")
-        return jsonify({
-            'success': True,
-            'message': f" {currency} 開始交易，等待合適的開倉條件。當前布林通道下軌價格: {lower_band:.4f} USDT"
-        })
-         
-    except Exception as e:
-        error_msg = f"開始交易 {currency} 時出錯: {str(e)}"
+    """開始交易：放入命令隊列由交易引擎執行，立即返回任務 ID"""
+    if currency not in supported_currencies:
+        error_msg = f"貨幣 {currency} 未找到"
         logging.error(error_msg)
-        return jsonify({'success': False, 'error': error_msg}), 500
+        return jsonify({'success': False, 'error': error_msg}), 404
+    job_id = commands.submit('start_trading', currency)
+    return jsonify({'success': True, 'job_id': job_id, 'status_url': f"/api/jobs/{job_id}"}), 202
+
+@app.route('/api/jobs')
+def api_jobs():
+    """最近的手動交易命令"""
+    return jsonify({'success': True, 'jobs': commands.recent(request.args.get('limit', 20, type=int))})
+
+@app.route('/api/jobs/<job_id>')
+def api_job(job_id):
+    """
+    命令狀態：queued / running / done / failed，完成後 result 為執行結果、error 為失敗原因
+    ?wait=N 時最多等待 N 秒直到任務完成（長輪詢，上限 COMMAND_CONFIG['max_wait']）
+    """
+    job = commands.status(job_id, wait=request.args.get('wait', 0, type=float))
+    if job is None:
+        return jsonify({'success': False, 'error': f"任務 {job_id} 不存在"}), 404
+    return jsonify({'success': True, 'job': job})
     
 # 定義 API 接口
 @app.route('/api/dashboard')
@@ -409,33 +293,20 @@ def api_dashboard():
     """API 接口：返回儀表板數據"""
     try:
         current_trade_info, usdt_balance = get_trade_info()
-        total_asset_value = usdt_balance
+        total_asset_value = calculate_total_asset_value(current_trade_info, usdt_balance)
         #trade_strategy()  # 調用 main.py 的核心邏輯
 
-        # 計算總資產價值
-        for currency, info in current_trade_info.items():
-            try:
-                ticker = exchange.fetch_ticker(f"{currency}/USDT")
-                current_price = float(ticker['last'])
-                for position in info['positions']:
-                    if isinstance(position, dict) and 'amount' in position:
-                        position_value = float(position['amount']) * current_price
-                        total_asset_value += position_value
-            except Exception as e:
-                logging.error(f"獲取 {currency} 價格失敗: {e}")
-
-        # 計算每日、每月收益和年化收益率
-        daily_profit = sum(info.get('daily_profit', 0) for info in current_trade_info.values())
-        monthly_profit = sum(info.get('monthly_profit', 0) for info in current_trade_info.values())
-        days_passed = (datetime.now() - datetime(datetime.now().year, 1, 1)).days
-        annual_return = (daily_profit / total_asset_value * 365 / days_passed * 100) if total_asset_value > 0 else 0
+        # 每日、每月、累計收益與年化收益率（收益帳本預先匯總，O(1) 讀取）
+        ledger = default_account().pnl
+        daily_profit = ledger.daily()
+        monthly_profit = ledger.monthly()
+        annual_return = ledger.annual_return(total_asset_value)
 
         # 按等待交易中和交易狀態排序
         sorted_trade_info = dict(sorted(current_trade_info.items(), key=lambda x: (
             -x[1].get('waiting_for_open', False),  # 等待交易中的優先
             -x[1].get('is_trading', False)        # 正在交易的次之
         )))
-        save_trade_info_to_file(sorted_trade_info)  # 儲存到 JSON 文件
         # 返回 JSON 格式的數據
         return jsonify({
             'success': True,
@@ -444,28 +315,144 @@ def api_dashboard():
             'usdt_balance': usdt_balance,
             'daily_profit': daily_profit,
             'monthly_profit': monthly_profit,
-            'annual_return': annual_return
+            'total_profit': ledger.total(),
+            'unrealized_profit': ledger.unrealized_pnl(),
+            'annual_return': annual_return,
+            'execution': execution.summary()
         })
     
     except Exception as e:
-        logging.error(f"獲取儀表板數據時出錯: {str(e)}")
+        logging.error("獲取儀表板數據時出錯: %s", e)
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/api/universe')
+def api_universe():
+    """API 接口：返回全市場掃描的入場候選排名（上一次掃描的結果，到期時在後台重新掃描）"""
+    try:
+        top = int(request.args.get('top', 20))
+        results = scanner.scan_in_background()
+        return jsonify({
+            'success': True,
+            'candidates': results[:top],
+            'stats': scanner.last_scan_stats(),
+            'scanning': scanner.scanning()
+        })
+    except Exception as e:
+        logging.error("掃描交易對時出錯: %s", e)
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+def admin_authorized():
+    token = PROFILE_CONFIG['admin_token']
+    return not token or request.headers.get('X-Admin-Token') == token
+
+@app.route('/api/admin/profile', methods=['GET', 'POST'])
+def api_profile():
+    """管理接口：開啟接下來 N 個交易週期 / N 個請求的性能分析"""
+    if not admin_authorized():
+        return jsonify({'success': False, 'error': '未授權'}), 403
+    if request.method == 'GET':
+        return jsonify({'success': True, 'status': profiler.status()})
+    try:
+        data = request.get_json(silent=True) or {}
+        cycles = int(data.get('cycles', request.args.get('cycles', 0)))
+        requests_count = int(data.get('requests', request.args.get('requests', 0)))
+        return jsonify({'success': True, 'status': profiler.arm(cycles=cycles, requests=requests_count)})
+    except (TypeError, ValueError) as e:
+        return jsonify({'success': False, 'error': f"參數錯誤: {str(e)}"}), 400
+
+@app.route('/api/equity')
+def api_equity():
+    """
+    權益曲線：/api/equity?from=&to=&points=&method=lttb|minmax&exposure=0|1
+    from/to 支援秒、毫秒或 ISO 時間，返回降採樣後的列式數據
+    """
+    try:
+        series = default_account().equity.query(
+            start=equity.parse_time(request.args.get('from')),
+            end=equity.parse_time(request.args.get('to')),
+            points=request.args.get('points', type=int),
+            method=request.args.get('method', 'lttb'),
+            exposure=request.args.get('exposure', '1') != '0')
+        return jsonify(dict(series, success=True))
+    except ValueError as e:
+        return jsonify({'success': False, 'error': f"參數錯誤: {str(e)}"}), 400
+    except Exception as e:
+        logging.error("獲取權益曲線時出錯: %s", e)
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/execution')
+def api_execution():
+    """成交品質：每個交易對最近訂單的確認耗時、滑價與手續費匯總，以及最近的成交記錄"""
+    try:
+        limit = int(request.args.get('limit', EXECUTION_CONFIG['recent']))
+        return jsonify({'success': True, 'symbols': execution.summary(), 'recent': execution.recent(limit)})
+    except Exception as e:
+        logging.error("獲取成交品質數據時出錯: %s", e)
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/shadow')
+def api_shadow():
+    """影子評估：各組參數在實盤同一行情快照上的前向收益，按收益從高到低，附實盤同期收益"""
+    if not SHADOW_CONFIG['enabled']:
+        return jsonify({'success': False, 'error': '影子評估未啟用（SHADOW_ENABLED=1）'}), 404
+    try:
+        account = default_account()
+        return jsonify(dict(shadow.get_book(account).report(account), success=True))
+    except Exception as e:
+        logging.error("獲取影子評估結果時出錯: %s", e)
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/admin/shadow/reset', methods=['POST'])
+def api_shadow_reset():
+    """管理接口：清空影子持倉，下一個週期重新從實盤持倉開始"""
+    if not admin_authorized():
+        return jsonify({'success': False, 'error': '未授權'}), 403
+    shadow.get_book(default_account()).reset()
+    return jsonify({'success': True})
+
+@app.route('/api/admin/scheduler')
+def api_scheduler():
+    """管理接口：自適應輪詢的每幣種觸發距離、檢查間隔與請求預算使用情況"""
+    if not admin_authorized():
+        return jsonify({'success': False, 'error': '未授權'}), 403
+    return jsonify({'success': True, 'status': scheduler.get_scheduler().status()})
+
+@app.route('/api/admin/gateway')
+def api_gateway():
+    """管理接口：各交易所端點的熔斷狀態、延遲與超時"""
+    if not admin_authorized():
+        return jsonify({'success': False, 'error': '未授權'}), 403
+    return jsonify({'success': True, 'endpoints': gateway.stats()})
+
+@app.route('/api/admin/logging')
+def api_logging():
+    """管理接口：日誌隊列積壓與隊列已滿時丟棄的日誌條數"""
+    if not admin_authorized():
+        return jsonify({'success': False, 'error': '未授權'}), 403
+    return jsonify(dict(logging_stats(), success=True))
+
 def run_trade_strategy():
+    # 主帳戶與 OKX_SUB_ACCOUNTS 中配置的子帳戶在同一進程中運行，共用公共行情
+    load_accounts()
+    if SCHEDULER_CONFIG['enabled']:
+        # 自適應輪詢：接近觸發價的幣種幾秒檢查一次，遠離的幣種很少檢查，總請求數受預算限制
+        scheduler.get_scheduler().run()
+        return
     while True:
         try:
-            trade_strategy()            
-            # 保存持倉數據到 JSON 文件
-            save_trade_info_to_file(trade_info)
-            time.sleep(60)
+            run_all_accounts()  # 每個帳戶執行後各自保存持倉數據
+            commands.serve(60)  # 週期之間執行手動交易命令
         except Exception as e:
-            logging.error(f"交易策略執行錯誤: {str(e)}")
-            time.sleep(60)
+            logging.error("交易策略執行錯誤: %s", e)
+            commands.serve(60)
 
 # 在 Flask 啟動時啟動後台線程
 #@app.before_first_request FLASK 2.3.0以前版本
 def start_background_tasks():
     print("啟動後台任務...")
+    # 先從成交檢查點恢復所有帳戶的持倉，再開始交易與提供持倉數據
+    load_accounts()
+    recovery.recover_all()
     thread = threading.Thread(target=run_trade_strategy, daemon=True)
     thread.start()
 
@@ -473,4 +460,5 @@ def start_background_tasks():
 if __name__ == '__main__':
      # 在應用程序啟動時啟動後台任務
     start_background_tasks()
+    profiler.install_signal_handler()
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
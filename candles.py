@@ -0,0 +1,163 @@
+import time
+import threading
+import numpy as np
+from config import CANDLE_CONFIG
+
+MINUTE_MS = 60000
+TIMEFRAME_MS = {
+    '1m': MINUTE_MS, '5m': 5 * MINUTE_MS, '15m': 15 * MINUTE_MS, '30m': 30 * MINUTE_MS,
+    '1h': 60 * MINUTE_MS, '4h': 240 * MINUTE_MS, '1d': 1440 * MINUTE_MS
+}
+
+
+class MinuteRing:
+    """單個交易對的 1 分鐘K線環形緩衝區，欄位為 open/high/low/close/volume"""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.ts = np.zeros(capacity, dtype=np.int64)
+        self.bars = np.zeros((capacity, 5), dtype=float)
+        self.count = 0
+        self.head = 0  # 下一個寫入位置
+        self.last_cum_volume = None
+
+    def update(self, minute_ts, price, volume):
+        last = (self.head - 1) % self.capacity
+        if self.count and self.ts[last] == minute_ts:
+            bar = self.bars[last]
+            bar[1] = max(bar[1], price)
+            bar[2] = min(bar[2], price)
+            bar[3] = price
+            bar[4] += volume
+            return
+        if self.count and minute_ts < self.ts[last]:
+            return  # 亂序的舊報價直接丟棄
+        self.ts[self.head] = minute_ts
+        self.bars[self.head] = (price, price, price, price, volume)
+        self.head = (self.head + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def arrays(self):
+        """按時間順序返回 (ts, bars) 的副本"""
+        if self.count < self.capacity:
+            return self.ts[:self.count].copy(), self.bars[:self.count].copy()
+        return np.roll(self.ts, -self.head), np.roll(self.bars, -self.head, axis=0)
+
+
+_rings = {}
+_history = {}  # (symbol, timeframe) -> REST 回補的K線列表 [[ts, o, h, l, c, v], ...]
+_lock = threading.Lock()
+
+
+def on_tick(symbol, price, ts_ms=None, cum_volume=None):
+    """
+    記錄一筆報價到 1 分鐘K線
+    :param cum_volume: 24 小時累計成交量，用相鄰兩筆的差值近似本分鐘成交量
+    """
+    if not CANDLE_CONFIG['enabled'] or not price:
+        return
+    ts_ms = int(ts_ms or time.time() * 1000)
+    with _lock:
+        ring = _rings.get(symbol)
+        if ring is None:
+            ring = _rings[symbol] = MinuteRing(CANDLE_CONFIG['capacity_minutes'])
+        volume = 0.0
+        if cum_volume is not None:
+            if ring.last_cum_volume is not None:
+                volume = max(float(cum_volume) - ring.last_cum_volume, 0.0)
+            ring.last_cum_volume = float(cum_volume)
+        ring.update(ts_ms - ts_ms % MINUTE_MS, float(price), volume)
+
+
+def on_ticker(symbol, ticker):
+    """從 ccxt ticker 記錄報價"""
+    if ticker:
+        on_tick(symbol, ticker.get('last'), ticker.get('timestamp'), ticker.get('baseVolume'))
+
+
+def resample(ts, bars, frame_ms):
+    """
+    將 1 分鐘K線重採樣為 frame_ms 週期（UTC 對齊）
+    :return: ccxt 格式的 ndarray，每行為 [ts, open, high, low, close, volume]
+    """
+    if not len(ts):
+        return np.zeros((0, 6))
+    buckets = ts // frame_ms
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    ends = np.r_[starts[1:] - 1, len(ts) - 1]
+    out = np.empty((len(starts), 6))
+    out[:, 0] = buckets[starts] * frame_ms
+    out[:, 1] = bars[starts, 0]
+    out[:, 2] = np.maximum.reduceat(bars[:, 1], starts)
+    out[:, 3] = np.minimum.reduceat(bars[:, 2], starts)
+    out[:, 4] = bars[ends, 3]
+    out[:, 5] = np.add.reduceat(bars[:, 4], starts)
+    return out
+
+
+def _local_bars(symbol, frame_ms):
+    """
+    本地K線中可信的部分：只取最後一個缺口之後、且整個週期都被覆蓋的K線
+    :return: (K線 ndarray, 第一根可信K線的開盤時間)
+    """
+    ring = _rings.get(symbol)
+    if ring is None or not ring.count:
+        return np.zeros((0, 6)), None
+    with _lock:
+        ts, bars = ring.arrays()
+    if time.time() * 1000 - ts[-1] > CANDLE_CONFIG['max_gap_minutes'] * MINUTE_MS:
+        return np.zeros((0, 6)), None  # 報價已中斷，本地數據不再可信
+    gaps = np.flatnonzero(np.diff(ts) > CANDLE_CONFIG['max_gap_minutes'] * MINUTE_MS)
+    if len(gaps):
+        ts, bars = ts[gaps[-1] + 1:], bars[gaps[-1] + 1:]
+    first_complete = -(-int(ts[0]) // frame_ms) * frame_ms  # 向上取整到週期邊界
+    local = resample(ts, bars, frame_ms)
+    return local[local[:, 0] >= first_complete], first_complete
+
+
+def get_ohlcv(symbol, timeframe, limit, fetch):
+    """
+    獲取K線：優先使用本地 1 分鐘K線重採樣，只在本地數據覆蓋不到的區間調用 REST 回補
+    :param fetch: REST 回補函數 fetch(since, limit) -> ccxt 格式K線列表
+    :return: ccxt 格式K線列表
+    """
+    if not CANDLE_CONFIG['enabled']:
+        return fetch(None, limit)
+
+    frame_ms = TIMEFRAME_MS.get(timeframe)
+    if frame_ms is None:
+        return fetch(None, limit)
+
+    local, first_complete = _local_bars(symbol, frame_ms)
+    key = (symbol, timeframe)
+    history = _history.get(key) or []
+
+    if len(local):
+        # 本地K線之前還差 needed 根，只回補 first_complete 之前的這一段
+        needed = max(limit - len(local), 0)
+        older = [bar for bar in history if bar[0] < first_complete]
+        if needed and (len(older) < needed or older[-1][0] + frame_ms < first_complete):
+            older = [bar for bar in (fetch(first_complete - needed * frame_ms, needed) or []) if bar[0] < first_complete]
+            with _lock:
+                _history[key] = older
+        merged = older + local.tolist()
+    else:
+        # 還沒有本地報價：使用 REST K線，只有進入新週期後才增量獲取
+        now_bucket = int(time.time() * 1000) // frame_ms * frame_ms
+        if len(history) < limit:
+            history = fetch(None, limit) or []
+        elif history[-1][0] < now_bucket:
+            newer = fetch(history[-1][0], int((now_bucket - history[-1][0]) // frame_ms) + 1) or []
+            if newer:
+                history = [bar for bar in history if bar[0] < newer[0][0]] + newer
+        history = history[-max(limit, CANDLE_CONFIG['history_bars']):]
+        with _lock:
+            _history[key] = history
+        merged = history
+
+    return merged[-limit:]
+
+
+def buffer_stats():
+    """各交易對緩衝區的K線數量，用於監控"""
+    return {symbol: ring.count for symbol, ring in _rings.items()}
@@ -0,0 +1,182 @@
+import os
+import json
+import gzip
+import zlib
+import time
+import atexit
+import logging
+import threading
+from collections import deque
+from datetime import datetime
+import ccxt
+
+_ROUTED_PREFIXES = ('fetch', 'create', 'cancel', 'edit')
+
+
+def _routed(name):
+    return name.startswith(_ROUTED_PREFIXES) or name in ('load_markets', 'loadMarkets')
+
+
+def _key(method, args):
+    """請求匹配鍵：方法名 + 交易對（since 等時間參數在回放時不同，不參與匹配）"""
+    return method, args[0] if args and isinstance(args[0], str) else None
+
+
+class RecordingExchange:
+    """
+    錄製代理：轉發所有調用到真實客戶端，並把每次請求的參數、結果（或錯誤）與耗時
+    追加寫入 gzip 壓縮的 JSON lines 文件
+
+    每隔 flush_interval 秒結束當前 gzip 成員並重新以追加模式打開，文件始終由完整的成員組成，
+    進程崩潰或被殺時最多丟失最後一個間隔內的記錄
+    """
+
+    def __init__(self, client, path, flush_interval=1.0):
+        object.__setattr__(self, '_client', client)
+        object.__setattr__(self, '_path', path)
+        object.__setattr__(self, '_lock', threading.Lock())
+        object.__setattr__(self, '_started', time.monotonic())
+        object.__setattr__(self, '_last_flush', time.monotonic())
+        object.__setattr__(self, '_flush_interval', flush_interval)
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        object.__setattr__(self, '_file', gzip.open(path, 'at', encoding='utf-8'))
+        self._write({'meta': {'id': getattr(client, 'id', None), 'started': datetime.now().isoformat(),
+                              'has': dict(getattr(client, 'has', {}) or {})}})
+        atexit.register(self.close)
+        logging.info("交易所請求錄製已開啟: %s", path)
+
+    def _write(self, record):
+        line = json.dumps(record, ensure_ascii=False, default=str, separators=(',', ':'))
+        with self._lock:
+            self._file.write(line + '\n')
+            now = time.monotonic()
+            if now - self._last_flush >= self._flush_interval:
+                self._file.close()
+                object.__setattr__(self, '_file', gzip.open(self._path, 'at', encoding='utf-8'))
+                object.__setattr__(self, '_last_flush', now)
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if not callable(attr) or not _routed(name):
+            return attr
+
+        def recorded(*args, **kwargs):
+            offset = time.monotonic() - self._started
+            started = time.perf_counter()
+            record = {'t': round(offset, 4), 'm': name, 'a': args, 'kw': kwargs}
+            try:
+                result = attr(*args, **kwargs)
+                record['r'] = result
+                return result
+            except Exception as e:
+                record['e'] = [type(e).__name__, str(e)]
+                raise
+            finally:
+                record['dt'] = round(time.perf_counter() - started, 4)
+                self._write(record)
+        recorded.__name__ = name
+        return recorded
+
+    def __setattr__(self, name, value):
+        setattr(self._client, name, value)
+
+
+def load(path):
+    """
+    讀取錄製文件：返回 (meta, [record, ...])，多次錄製追加的文件會合併
+    進程崩潰時最後一個 gzip 成員可能沒有結束標記，保留在此之前讀取到的記錄
+    """
+    meta, records = {}, []
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        try:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break  # 進程崩潰時最後一行可能不完整
+                if 'meta' in record:
+                    meta = meta or record['meta']
+                else:
+                    records.append(record)
+        except (EOFError, gzip.BadGzipFile, zlib.error) as e:
+            logging.warning("錄製文件 %s 末尾不完整（%s），保留已讀取的 %s 條記錄", path, e, len(records))
+    return meta, records
+
+
+class ReplayExchange:
+    """
+    回放交易所：按錄製順序返回同一方法、同一交易對的結果或錯誤，沒有網路請求
+    :param speed: 1 為按錄製耗時回放，>1 為加速，0 為不等待
+    """
+
+    def __init__(self, path, speed=1.0):
+        meta, records = load(path)
+        self.id = meta.get('id') or 'replay'
+        self.has = meta.get('has') or {}
+        self.markets = None
+        self.currencies = None
+        self.timeout = 30000
+        self.speed = speed
+        self._queues = {}
+        self._last = {}
+        self._lock = threading.Lock()
+        self.counts = {'served': 0, 'reused': 0, 'missing': 0}
+        for record in records:
+            self._queues.setdefault(_key(record['m'], record.get('a') or []), deque()).append(record)
+        logging.info("交易所回放已載入 %s 個請求: %s", len(records), path)
+
+    def set_markets(self, markets, currencies=None):
+        self.markets = markets
+        self.currencies = currencies
+
+    def milliseconds(self):
+        return int(time.time() * 1000)
+
+    def _next(self, name, args):
+        key = _key(name, args)
+        with self._lock:
+            queue = self._queues.get(key)
+            if queue:
+                record = self._last[key] = queue.popleft()
+                self.counts['served'] += 1
+            else:
+                # 錄製中的請求已用完時重複最後一個結果，保證回放可以繼續並且結果確定
+                record = self._last.get(key)
+                self.counts['reused' if record else 'missing'] += 1
+        return record
+
+    def _serve(self, name, *args, **kwargs):
+        record = self._next(name, args)
+        if record is None:
+            raise ccxt.ExchangeNotAvailable(f"回放文件中沒有 {name} {args[:1]} 的請求")
+        if self.speed:
+            time.sleep(record.get('dt', 0) / self.speed)
+        if 'e' in record:
+            error_type, message = record['e']
+            error_class = getattr(ccxt, error_type, None)
+            if not (isinstance(error_class, type) and issubclass(error_class, Exception)):
+                error_class = ccxt.ExchangeError
+            raise error_class(message)
+        result = record.get('r')
+        if name in ('load_markets', 'loadMarkets') and isinstance(result, dict):
+            self.markets = result
+        return result
+
+    def __getattr__(self, name):
+        if not _routed(name):
+            raise AttributeError(name)
+
+        def replayed(*args, **kwargs):
+            return self._serve(name, *args, **kwargs)
+        replayed.__name__ = name
+        return replayed
+
+    def stats(self):
+        return dict(self.counts)
@@ -0,0 +1,279 @@
+"""
+手動交易命令隊列：Web 請求只把命令放入隊列並立即返回任務 ID，由交易引擎線程在週期之間執行，
+引擎是持倉狀態的唯一寫入者，手動操作不會與策略週期同時修改持倉
+"""
+import uuid
+import time
+import queue
+import logging
+import threading
+from collections import OrderedDict
+import ccxt
+import execution
+import gateway
+import recovery
+from config import COMMAND_CONFIG, first_position_amount, float_safe
+from utils import get_bollinger
+from accounts import default_account, get_account
+from market_data import check_liquidity, estimate_slippage, get_ticker
+from strategies.entry_strategy import open_position
+from strategies.exit_strategy import resolve_fill, calculate_target_price, _allocate_fill
+from strategies import take_profit_orders
+
+_queue = queue.Queue()
+_jobs = OrderedDict()   # job_id -> 任務狀態（最近 history 個）
+_events = {}            # job_id -> 完成事件
+_lock = threading.Lock()
+
+
+class CommandError(Exception):
+    """命令無法執行（如無持倉、流動性不足），任務標記為 failed，錯誤信息返回給前端"""
+
+
+def start_trading(currency, account):
+    """開始交易：設置等待開倉狀態，價格已觸及布林通道下軌時立即建立首倉"""
+    info = account.trade_info[currency]
+    bollinger = get_bollinger(f"{currency}/USDT", timeframe='1h', period=20, deviation=2)
+    if not bollinger:
+        raise CommandError(f"無法獲取 {currency} 的布林通道數據")
+    lower_band = bollinger['lower']
+
+    info['waiting_for_open'] = True
+    info['is_trading'] = True
+    account.save()
+
+    price = float(get_ticker(f"{currency}/USDT")['last'])
+    if price <= lower_band:
+        success, error_msg = open_position(currency, price, first_position_amount, account=account)
+        if success:
+            logging.info(" %s 開始交易，並立即開倉成功", currency)
+            info['waiting_for_open'] = False
+            account.save()
+            return {'message': f"開始交易成功，並立即開倉。當前價格: {price:.4f}，布林通道下軌價格: {lower_band:.4f} USDT"}
+        logging.info(" %s 開始交易，但無法立即開倉: %s", currency, error_msg)
+        return {'message': f"開始交易成功，等待合適的開倉條件。當前價格: {price:.4f}，布林通道下軌價格: {lower_band:.4f} USDT"}
+
+    logging.info(" %s 開始交易，等待合適的開倉條件", currency)
+    return {'message': f" {currency} 開始交易，等待合適的開倉條件。當前布林通道下軌價格: {lower_band:.4f} USDT"}
+
+
+def reconcile_balance(currency, account):
+    """
+    持倉記錄為空但交易所有該幣種可用餘額時（如在交易所手動買入），以當前價格建立初始倉位；
+    執行時重新查詢餘額，提交後已建倉的幣種不重複建立
+    """
+    info = account.trade_info[currency]
+    if info['positions']:
+        return {'message': f"{currency} 已有持倉記錄，無需對帳"}
+    amount = float(account.exchange.fetch_balance().get(currency, {}).get('free', 0))
+    if amount <= 0:
+        return {'message': f"{currency} 交易所無可用餘額"}
+    price = float(get_ticker(f"{currency}/USDT")['last'])
+    info['positions'].append({
+        'amount': amount,
+        'entry_price': price,
+        'target_price': calculate_target_price(currency, price),
+        'timestamp': time.time() * 1000,
+        'profit': 0.0
+    })
+    account.exposure.record_open(currency, amount, price)
+    info['is_trading'] = True
+    account.save()
+    logging.info("%s 按交易所餘額建立初始倉位: %.6f @ %.4f", currency, amount, price)
+    return {'message': f"{currency} 已按交易所餘額建立初始倉位 {amount:.6f} @ {price:.4f}"}
+
+
+def _clear(currency, account):
+    info = account.trade_info[currency]
+    info['positions'] = []
+    account.exposure.record_clear(currency)
+    info['is_trading'] = False
+    account.save()
+
+
+def close_all(currency, account, decided_at=None):
+    """賣出該幣種的全部倉位並結束交易（以下單前的買一價作為決策價格記錄滑價）"""
+    client = account.exchange
+    symbol = f"{currency}/USDT"
+    positions = account.trade_info[currency]['positions']
+    if not positions:
+        logging.error("%s 無持倉可賣出", currency)
+        raise CommandError(f"{currency} 無持倉可賣出")
+    if account.trade_info[currency].get('pending_reconcile'):
+        raise CommandError(f"{currency} 有結果未知的訂單待對帳，請稍後再試")
+    # 先撤銷交易所端止盈掛單，釋放被佔用的數量；撤單前已成交的部分已記帳
+    if any(position.get('tp_order') for position in positions):
+        take_profit_orders.release(currency, account)
+        positions = account.trade_info[currency]['positions']
+        if not positions:
+            _clear(currency, account)
+            return {'message': f"{currency} 倉位已由止盈掛單全部賣出"}
+    total_amount = sum(position.get('amount', 0) for position in positions)
+
+    ok, reason, snapshot = check_liquidity(symbol)
+    if not ok:
+        logging.warning("%s，跳過本次交易", reason)
+        raise CommandError(reason)
+    _, slippage_pct = estimate_slippage(snapshot, total_amount, 'sell')
+    if slippage_pct is not None:
+        logging.info("%s 全部賣出預估滑價: %.2f%%", currency, slippage_pct)
+
+    market = client.load_markets().get(symbol)
+    if market and total_amount < market['limits']['amount']['min']:
+        # 剩餘數量小於最小交易量，直接清空持倉並結束交易狀態
+        logging.warning("%s 交易量 %s 小於最小交易量 %s", currency, total_amount, market['limits']['amount']['min'])
+        _clear(currency, account)
+        return {'message': f"{currency} 剩餘數量小於最小交易量，已清空持倉"}
+
+    try:
+        ticket = execution.begin(symbol, 'sell', total_amount, snapshot['best_bid'],
+                                 source='close_all', account=account.name, decided_at=decided_at)
+        order = ticket.submit(client.create_market_sell_order, symbol, total_amount)
+    except gateway.OutcomeUnknown:
+        # 賣單可能已成交，不能重新提交：從成交記錄對帳，查到成交時回放到持倉
+        if not recovery.reconcile_unknown(account, currency):
+            raise CommandError(f"{currency} 賣單結果未知，已轉入對帳，請稍後確認持倉")
+        if account.trade_info[currency]['positions']:
+            return {'message': f"{currency} 賣單結果未知，對帳後仍有倉位未賣出"}
+        _clear(currency, account)
+        return {'message': f"{currency} 所有倉位已賣出（對帳確認）"}
+    except ccxt.ExchangeError as e:
+        if "Order amount should be greater than the minimum available amount" not in str(e):
+            raise
+        # 剩餘單位數的價值小於 0.05 USDT 時清空持倉並結束交易狀態
+        remaining_value = total_amount * float(client.fetch_ticker(symbol)['last'])
+        if remaining_value >= 0.05:
+            raise CommandError(f"{currency} 剩餘數量價值大於 0.05 USDT，無法清空持倉")
+        _clear(currency, account)
+        return {'message': f"{currency} 剩餘數量價值小於 0.05 USDT，已清空持倉"}
+    logging.info("%s 所有倉位已賣出: %s", currency, order)
+
+    # 按實際成交數量依倉位順序分配，已實現收益計入收益帳本
+    filled, fill_price = resolve_fill(order, symbol, total_amount, snapshot['best_bid'], client=client, ticket=ticket)
+    if filled <= 0:
+        raise CommandError(f"{currency} 賣單 {order.get('id')} 未成交，倉位保持不變")
+    realized = _allocate_fill(account, currency, {'positions': list(positions)}, filled, fill_price)
+    account.mark_applied(currency, order)
+    remaining = total_amount - filled
+    if remaining <= total_amount * 1e-9:
+        _clear(currency, account)
+        return {'message': f"{currency} 所有倉位已賣出", 'fill_price': fill_price, 'realized': realized}
+    # 部分成交：未賣出的數量保留在倉位中，交易狀態不變
+    account.save()
+    logging.warning("%s 全部賣出只成交 %.6f / %.6f，剩餘 %.6f 保留在倉位中", currency, filled, total_amount, remaining)
+    return {'message': f"{currency} 只成交 {filled:.6f}，剩餘 {remaining:.6f} 未賣出",
+            'fill_price': fill_price, 'realized': realized, 'filled': filled, 'remaining': remaining}
+
+
+HANDLERS = {
+    'start_trading': start_trading,
+    'close_all': close_all,
+    'reconcile_balance': reconcile_balance
+}
+
+
+def submit(kind, currency, account=None, **params):
+    """放入隊列並返回任務 ID（不等待執行）"""
+    job_id = uuid.uuid4().hex[:12]
+    job = {
+        'id': job_id,
+        'kind': kind,
+        'currency': currency,
+        'account': account or default_account().name,
+        'params': params,
+        'status': 'queued',
+        'result': None,
+        'error': None,
+        'created_at': time.time(),
+        'started_at': None,
+        'finished_at': None
+    }
+    with _lock:
+        _jobs[job_id] = job
+        _events[job_id] = threading.Event()
+        while len(_jobs) > COMMAND_CONFIG['history']:
+            old_id, _ = _jobs.popitem(last=False)
+            _events.pop(old_id, None)
+    _queue.put(job_id)
+    logging.info("命令 %s %s 已排隊（任務 %s）", kind, currency, job_id)
+    return job_id
+
+
+def _execute(job_id):
+    with _lock:
+        job = _jobs.get(job_id)
+        event = _events.get(job_id)
+    if job is None:
+        return
+    job['status'] = 'running'
+    job['started_at'] = time.time()
+    try:
+        account = get_account(job['account']) or default_account()
+        job['result'] = HANDLERS[job['kind']](job['currency'], account, **job['params'])
+        job['status'] = 'done'
+    except CommandError as e:
+        job['error'] = str(e)
+        job['status'] = 'failed'
+    except Exception as e:
+        logging.error("命令 %s %s 執行失敗: %s", job['kind'], job['currency'], e)
+        job['error'] = str(e)
+        job['status'] = 'failed'
+    job['finished_at'] = time.time()
+    logging.info("任務 %s %s，耗時 %.2f 秒", job_id, job['status'], job['finished_at'] - job['started_at'])
+    if event:
+        event.set()
+
+
+def drain():
+    """執行隊列中已有的全部命令（引擎線程調用），返回已執行的任務"""
+    executed = []
+    while True:
+        try:
+            job_id = _queue.get_nowait()
+        except queue.Empty:
+            return executed
+        _execute(job_id)
+        executed.append(_jobs.get(job_id))
+
+
+def serve(timeout, stop=None):
+    """
+    代替引擎週期之間的休眠：最多等待 timeout 秒，有命令到達時執行完隊列中的命令後立即返回，
+    讓引擎盡快以新狀態運行下一個週期；stop（threading.Event）被設置時提前返回
+    :return: 已執行的任務
+    """
+    deadline = time.monotonic() + timeout
+    while not (stop and stop.is_set()):
+        executed = drain()
+        if executed:
+            return executed
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return []
+        try:
+            job_id = _queue.get(timeout=min(remaining, 1.0))
+        except queue.Empty:
+            continue
+        _execute(job_id)
+        return [_jobs.get(job_id)] + drain()
+    return []
+
+
+def status(job_id, wait=0):
+    """任務狀態；wait > 0 時最多等待 wait 秒直到任務完成（長輪詢）"""
+    with _lock:
+        job = _jobs.get(job_id)
+        event = _events.get(job_id)
+    if job is None:
+        return None
+    if wait and event:
+        event.wait(min(wait, COMMAND_CONFIG['max_wait']))
+    result = dict(job)
+    result['queue_position'] = _queue.qsize() if job['status'] == 'queued' else 0
+    return result
+
+
+def recent(limit=20):
+    """最近的任務，最新的在前"""
+    with _lock:
+        return [dict(job) for job in list(_jobs.values())[::-1][:limit]]
@@ -12,8 +12,8 @@ okx_api_key = os.getenv('OKX_API_KEY')
 okx_secret_key = os.getenv('OKX_SECRET_KEY')
 okx_passphrase = os.getenv('OKX_PASSPHRASE')
 
-# 驗證API憑證是否存在
-if not all([okx_api_key, okx_secret_key, okx_passphrase]):
+# 驗證API憑證是否存在（回放與模擬交易所不連網，不需要憑證）
+if not all([okx_api_key, okx_secret_key, okx_passphrase]) and os.getenv('EXCHANGE_MODE', 'live') not in ('replay', 'fake'):
     logging.error("缺少必要的API憑證")
     raise ValueError("缺少必要的API憑證，請檢查.env文件")
 
@@ -24,6 +24,12 @@ max_positions = 12
 total_investment_limit = 3000
 first_position_amount = 30  # 首倉固定買入金額
 
+# 建倉/止盈規則參數（strategies/kernel.py 使用）
+strategy_params = {
+    'take_profit_pct': 3.0,   # 止盈漲幅 (3%)
+    'ladder_drop_pct': 6.0    # 加倉所需相對上一倉位的跌幅 (6%)
+}
+
 # config.py
 cached_prices = {}  # 全局變量，用於存儲緩存價格
 
@@ -51,7 +57,62 @@ rebalance_params = {
     'min_profit': 2.5,  # 最小獲利比例 (0.5%)
     'sell_ratio_range': (0.05, 0.1),  # 賣出比例範圍 (5-10%)
     'min_amount': 0.0001,  # 最小交易數量
-    'profit_share': 0.5  # 用於補充虧損的收益比例 (50%)
+    'profit_share': 0.5,  # 用於補充虧損的收益比例 (50%)
+    'max_workers': 4  # 執行再平衡計劃時的最大並發下單數
+}
+
+# 行情快照緩存與流動性檢查參數
+MARKET_DATA_CONFIG = {
+    'book_depth': 20,          # 訂單簿快照檔位數
+    'book_ttl': 5,             # 訂單簿快照有效期（秒）
+    'ticker_ttl': 5,           # 行情快照有效期（秒）
+    'max_spread_pct': 1.0,     # 最大買賣差價 (1%)
+    'min_quote_volume': 100000,  # 最小 24 小時成交額 (USDT)
+    'max_slippage_pct': 0.5    # 最大預估滑價 (0.5%)
+}
+
+# 本地K線構建參數（由行情報價構建 1 分鐘K線，再重採樣為 1h/4h/1d）
+CANDLE_CONFIG = {
+    'enabled': True,
+    'capacity_minutes': 60 * 24 * 32,  # 每個交易對保留的 1 分鐘K線數量（約 32 天，足夠 20 日布林通道）
+    'max_gap_minutes': 5,              # 相鄰報價間隔超過此值視為缺口，缺口之前的數據改用 REST 回補
+    'history_bars': 200                # 每個週期保留的 REST 回補K線數量
+}
+
+# 全市場掃描參數（篩選門檻沿用 MARKET_DATA_CONFIG 的成交額與買賣差價）
+SCANNER_CONFIG = {
+    'timeframe': '1h',       # 布林通道/波動率使用的K線週期
+    'scan_interval': 60,     # 兩次掃描的最短間隔（秒）
+    'max_symbols': 600,      # 參與評分的交易對上限（按成交額排序）
+    'ohlcv_budget': 40,      # 每次掃描最多發出的K線請求數，其餘交易對下次再刷新
+    'exclude': ['USDC', 'DAI', 'TUSD', 'FDUSD', 'PYUSD']  # 穩定幣不參與掃描
+}
+
+# 子帳戶設置：OKX_SUB_ACCOUNTS=sub1,sub2，每個子帳戶讀取 OKX_API_KEY_SUB1 / OKX_SECRET_KEY_SUB1 / OKX_PASSPHRASE_SUB1
+ACCOUNTS_CONFIG = [
+    {
+        'name': name,
+        'api_key': os.getenv(f"OKX_API_KEY_{name.upper()}"),
+        'secret_key': os.getenv(f"OKX_SECRET_KEY_{name.upper()}"),
+        'passphrase': os.getenv(f"OKX_PASSPHRASE_{name.upper()}"),
+        'state_file': f"trade_info_{name}.json"
+    }
+    for name in filter(None, (n.strip() for n in os.getenv('OKX_SUB_ACCOUNTS', '').split(',')))
+]
+
+# 止盈出場參數
+EXIT_CONFIG = {
+    'batch_orders': True,  # 多個幣種同時觸發止盈時使用 OKX 批量下單
+    'batch_limit': 20      # OKX 單次批量下單最多 20 張
+}
+
+# 交易所端止盈掛單：建倉後立即在 target_price 掛出止盈單，成交由掛單狀態同步記帳，
+# 有掛單的倉位不再由每個週期的價格輪詢檢查止盈
+RESTING_TP_CONFIG = {
+    'enabled': os.getenv('RESTING_TAKE_PROFIT', '0') == '1',
+    'mode': os.getenv('RESTING_TAKE_PROFIT_MODE', 'limit'),  # 'limit' 限價賣單；'algo' OKX 止盈委託（觸發後市價賣出）
+    'sync_interval': 15,     # 掛單狀態同步間隔（秒），每次同步只請求一次未成交訂單列表
+    'retry_interval': 300    # 掛單失敗（如手續費扣減了基礎幣種數量）後的重試間隔（秒），期間該倉位由輪詢止盈
 }
 
 # 系統設置
@@ -63,11 +124,125 @@ SYSTEM_CONFIG = {
     'debug_mode': True   # 調試模式開關
 }
 
+# 重啟恢復：從成交檢查點之後的成交回放持倉
+RECOVERY_CONFIG = {
+    'overlap_seconds': 300,      # 從檢查點往前多掃描的時間，按訂單號去重
+    'bootstrap_days': 7,         # 沒有檢查點且沒有持倉時，從多少天前的成交重建
+    'max_order_ids': 200,        # 每個幣種保留的已處理訂單號數量
+    'unknown_grace_seconds': 120  # 下單結果未知時，超過多少秒仍查不到成交視為訂單未執行
+}
+
+# 收益帳本：各粒度保留的桶數量
+PNL_CONFIG = {
+    'hour_retention': 72,
+    'day_retention': 400,
+    'month_retention': 120
+}
+
+# 交易所模式：live 直接連線；record 連線並錄製所有請求；replay 從錄製文件回放，不連網；
+# fake 使用記憶體內的模擬交易所（壓力測試用）
+CASSETTE_CONFIG = {
+    'mode': os.getenv('EXCHANGE_MODE', 'live'),
+    'path': os.getenv('CASSETTE_FILE', 'logs/cassettes/exchange.jsonl.gz'),
+    'speed': float(os.getenv('REPLAY_SPEED', '1')),  # 回放速度：1 為原速，0 為不等待
+    'fake_latency': float(os.getenv('FAKE_EXCHANGE_LATENCY', '0'))  # 模擬交易所每次請求的平均延遲（秒）
+}
+
+# 交易所請求 gateway：熔斷、自適應超時與只讀請求對沖
+GATEWAY_CONFIG = {
+    'min_timeout': 2,            # 自適應超時下限（秒）
+    'max_timeout': 15,           # 自適應超時上限，也是下單類請求的超時（秒）
+    'timeout_multiplier': 3,     # 超時 = 最近延遲 p95 × 倍數
+    'latency_window': 100,       # 每個端點保留的延遲樣本數
+    'min_samples': 20,           # 樣本數達到後才啟用自適應超時與對沖
+    'call_budget': 20,           # 單次只讀調用含重試的總時限（秒）
+    'failure_threshold': 5,      # 連續失敗次數達到後熔斷
+    'cooldown': 30,              # 熔斷持續時間（秒）
+    'max_inflight': 4,           # 每個端點同時進行中的請求上限
+    'pool_size': 32,             # gateway 共用線程數
+    'hedge_reads': True,         # 只讀請求超過延遲分位數時發出對沖請求
+    'hedge_percentile': 95,
+    'min_hedge_delay': 0.3       # 對沖等待下限（秒）
+}
+
+# 成交品質追蹤：每張訂單的決策/提交/確認時間、成交均價、手續費與相對決策價格的滑價
+EXECUTION_CONFIG = {
+    'path': 'logs/executions.jsonl',  # 每張訂單一行的成交記錄
+    'window': 200,                    # 每個交易對滾動匯總保留的訂單數
+    'recent': 50                      # 接口返回的最近訂單數
+}
+
+# 自適應輪詢：按價格到最近觸發價（止盈、下一加倉價、布林下軌）的距離與近期波動率安排每個幣種的檢查時間，
+# 所有輪詢共用每分鐘請求預算
+SCHEDULER_CONFIG = {
+    'enabled': True,
+    'requests_per_minute': 12,    # 行情輪詢的全局請求預算（批量行情每次算 1 個請求）
+    'min_interval': 3,            # 最熱門幣種的檢查間隔下限（秒）
+    'max_interval': 300,          # 遠離所有觸發價的幣種的檢查間隔上限（秒）
+    'time_fraction': 0.05,        # 檢查間隔 = 預期觸及時間 (距離/波動率)^2 × 此比例
+    'default_hourly_vol': 0.01,   # 沒有足夠報價時假設的每小時波動率（1%）
+    'vol_halflife': 30,           # 波動率 EWMA 的半衰期（樣本數）
+    'band_ttl': 300,              # 布林通道下軌的重新計算間隔（秒）
+    'idle_sleep': 0.5             # 主循環最短休眠（秒）
+}
+
+# 分片運行：幣種按持倉數分配到多個工作進程，每個進程有自己的交易所客戶端與持倉文件，
+# 全局 total_investment_limit 由協調器以額度預留的方式分配，本地額度足夠時建倉不需要與協調器通信
+SHARDING_CONFIG = {
+    'workers': max(1, min(4, os.cpu_count() or 1)),  # 預設工作進程數
+    'lease_chunk': 150,              # 每次向協調器申請 / 保留的額度（USDT）
+    'merge_interval': 30,            # 協調器把各分片持倉合併回主持倉文件的間隔（秒）
+    'map_file': 'sharding.json'      # 幣種分配表
+}
+
+# 手動交易命令隊列：開始交易 / 關閉交易由交易引擎線程在週期之間執行，請求只返回任務 ID
+COMMAND_CONFIG = {
+    'history': 200,   # 保留最近的任務狀態數量
+    'max_wait': 25    # 任務狀態長輪詢的最長等待（秒）
+}
+
+# 影子評估：K 組參數在實盤同一個行情快照上各自維護虛擬持倉（不下單），一次數組運算完成，
+# 從啟動時的實盤持倉出發比較各組參數的前向收益；網格為 ladder_drop_pct × take_profit_pct 的組合
+SHADOW_CONFIG = {
+    'enabled': os.getenv('SHADOW_ENABLED', '0') == '1',
+    'grid': {
+        'ladder_drop_pct': [3.0, 4.0, 5.0, 6.0, 7.0, 8.0, 10.0],
+        'take_profit_pct': [1.5, 2.0, 2.5, 3.0, 4.0, 5.0]
+    },
+    'variants': [],             # 額外的參數組，如 {'ladder_drop_pct': 6, 'take_profit_pct': 3, 'amount': 50}
+    'fee_rate': 0.001,          # 虛擬成交的手續費率（雙邊）
+    'band_ttl': 300,            # 布林通道下軌緩存（秒）
+    'save_interval': 60         # 虛擬持倉保存間隔（秒）
+}
+
+# 權益曲線：每個交易週期追加組合價值、USDT 餘額與各幣種持倉市值（定長二進位文件）
+EQUITY_CONFIG = {
+    'min_interval': 30,       # 兩個樣本之間的最短間隔（秒）
+    'default_points': 500,    # /api/equity 預設返回的點數
+    'max_points': 5000        # /api/equity 返回點數上限
+}
+
+# 性能分析設置（預設關閉，透過 /api/admin/profile 或 SIGUSR1 開啟）
+PROFILE_CONFIG = {
+    'output_dir': 'logs/profiles',  # 報告輸出目錄
+    'tracemalloc': True,            # 是否同時記錄記憶體快照差異
+    'tracemalloc_frames': 10,       # tracemalloc 保存的堆疊深度
+    'top_n': 40,                    # 報告中列出的函數 / 記憶體行數
+    'signal_cycles': 3,             # 收到 SIGUSR1 後分析的週期數
+    'admin_token': os.getenv('ADMIN_TOKEN')  # 設置後管理接口需帶 X-Admin-Token
+}
+
 # 日誌設置
 LOG_CONFIG = {
-    'filename': 'logs/trading.log',
-    'format': '%(asctime)s - %(levelname)s - %(message)s',
-    'level': logging.INFO
+    'filename': os.getenv('LOG_FILE', 'logs/trading.jsonl'),  # JSON-lines 日誌文件
+    'format': '%(asctime)s - %(levelname)s - %(message)s',  # 控制台輸出格式
+    'level': logging.INFO,
+    'max_bytes': 20 * 1024 * 1024,  # 單個日誌文件上限，超過後輪替並 gzip 壓縮
+    'backup_count': 10,             # 保留的壓縮日誌數量
+    'queue_size': 10000,            # 日誌隊列長度，滿了直接丟棄，不阻塞交易線程
+    'sample_interval': 60,          # 重複日誌限流窗口（秒），0 表示不限流
+    'sample_burst': 20,             # 每個調用位置在窗口內最多輸出的 INFO 條數
+    'console': True                 # 是否同時輸出到控制台
 }
 
 def initialize_trade_info():
@@ -81,15 +256,20 @@ def initialize_trade_info():
         'last_rebalance_time': None,
         'rebalance_count': 0,
         'is_trading': False,  # 是否正在交易
-        'waiting_for_open': False  # 是否在等待開倉
+        'waiting_for_open': False,  # 是否在等待開倉
+        'fill_checkpoint': {'timestamp': None, 'order_ids': []},  # 已反映到持倉的最後成交
+        'pending_reconcile': None  # 下單結果未知時的待對帳標記 {'since': 毫秒時間戳}，對帳前暫停該幣種下單
     } for currency in supported_currencies}
 
 # 定義 JSON 文件路徑
-TRADE_INFO_FILE = 'trade_info.json'
+TRADE_INFO_FILE = os.getenv('TRADE_INFO_FILE', 'trade_info.json')  # 分片模式下每個工作進程使用自己的文件
 
-def save_trade_info_to_file(trade_info):
+def save_trade_info_to_file(trade_info, path=None):
+    path = path or TRADE_INFO_FILE
+    tmp = path + '.tmp'
     try:
-        with open(TRADE_INFO_FILE, 'w', encoding='utf-8') as f:
+        # 先寫臨時文件再原子替換，其他進程（分片協調器合併）不會讀到寫了一半的文件
+        with open(tmp, 'w', encoding='utf-8') as f:
             data_to_save = {
                 currency: {
                     'positions': [
@@ -98,7 +278,8 @@ def save_trade_info_to_file(trade_info):
                             'amount': float_safe(position.get('amount', 0)),
                             'target_price': float_safe(position.get('target_price', 0)),
                             'profit': float_safe(position.get('profit', 0)),
-                            'timestamp': position.get('timestamp', datetime.now().timestamp() * 1000)  # 設置默認值
+                            'timestamp': position.get('timestamp', datetime.now().timestamp() * 1000),  # 設置默認值
+                            'tp_order': position.get('tp_order')  # 交易所端止盈掛單
                         }
                         for position in info['positions']
                     ],
@@ -109,19 +290,27 @@ def save_trade_info_to_file(trade_info):
                     'last_rebalance_time': info.get('last_rebalance_time', None),
                     'rebalance_count': info.get('rebalance_count', 0),
                     'is_trading': info.get('is_trading', False),
-                    'waiting_for_open': info.get('waiting_for_open', False)
+                    'waiting_for_open': info.get('waiting_for_open', False),
+                    'fill_checkpoint': info.get('fill_checkpoint', {'timestamp': None, 'order_ids': []}),
+                    'pending_reconcile': info.get('pending_reconcile')
                 }
                 for currency, info in trade_info.items()
             }
             json.dump(data_to_save, f, ensure_ascii=False, indent=4, default=str)
-        logging.info("持倉數據已成功保存到 JSON 文件")
+        os.replace(tmp, path)
+        logging.debug("持倉數據已成功保存到 JSON 文件")
     except Exception as e:
-        logging.error(f"保存持倉數據到 JSON 文件失敗: {str(e)}")
+        logging.error("保存持倉數據到 JSON 文件失敗: %s", e)
 
-def load_trade_info_from_file():
+def load_trade_info_from_file(path=None, strict=False):
+    """
+    從 JSON 文件加載持倉
+    :param strict: 為 True 時文件不存在或讀取失敗拋出異常，而不是返回空白的 trade_info
+    """
+    path = path or TRADE_INFO_FILE
     try:
-        if os.path.exists(TRADE_INFO_FILE):
-            with open(TRADE_INFO_FILE, 'r', encoding='utf-8') as f:
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
                 loaded_data = json.load(f)
                 trade_info = initialize_trade_info()
                 for currency, info in loaded_data.items():
@@ -132,7 +321,8 @@ def load_trade_info_from_file():
                                 'amount': float_safe(position.get('amount', 0)),
                                 'target_price': float_safe(position.get('target_price', 0)),
                                 'profit': float_safe(position.get('profit', 0)),
-                                'timestamp': position.get('timestamp', datetime.now().timestamp() * 1000)  # 設置默認值
+                                'timestamp': position.get('timestamp', datetime.now().timestamp() * 1000),  # 設置默認值
+                                'tp_order': position.get('tp_order')  # 交易所端止盈掛單
                             }
                             for position in info.get('positions', [])
                         ]
@@ -144,13 +334,20 @@ def load_trade_info_from_file():
                         trade_info[currency]['rebalance_count'] = info.get('rebalance_count', 0)
                         trade_info[currency]['is_trading'] = info.get('is_trading', False)
                         trade_info[currency]['waiting_for_open'] = info.get('waiting_for_open', False)
+                        if info.get('fill_checkpoint'):
+                            trade_info[currency]['fill_checkpoint'] = info['fill_checkpoint']
+                        trade_info[currency]['pending_reconcile'] = info.get('pending_reconcile')
                 logging.info("持倉數據已成功從 JSON 文件加載")
                 return trade_info
         else:
+            if strict:
+                raise FileNotFoundError(path)
             logging.warning("JSON 文件不存在，初始化新的 trade_info")
             return initialize_trade_info()
     except Exception as e:
-        logging.error(f"從 JSON 文件加載持倉數據失敗: {str(e)}")
+        logging.error("從 JSON 文件加載持倉數據失敗: %s", e)
+        if strict:
+            raise
         return initialize_trade_info()
 
 def float_safe(value):
@@ -0,0 +1,269 @@
+"""
+交易引擎命令行入口（不載入 Flask）：
+    python engine.py                          # 按 update_interval 持續運行，Ctrl-C 退出
+    python engine.py --once --dry-run         # 以當前持倉跑一個週期，只記錄會下的訂單
+    python engine.py --cycles 20 --interval 0 --exchange paper --profile
+    python engine.py --cycles 50 --interval 0 --exchange replay --cassette logs/cassettes/exchange.jsonl.gz
+退出時打印每個週期的耗時匯總
+"""
+import os
+import sys
+import glob
+import time
+import shutil
+import signal
+import logging
+import argparse
+import tempfile
+
+# --exchange 對應 config.CASSETTE_CONFIG['mode']，必須在導入 config 之前設置
+EXCHANGE_MODES = {'live': 'live', 'paper': 'fake', 'replay': 'replay'}
+
+
+class DryRunClient:
+    """
+    不下單的客戶端代理：行情與查詢照常轉發，下單類請求按當前價格模擬立即成交並記錄
+    （不能立即成交的限價單與止盈委託只記錄為掛單），
+    策略與持倉更新走和實盤相同的路徑
+    """
+
+    def __init__(self, client):
+        object.__setattr__(self, '_client', client)
+        object.__setattr__(self, 'orders', [])
+
+    def _simulate(self, symbol, type, side, amount, price=None, params={}):
+        last = float(self._client.fetch_ticker(symbol)['last'])
+        trigger = params.get('takeProfitPrice')
+        # 不能立即成交的限價單與止盈委託只記錄為掛單，不模擬成交
+        resting = trigger or (type == 'limit' and price is not None and (price > last if side == 'sell' else price < last))
+        fill_price = last if price is None else price
+        order = {
+            'id': f"dry-{len(self.orders) + 1}", 'symbol': symbol, 'type': type, 'side': side,
+            'status': 'open' if resting else 'closed', 'timestamp': int(time.time() * 1000),
+            'amount': amount, 'filled': 0.0 if resting else amount, 'remaining': amount if resting else 0.0,
+            'price': price, 'average': None if resting else fill_price,
+            'cost': 0.0 if resting else amount * fill_price, 'fee': None
+        }
+        self.orders.append(order)
+        if resting:
+            logging.info("[dry-run] 掛單 %s %s %.6f @ %.6f（未下單）", side, symbol, amount, trigger or price)
+        else:
+            logging.info("[dry-run] %s %s %.6f @ %.6f（未下單）", side, symbol, amount, fill_price)
+        return order
+
+    def create_order(self, symbol, type, side, amount, price=None, params={}):
+        return self._simulate(symbol, type, side, amount, price, params)
+
+    def create_market_buy_order(self, symbol, amount, params={}):
+        return self._simulate(symbol, 'market', 'buy', amount)
+
+    def create_market_sell_order(self, symbol, amount, params={}):
+        return self._simulate(symbol, 'market', 'sell', amount)
+
+    def create_limit_buy_order(self, symbol, amount, price, params={}):
+        return self._simulate(symbol, 'limit', 'buy', amount, price)
+
+    def create_limit_sell_order(self, symbol, amount, price, params={}):
+        return self._simulate(symbol, 'limit', 'sell', amount, price)
+
+    def create_orders(self, orders, params={}):
+        return [self._simulate(o['symbol'], o['type'], o['side'], o['amount'], o.get('price')) for o in orders]
+
+    def _dry_order(self, id):
+        return next((order for order in self.orders if order['id'] == id), None)
+
+    def cancel_order(self, id, symbol=None, params={}):
+        logging.info("[dry-run] 撤銷訂單 %s %s（未發送）", id, symbol or '')
+        order = self._dry_order(id)
+        if order is not None and order['status'] == 'open':
+            order['status'] = 'canceled'
+        return {'id': id, 'symbol': symbol, 'status': 'canceled'}
+
+    def cancel_orders(self, ids, symbol=None, params={}):
+        return [self.cancel_order(id, symbol) for id in ids]
+
+    def edit_order(self, id, symbol, type, side, amount=None, price=None, params={}):
+        logging.info("[dry-run] 修改訂單 %s %s（未發送）", id, symbol)
+        order = self._dry_order(id)
+        if order is not None and order['status'] == 'open':
+            order.update(amount=amount or order['amount'], remaining=amount or order['amount'], price=price or order['price'])
+            return dict(order)
+        return {'id': id, 'symbol': symbol, 'type': type, 'side': side, 'amount': amount, 'price': price, 'status': 'open'}
+
+    def fetch_open_orders(self, symbol=None, since=None, limit=None, params={}):
+        return [dict(order) for order in self.orders
+                if order['status'] == 'open' and (symbol is None or order['symbol'] == symbol)]
+
+    def fetch_order(self, id, symbol=None, params={}):
+        order = self._dry_order(id)
+        if order is not None:
+            return dict(order)
+        return self._client.fetch_order(id, symbol, params)
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._client, name, value)
+
+
+def _prepare_workdir(args):
+    """
+    切換到狀態目錄（持倉、收益帳本、權益曲線與日誌都相對當前目錄）：
+    模擬盤預設使用 paper/；dry-run 把狀態文件複製到臨時目錄，不改動原文件
+    """
+    state_dir = os.path.abspath(args.state_dir or ('paper' if args.exchange == 'paper' else '.'))
+    os.makedirs(state_dir, exist_ok=True)
+    if not args.dry_run:
+        os.chdir(state_dir)
+        return state_dir, None
+    workdir = tempfile.mkdtemp(prefix='engine-dry-run-')
+    for path in glob.glob(os.path.join(state_dir, 'trade_info*')):
+        if os.path.isfile(path):
+            shutil.copy2(path, workdir)
+    os.chdir(workdir)
+    return state_dir, workdir
+
+
+def _percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    k = min(len(ordered) - 1, max(0, int(round(pct / 100 * (len(ordered) - 1)))))
+    return ordered[k]
+
+
+def print_summary(cycles, started, dry_run_orders=None, profile_status=None):
+    """每個週期的耗時匯總（秒），以及交易所調用次數"""
+    print(f"\n引擎運行 {time.perf_counter() - started:.1f} 秒，完成 {len(cycles)} 個週期")
+    if cycles:
+        print(f"{'':<10}{'平均':>10}{'p50':>10}{'p95':>10}{'最大':>10}")
+        for key, label in (('total', '週期'), ('prices', '行情'), ('strategy', '策略')):
+            values = [c[key] for c in cycles]
+            print(f"{label:<10}{sum(values) / len(values):>10.3f}{_percentile(values, 50):>10.3f}"
+                  f"{_percentile(values, 95):>10.3f}{max(values):>10.3f}")
+        calls = [c['exchange_calls'] for c in cycles]
+        print(f"每週期交易所調用: 平均 {sum(calls) / len(calls):.1f}，最大 {max(calls)}")
+        errors = sum(1 for c in cycles if c.get('error'))
+        if errors:
+            print(f"失敗週期: {errors}")
+    if dry_run_orders is not None:
+        print(f"dry-run 模擬訂單 {len(dry_run_orders)} 張")
+        for order in dry_run_orders[-20:]:
+            price = order['average'] or order['price'] or 0.0
+            print(f"  {order['side']:<4} {order['symbol']:<12} {order['amount']:.6f} @ {price:.6f}"
+                  + ('（掛單）' if order['status'] == 'open' else ''))
+    if profile_status:
+        print(f"性能分析報告目錄: {os.path.abspath(profile_status['output_dir'])}")
+        for name in profile_status['files'][-10:]:
+            if name.endswith('.txt'):
+                print(f"  {name}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='交易引擎（不啟動 Web 服務）')
+    parser.add_argument('--once', action='store_true', help='只執行一個週期')
+    parser.add_argument('--cycles', type=int, default=0, help='執行 N 個週期後退出，0 為持續運行')
+    parser.add_argument('--interval', type=float, help='週期間隔（秒），預設為 SYSTEM_CONFIG["update_interval"]')
+    parser.add_argument('--dry-run', action='store_true', help='不下單：下單請求按當前價格模擬成交，狀態寫入臨時目錄')
+    parser.add_argument('--profile', action='store_true', help='對週期進行 cProfile 分析，報告寫入 PROFILE_CONFIG["output_dir"]')
+    parser.add_argument('--exchange', choices=sorted(EXCHANGE_MODES), default=None,
+                        help='live 實盤；paper 模擬交易所；replay 回放錄製文件（預設沿用 EXCHANGE_MODE）')
+    parser.add_argument('--cassette', help='replay 使用的錄製文件，預設為 CASSETTE_FILE')
+    parser.add_argument('--replay-speed', type=float, help='回放速度，0 為不等待')
+    parser.add_argument('--state-dir', help='狀態文件目錄，預設為當前目錄（paper 為 paper/）')
+    parser.add_argument('--no-recover', action='store_true', help='啟動時不從成交檢查點恢復持倉')
+    args = parser.parse_args(argv)
+    cycles_limit = 1 if args.once else max(0, args.cycles)
+
+    if args.exchange:
+        os.environ['EXCHANGE_MODE'] = EXCHANGE_MODES[args.exchange]
+    if args.cassette:
+        os.environ['CASSETTE_FILE'] = os.path.abspath(args.cassette)
+    if args.replay_speed is not None:
+        os.environ['REPLAY_SPEED'] = str(args.replay_speed)
+    state_dir, dry_run_dir = _prepare_workdir(args)
+
+    # 導入順序：環境變量與工作目錄確定後再載入配置、交易所與策略
+    from config import SYSTEM_CONFIG, CASSETTE_CONFIG, PROFILE_CONFIG
+    import gateway
+    import profiler
+    import recovery
+    from accounts import load_accounts, default_account, all_accounts
+    from main import fetch_cycle_prices, trade_strategy
+
+    mode = CASSETTE_CONFIG['mode']
+    interval = SYSTEM_CONFIG['update_interval'] if args.interval is None else max(0.0, args.interval)
+    logging.info("交易引擎啟動: 交易所 %s，狀態目錄 %s%s", mode, state_dir, f"（dry-run 副本 {dry_run_dir}）" if dry_run_dir else '')
+
+    # 子帳戶使用各自的實盤客戶端，模擬盤與回放只運行主帳戶
+    accounts = load_accounts() if mode in ('live', 'record') else [default_account()]
+    if mode == 'fake':
+        # 模擬交易所每次啟動都是新的餘額，按已保存的持倉補入基礎幣種
+        for currency in accounts[0].trade_info:
+            units = accounts[0].exposure.currency_exposure(currency)['units']
+            if units:
+                accounts[0].exchange.deposit(currency, units)
+    if not args.no_recover:
+        recovery.recover_all()
+    dry_run_clients = []
+    if args.dry_run:
+        for account in all_accounts():
+            account.exchange = DryRunClient(account.exchange)
+            dry_run_clients.append(account.exchange)
+    if args.profile:
+        # trade_strategy 已按 'cycle' 分析，每個帳戶每個週期一份報告
+        profiler.arm(cycles=(cycles_limit or PROFILE_CONFIG['signal_cycles']) * len(all_accounts()))
+
+    def run_cycle():
+        """與 main.run_all_accounts 相同，分段計時"""
+        timing = {}
+        started = time.perf_counter()
+        prices = fetch_cycle_prices()
+        timing['prices'] = time.perf_counter() - started
+        for account in all_accounts():
+            trade_strategy(account=account, prices=prices)
+        timing['strategy'] = time.perf_counter() - started - timing['prices']
+        return timing
+
+    stop = {'requested': False}
+
+    def _request_stop(signum, frame):
+        stop['requested'] = True
+        logging.info("收到停止信號，當前週期結束後退出")
+    signal.signal(signal.SIGTERM, _request_stop)
+
+    cycles = []
+    started = time.perf_counter()
+    try:
+        while not stop['requested'] and (not cycles_limit or len(cycles) < cycles_limit):
+            calls_before = sum(entry.get('calls', 0) for entry in gateway.stats().values())
+            cycle_started = time.perf_counter()
+            record = {'prices': 0.0, 'strategy': 0.0}
+            try:
+                record.update(run_cycle())
+            except Exception as e:
+                logging.error("交易週期執行錯誤: %s", e)
+                record['error'] = str(e)
+            record['total'] = time.perf_counter() - cycle_started
+            record['exchange_calls'] = sum(entry.get('calls', 0) for entry in gateway.stats().values()) - calls_before
+            cycles.append(record)
+            logging.info("週期 %d 完成: %.3f 秒（行情 %.3f，策略 %.3f），交易所調用 %s",
+                         len(cycles), record['total'], record['prices'], record['strategy'], record['exchange_calls'])
+            if cycles_limit and len(cycles) >= cycles_limit:
+                break
+            deadline = time.monotonic() + max(0.0, interval - record['total'])
+            while not stop['requested'] and time.monotonic() < deadline:
+                time.sleep(min(1.0, deadline - time.monotonic()))
+    except KeyboardInterrupt:
+        logging.info("已中斷，退出交易引擎")
+    finally:
+        orders = [order for client in dry_run_clients for order in client.orders] if args.dry_run else None
+        print_summary(cycles, started, orders, profiler.status() if args.profile else None)
+        if dry_run_dir:
+            print(f"dry-run 狀態副本: {dry_run_dir}")
+    return 1 if cycles and all(c.get('error') for c in cycles) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
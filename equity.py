@@ -0,0 +1,205 @@
+import os
+import json
+import time
+import logging
+import threading
+from datetime import datetime
+import numpy as np
+from config import EQUITY_CONFIG, float_safe
+
+# 每個週期一條記錄（定長二進位，按時間遞增追加）
+SAMPLE_DTYPE = np.dtype([('ts', '<f8'), ('equity', '<f8'), ('usdt', '<f8'), ('invested', '<f8'), ('unrealized', '<f8')])
+# 每個週期每個有持倉的幣種一條記錄：樣本序號、幣種序號、持倉市值
+EXPOSURE_DTYPE = np.dtype([('sample', '<u4'), ('currency', '<u2'), ('value', '<f4')])
+
+
+def series_paths(state_file):
+    """帳戶持倉文件對應的權益曲線文件，如 trade_info.json -> trade_info_equity.bin / _exposure.bin / .json"""
+    base = os.path.splitext(state_file)[0] + '_equity'
+    return base + '.bin', base + '_exposure.bin', base + '.json'
+
+
+def parse_time(value):
+    """查詢參數轉為秒級時間戳：支援秒、毫秒與 ISO 時間字串，空值返回 None"""
+    if value in (None, ''):
+        return None
+    try:
+        number = float(value)
+        return number / 1000 if number > 1e11 else number
+    except (TypeError, ValueError):
+        return datetime.fromisoformat(str(value)).timestamp()
+
+
+def _read(path, dtype):
+    """以 memmap 讀取定長記錄文件，忽略進程中斷時寫了一半的最後一條記錄"""
+    if not os.path.exists(path):
+        return np.zeros(0, dtype=dtype)
+    count = os.path.getsize(path) // dtype.itemsize
+    if count == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', shape=(count,))
+
+
+def lttb(x, y, threshold):
+    """
+    Largest-Triangle-Three-Buckets 降採樣，返回選中點的索引
+    每個桶內的三角形面積以向量計算，只有桶之間是循環（循環次數 = threshold）
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], max(edges[i + 1], edges[i] + 1)
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        next_start = end if end < next_end else next_end - 1
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(area))
+        selected[i + 1] = a
+    return selected
+
+
+def minmax(y, threshold):
+    """每個桶保留最小值與最大值，返回排序後的索引（峰值與回撤不會被平均掉）"""
+    n = len(y)
+    if threshold >= n or threshold < 4:
+        return np.arange(n)
+    buckets = threshold // 2
+    edges = np.linspace(0, n, buckets + 1).astype(np.int64)
+    bucket_of = np.repeat(np.arange(buckets), np.diff(edges))
+    index = np.arange(n)
+    selected = [np.array([0, n - 1])]
+    for reduce in (np.minimum, np.maximum):
+        # 桶內極值由 reduceat 求出，再取桶內第一個等於極值的位置
+        hits = y == reduce.reduceat(y, edges[:-1])[bucket_of]
+        first = np.full(buckets, n - 1, dtype=np.int64)
+        np.minimum.at(first, bucket_of[hits], index[hits])
+        selected.append(first)
+    return np.unique(np.concatenate(selected))
+
+
+class EquitySeries:
+    """
+    一個帳戶的權益曲線：每個交易週期追加一條組合價值、USDT 餘額、投資額與未實現收益，
+    以及各幣種的持倉市值。文件只追加、定長記錄，查詢時 memmap + 二分查找定位時間範圍再降採樣
+    """
+
+    def __init__(self, sample_path, exposure_path, meta_path):
+        self.sample_path = sample_path
+        self.exposure_path = exposure_path
+        self.meta_path = meta_path
+        self._lock = threading.Lock()
+        self.currencies = []
+        self._last_ts = 0.0
+        if os.path.exists(meta_path):
+            try:
+                with open(meta_path, 'r', encoding='utf-8') as f:
+                    self.currencies = json.load(f).get('currencies', [])
+            except Exception as e:
+                logging.error("載入權益曲線索引 %s 失敗: %s", meta_path, e)
+        samples = _read(sample_path, SAMPLE_DTYPE)
+        self._count = len(samples)
+        if self._count:
+            self._last_ts = float(samples['ts'][-1])
+        self._index = {currency: i for i, currency in enumerate(self.currencies)}
+
+    def _currency_index(self, currency):
+        index = self._index.get(currency)
+        if index is None:
+            index = self._index[currency] = len(self.currencies)
+            self.currencies.append(currency)
+            os.makedirs(os.path.dirname(self.meta_path) or '.', exist_ok=True)
+            with open(self.meta_path, 'w', encoding='utf-8') as f:
+                json.dump({'currencies': self.currencies}, f, ensure_ascii=False)
+        return index
+
+    def append(self, usdt, prices, book, unrealized=0.0, ts=None):
+        """
+        追加一個樣本；距離上一個樣本不足 min_interval 秒時跳過
+        :param prices: {currency: 當前價格}
+        :param book: 帳戶的持倉匯總（ExposureBook）
+        :return: 組合價值，跳過時返回 None
+        """
+        ts = ts or time.time()
+        if ts - self._last_ts < EQUITY_CONFIG['min_interval']:
+            return None
+        exposures = {}
+        for currency, price in prices.items():
+            units = book.currency_exposure(currency)['units']
+            if units and price:
+                exposures[currency] = units * float_safe(price)
+        equity = float_safe(usdt) + sum(exposures.values())
+        with self._lock:
+            sample = np.array([(ts, equity, float_safe(usdt), book.portfolio_invested(), float_safe(unrealized))],
+                              dtype=SAMPLE_DTYPE)
+            rows = np.array([(self._count, self._currency_index(c), v) for c, v in exposures.items()],
+                            dtype=EXPOSURE_DTYPE)
+            try:
+                os.makedirs(os.path.dirname(self.sample_path) or '.', exist_ok=True)
+                # 先寫持倉市值再寫樣本：樣本記錄存在即代表該週期的持倉市值已完整寫入
+                if len(rows):
+                    with open(self.exposure_path, 'ab') as f:
+                        f.write(rows.tobytes())
+                with open(self.sample_path, 'ab') as f:
+                    f.write(sample.tobytes())
+                self._count += 1
+                self._last_ts = ts
+            except OSError as e:
+                logging.error("寫入權益曲線失敗: %s", e)
+                return None
+        return equity
+
+    def query(self, start=None, end=None, points=None, method='lttb', exposure=True):
+        """
+        查詢時間範圍內的權益曲線，降採樣到最多 points 個點
+        :param method: 'lttb'（保持形狀）或 'minmax'（保留每個桶的最高與最低點）
+        :return: 列式數據 {'t': [...], 'equity': [...], 'usdt': [...], ..., 'exposure': {currency: [...]}}
+        """
+        points = min(int(points or EQUITY_CONFIG['default_points']), EQUITY_CONFIG['max_points'])
+        samples = _read(self.sample_path, SAMPLE_DTYPE)[:self._count]
+        ts = samples['ts']
+        lo = int(np.searchsorted(ts, start, 'left')) if start is not None else 0
+        hi = int(np.searchsorted(ts, end, 'right')) if end is not None else len(ts)
+        window = samples[lo:hi]
+        if len(window) > points:
+            x, y = np.asarray(window['ts']), np.asarray(window['equity'])
+            picked = minmax(y, points) if method == 'minmax' else lttb(x, y, points)
+        else:
+            picked = np.arange(len(window))
+        chosen = np.asarray(window[picked])
+
+        result = {
+            'total': len(window),
+            'points': len(chosen),
+            't': (chosen['ts'] * 1000).astype(np.int64).tolist(),
+            'equity': np.round(chosen['equity'], 4).tolist(),
+            'usdt': np.round(chosen['usdt'], 4).tolist(),
+            'invested': np.round(chosen['invested'], 4).tolist(),
+            'unrealized': np.round(chosen['unrealized'], 4).tolist()
+        }
+        if exposure:
+            result['exposure'] = self._exposure_at(picked + lo)
+        return result
+
+    def _exposure_at(self, sample_indices):
+        """選中樣本的各幣種持倉市值，沒有持倉的週期為 0"""
+        rows = _read(self.exposure_path, EXPOSURE_DTYPE)
+        if not len(rows) or not len(sample_indices):
+            return {}
+        left = np.searchsorted(rows['sample'], sample_indices, 'left')
+        right = np.searchsorted(rows['sample'], sample_indices, 'right')
+        counts = right - left
+        if not counts.sum():
+            return {}
+        row_idx = np.concatenate([np.arange(l, r) for l, r in zip(left, right) if r > l])
+        point_idx = np.repeat(np.arange(len(sample_indices)), counts)
+        selected = np.asarray(rows[row_idx])
+        values = np.zeros((len(self.currencies), len(sample_indices)), dtype=float)
+        values[selected['currency'], point_idx] = selected['value']
+        return {currency: np.round(values[i], 4).tolist()
+                for i, currency in enumerate(self.currencies) if values[i].any()}
@@ -0,0 +1,173 @@
+import os
+import json
+import time
+import logging
+import threading
+from collections import deque
+from datetime import datetime
+import numpy as np
+from config import EXECUTION_CONFIG, float_safe
+
+# 每個交易對最近 window 張訂單的成交記錄，用於滾動匯總；啟動時從成交記錄文件的尾部恢復
+_records = {}
+_recent = deque(maxlen=EXECUTION_CONFIG['recent'])
+_lock = threading.Lock()
+_loaded = False
+
+
+def _load():
+    """首次使用時從成交記錄文件恢復滾動窗口"""
+    global _loaded
+    with _lock:
+        if _loaded:
+            return
+        _loaded = True
+        path = EXECUTION_CONFIG['path']
+        if not os.path.exists(path):
+            return
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        _remember(json.loads(line))
+                    except ValueError:
+                        continue
+        except OSError as e:
+            logging.warning("讀取成交記錄失敗: %s", e)
+
+
+def _remember(record):
+    _records.setdefault(record['symbol'], deque(maxlen=EXECUTION_CONFIG['window'])).append(record)
+    _recent.append(record)
+
+
+def _append(record):
+    path = EXECUTION_CONFIG['path']
+    try:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False, default=str) + '\n')
+    except OSError as e:
+        logging.warning("寫入成交記錄失敗: %s", e)
+
+
+def order_fee(order, symbol, price):
+    """訂單手續費折算為 USDT（以基礎幣種收取時按成交均價折算）"""
+    fees = list((order or {}).get('fees') or [])
+    if not fees and (order or {}).get('fee'):
+        fees = [order['fee']]
+    base, quote = symbol.split('/')
+    total = 0.0
+    for fee in fees:
+        cost = abs(float_safe((fee or {}).get('cost')))
+        currency = (fee or {}).get('currency')
+        if currency == base:
+            total += cost * price
+        elif currency in (quote, None):
+            total += cost
+    return total
+
+
+class Ticket:
+    """
+    單張訂單的執行記錄：begin 時記錄決策時間與決策價格，submit 記錄提交與確認時間，
+    fill 記錄成交均價與手續費並計算滑價（正數表示比決策價格成交得更差）
+    """
+
+    def __init__(self, symbol, side, amount, decision_price, source, account, decided_at):
+        self.record = {
+            'symbol': symbol,
+            'side': side,
+            'source': source,
+            'account': account,
+            'amount': amount,
+            'decision_price': float_safe(decision_price),
+            'decided_at': decided_at or time.time(),
+            'submitted_at': None,
+            'acked_at': None,
+            'order_id': None
+        }
+
+    def submit(self, func, *args, **kwargs):
+        """調用下單函數並記錄提交與確認時間，返回訂單"""
+        submitted_at = time.time()
+        order = func(*args, **kwargs)
+        self.acknowledged(order, submitted_at, time.time())
+        return order
+
+    def acknowledged(self, order, submitted_at, acked_at):
+        """批量下單時由調用方提供提交與確認時間"""
+        self.record['submitted_at'] = submitted_at
+        self.record['acked_at'] = acked_at
+        self.record['order_id'] = (order or {}).get('id')
+
+    def fill(self, filled, average, order=None):
+        """記錄成交並寫入成交記錄，返回記錄"""
+        record = self.record
+        decision = record['decision_price']
+        average = float_safe(average)
+        record['filled'] = float_safe(filled)
+        record['average'] = average
+        record['fee'] = order_fee(order, record['symbol'], average)
+        record['filled_at'] = time.time()
+        if decision > 0 and average > 0:
+            sign = 1 if record['side'] == 'buy' else -1
+            record['slippage_bps'] = sign * (average - decision) / decision * 10000
+            record['slippage_cost'] = sign * (average - decision) * record['filled']
+        else:
+            record['slippage_bps'] = record['slippage_cost'] = None
+        if record['submitted_at'] is not None:
+            record['decision_ms'] = (record['submitted_at'] - record['decided_at']) * 1000
+            record['ack_ms'] = (record['acked_at'] - record['submitted_at']) * 1000
+        record['time'] = datetime.fromtimestamp(record['filled_at']).isoformat()
+        _load()
+        with _lock:
+            _remember(record)
+        _append(record)
+        if record['slippage_bps'] is not None:
+            logging.info("%s %s 成交 %.6f @ %.6f，決策價 %.6f，滑價 %.1f bps，確認耗時 %.0f ms",
+                         record['symbol'], record['side'], record['filled'], average, decision,
+                         record['slippage_bps'], record.get('ack_ms', 0))
+        return record
+
+
+def begin(symbol, side, amount, decision_price, source='', account=None, decided_at=None):
+    """開始追蹤一張訂單（在讀取決策價格後、下單前調用）"""
+    return Ticket(symbol, side, amount, decision_price, source, account, decided_at)
+
+
+def _aggregate(records):
+    ack = np.array([r['ack_ms'] for r in records if r.get('ack_ms') is not None], dtype=float)
+    decision = np.array([r['decision_ms'] for r in records if r.get('decision_ms') is not None], dtype=float)
+    slippage = np.array([r['slippage_bps'] for r in records if r.get('slippage_bps') is not None], dtype=float)
+    notional = sum(float_safe(r.get('filled')) * float_safe(r.get('average')) for r in records)
+    return {
+        'orders': len(records),
+        'notional': notional,
+        'fees': sum(float_safe(r.get('fee')) for r in records),
+        'slippage_cost': sum(float_safe(r.get('slippage_cost')) for r in records),
+        'avg_slippage_bps': float(slippage.mean()) if len(slippage) else None,
+        'p95_slippage_bps': float(np.percentile(slippage, 95)) if len(slippage) else None,
+        'ack_p50_ms': float(np.percentile(ack, 50)) if len(ack) else None,
+        'ack_p95_ms': float(np.percentile(ack, 95)) if len(ack) else None,
+        'decision_p50_ms': float(np.percentile(decision, 50)) if len(decision) else None,
+        'last': records[-1].get('time') if records else None
+    }
+
+
+def summary():
+    """每個交易對最近 window 張訂單的滾動匯總，以及所有交易對的合計"""
+    _load()
+    with _lock:
+        by_symbol = {symbol: list(records) for symbol, records in _records.items()}
+    result = {symbol: _aggregate(records) for symbol, records in sorted(by_symbol.items())}
+    result['ALL'] = _aggregate([r for records in by_symbol.values() for r in records])
+    return result
+
+
+def recent(limit=None):
+    """最近的成交記錄，最新的在前"""
+    _load()
+    with _lock:
+        records = list(_recent)
+    return records[::-1][:limit]
@@ -0,0 +1,143 @@
+import logging
+import threading
+from config import trade_info, SYSTEM_CONFIG, float_safe
+
+
+def _empty():
+    return {'invested': 0.0, 'units': 0.0, 'positions': 0}
+
+
+def _compute(info_by_currency):
+    """全量掃描持倉，返回 (幣種匯總, 組合匯總)"""
+    currency_totals = {}
+    portfolio = {'invested': 0.0, 'positions': 0}
+    for currency, info in info_by_currency.items():
+        totals = _empty()
+        for position in info['positions']:
+            amount = float_safe(position.get('amount'))
+            totals['invested'] += amount * float_safe(position.get('entry_price'))
+            totals['units'] += amount
+            totals['positions'] += 1
+        currency_totals[currency] = totals
+        portfolio['invested'] += totals['invested']
+        portfolio['positions'] += totals['positions']
+    return currency_totals, portfolio
+
+
+class ExposureBook:
+    """
+    一份 trade_info 的持倉匯總：
+    invested 為按入場價計算的投資額，units 為持倉單位數，positions 為倉位數
+    """
+
+    def __init__(self, info_by_currency):
+        self.info_by_currency = info_by_currency
+        self._currency_totals = {}
+        self._portfolio_totals = {'invested': 0.0, 'positions': 0}
+        self._versions = {}   # currency -> 變更次數，供頁面片段緩存判斷是否需要重新渲染
+        self._epoch = 0       # 全量重建次數
+        self._lock = threading.Lock()
+        self.rebuild()
+
+    def rebuild(self, info_by_currency=None):
+        """從持倉數據全量重建匯總（啟動或狀態被整體替換時調用）"""
+        if info_by_currency is not None:
+            self.info_by_currency = info_by_currency
+        currency_totals, portfolio = _compute(self.info_by_currency)
+        with self._lock:
+            self._currency_totals = currency_totals
+            self._portfolio_totals = portfolio
+            self._epoch += 1
+
+    def record_open(self, currency, amount, entry_price):
+        """新倉位成交"""
+        invested = float_safe(amount) * float_safe(entry_price)
+        with self._lock:
+            totals = self._currency_totals.setdefault(currency, _empty())
+            totals['invested'] += invested
+            totals['units'] += float_safe(amount)
+            totals['positions'] += 1
+            self._portfolio_totals['invested'] += invested
+            self._portfolio_totals['positions'] += 1
+            self._bump(currency)
+
+    def record_reduce(self, currency, amount, entry_price, closed=False):
+        """
+        倉位賣出（再平衡部分賣出或止盈平倉）
+        :param amount: 賣出數量
+        :param entry_price: 該倉位的入場價格
+        :param closed: 該倉位是否已全部賣出並移除
+        """
+        invested = float_safe(amount) * float_safe(entry_price)
+        with self._lock:
+            totals = self._currency_totals.setdefault(currency, _empty())
+            totals['invested'] -= invested
+            totals['units'] -= float_safe(amount)
+            self._portfolio_totals['invested'] -= invested
+            if closed:
+                totals['positions'] -= 1
+                self._portfolio_totals['positions'] -= 1
+            self._bump(currency)
+
+    def record_clear(self, currency):
+        """幣種全部倉位被清空"""
+        with self._lock:
+            totals = self._currency_totals.get(currency)
+            if not totals:
+                return
+            self._portfolio_totals['invested'] -= totals['invested']
+            self._portfolio_totals['positions'] -= totals['positions']
+            self._currency_totals[currency] = _empty()
+            self._bump(currency)
+
+    def _bump(self, currency):
+        self._versions[currency] = self._versions.get(currency, 0) + 1
+
+    def version(self, currency):
+        """該幣種持倉的版本號，任何開倉/減倉/清倉/重建後都會改變"""
+        return self._epoch, self._versions.get(currency, 0)
+
+    def currency_exposure(self, currency):
+        """返回幣種匯總的副本"""
+        return dict(self._currency_totals.get(currency) or _empty())
+
+    def portfolio_invested(self):
+        """組合總投資額（按入場價計算）"""
+        return self._portfolio_totals['invested']
+
+    def portfolio_positions(self):
+        """組合總倉位數"""
+        return self._portfolio_totals['positions']
+
+    def verify(self, tolerance=1e-6):
+        """
+        調試模式下與全量計算結果比對，不一致時記錄並以全量結果為準
+        :return: 是否一致
+        """
+        if not SYSTEM_CONFIG['debug_mode']:
+            return True
+        currency_totals, _ = _compute(self.info_by_currency)
+        consistent = True
+        for currency, expected in currency_totals.items():
+            actual = self._currency_totals.get(currency) or _empty()
+            for key, value in expected.items():
+                if abs(actual[key] - value) > tolerance * max(1.0, abs(value)):
+                    logging.warning("%s 持倉匯總 %s 不一致: 增量=%s, 全量=%s", currency, key, actual[key], value)
+                    consistent = False
+        if not consistent:
+            self.rebuild()
+        return consistent
+
+
+# 主帳戶（config.trade_info）的匯總，模組級函數直接代理到它
+default_book = ExposureBook(trade_info)
+
+rebuild = default_book.rebuild
+record_open = default_book.record_open
+record_reduce = default_book.record_reduce
+record_clear = default_book.record_clear
+currency_exposure = default_book.currency_exposure
+portfolio_invested = default_book.portfolio_invested
+portfolio_positions = default_book.portfolio_positions
+verify = default_book.verify
+version = default_book.version
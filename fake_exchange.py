@@ -0,0 +1,274 @@
+import math
+import time
+import random
+import threading
+from collections import Counter
+import ccxt
+
+_BASE_PRICES = {
+    'BTC': 60000.0, 'ETH': 3000.0, 'ADA': 0.45, 'DOGE': 0.12, 'DOT': 6.5, 'UNI': 8.0, 'ARB': 0.9,
+    'KSM': 25.0, 'SUI': 1.2, 'SOL': 150.0, 'AVAX': 30.0, 'LINK': 14.0, 'CRV': 0.4
+}
+
+_TIMEFRAME_SECONDS = {'1m': 60, '5m': 300, '15m': 900, '30m': 1800, '1h': 3600, '4h': 14400, '1d': 86400}
+
+
+class FakeExchange:
+    """
+    記憶體內的模擬交易所，介面與 ccxt 的 okx 現貨一致：
+    價格按固定種子隨機遊走，市價單立即按當前價格成交並更新餘額；
+    未能立即成交的限價單與止盈委託（takeProfitPrice）掛在簿上，價格變動時撮合，
+    用於壓力測試與無網路的開發環境，calls 記錄每個方法的調用次數
+    """
+
+    id = 'fake'
+
+    def __init__(self, currencies=None, latency=0.0, seed=0, usdt_balance=10000.0):
+        self.has = {'fetchTickers': True, 'createOrders': True, 'fetchMyTrades': True, 'fetchClosedOrders': True,
+                    'fetchOpenOrders': True, 'editOrder': True}
+        self.timeout = 30000
+        self.latency = latency
+        self.calls = Counter()
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        names = currencies or list(_BASE_PRICES)
+        self._prices = {f"{c}/USDT": _BASE_PRICES.get(c, 1.0) for c in names}
+        self.markets = {symbol: self._market(symbol) for symbol in self._prices}
+        self.currencies = {c: {'id': c, 'code': c} for c in names + ['USDT']}
+        self._balance = {'USDT': float(usdt_balance)}
+        self._orders = {}
+        self._resting = {}   # 未成交的限價單與止盈委託
+        self._locked = {}    # 掛單佔用的餘額
+        self._trades = []
+        self._next_id = 1
+
+    @staticmethod
+    def _market(symbol):
+        base, quote = symbol.split('/')
+        return {
+            'id': f"{base}-{quote}", 'symbol': symbol, 'base': base, 'quote': quote,
+            'type': 'spot', 'spot': True, 'active': True,
+            'limits': {'amount': {'min': 1e-8, 'max': None}, 'cost': {'min': 1, 'max': None}},
+            'precision': {'amount': 1e-8, 'price': 1e-8}
+        }
+
+    def _call(self, name):
+        self.calls[name] += 1
+        if self.latency:
+            time.sleep(self.latency * (0.5 + self._rng.random()))
+
+    def _price(self, symbol, move=True):
+        if symbol not in self._prices:
+            raise ccxt.BadSymbol(f"fake 不支援交易對 {symbol}")
+        with self._lock:
+            if move:
+                self._prices[symbol] *= 1 + self._rng.gauss(0, 0.002)
+                self._match(symbol, self._prices[symbol])
+            return self._prices[symbol]
+
+    def milliseconds(self):
+        return int(time.time() * 1000)
+
+    def set_markets(self, markets, currencies=None):
+        self.markets = markets
+        self.currencies = currencies or self.currencies
+
+    def deposit(self, currency, amount):
+        """直接增減模擬帳戶餘額（模擬盤啟動時按已保存的持倉補入基礎幣種）"""
+        with self._lock:
+            self._balance[currency] = self._balance.get(currency, 0.0) + float(amount)
+
+    def load_markets(self, reload=False, params={}):
+        self._call('load_markets')
+        return self.markets
+
+    def fetch_status(self, params={}):
+        self._call('fetch_status')
+        return {'status': 'ok', 'updated': self.milliseconds()}
+
+    def _ticker(self, symbol):
+        last = self._price(symbol)
+        return {
+            'symbol': symbol, 'timestamp': self.milliseconds(), 'last': last, 'close': last,
+            'bid': last * 0.9995, 'ask': last * 1.0005,
+            'baseVolume': 1e9 / last, 'quoteVolume': 1e9
+        }
+
+    def fetch_ticker(self, symbol, params={}):
+        self._call('fetch_ticker')
+        return self._ticker(symbol)
+
+    def fetch_tickers(self, symbols=None, params={}):
+        self._call('fetch_tickers')
+        return {symbol: self._ticker(symbol) for symbol in (symbols or self._prices) if symbol in self._prices}
+
+    def fetch_order_book(self, symbol, limit=None, params={}):
+        self._call('fetch_order_book')
+        last = self._price(symbol, move=False)
+        depth = limit or 20
+        return {
+            'symbol': symbol, 'timestamp': self.milliseconds(),
+            'bids': [[last * (1 - 0.0005 * (i + 1)), 1e5 / last] for i in range(depth)],
+            'asks': [[last * (1 + 0.0005 * (i + 1)), 1e5 / last] for i in range(depth)]
+        }
+
+    def fetch_ohlcv(self, symbol, timeframe='1h', since=None, limit=None, params={}):
+        """以當前價格為終點生成確定的正弦波K線"""
+        self._call('fetch_ohlcv')
+        last = self._price(symbol, move=False)
+        frame_ms = _TIMEFRAME_SECONDS.get(timeframe, 3600) * 1000
+        count = limit or 100
+        end = self.milliseconds() // frame_ms * frame_ms
+        start = since // frame_ms * frame_ms if since else end - (count - 1) * frame_ms
+        bars = []
+        for i in range(count):
+            ts = start + i * frame_ms
+            if ts > end:
+                break
+            close = last * (1 + 0.03 * math.sin((end - ts) / frame_ms / 6))
+            bars.append([ts, close * 0.999, close * 1.004, close * 0.996, close, 1000.0])
+        return bars
+
+    def fetch_balance(self, params={}):
+        self._call('fetch_balance')
+        with self._lock:
+            balance = {code: {'free': amount, 'used': self._locked.get(code, 0.0), 'total': amount + self._locked.get(code, 0.0)}
+                       for code, amount in self._balance.items()}
+        balance['free'] = {code: entry['free'] for code, entry in balance.items()}
+        return balance
+
+    @staticmethod
+    def _crosses(order, price):
+        """掛單在該價格是否成交：止盈委託按觸發價，限價單按限價"""
+        if order.get('takeProfitPrice'):
+            return price >= order['takeProfitPrice']
+        return price >= order['price'] if order['side'] == 'sell' else price <= order['price']
+
+    def _new_order(self, symbol, type, side, amount, status):
+        order_id = str(self._next_id)
+        self._next_id += 1
+        order = {
+            'id': order_id, 'symbol': symbol, 'type': type, 'side': side, 'status': status,
+            'timestamp': self.milliseconds(), 'lastTradeTimestamp': None,
+            'amount': amount, 'filled': 0.0, 'remaining': amount,
+            'price': None, 'average': None, 'cost': 0.0, 'fee': None
+        }
+        self._orders[order_id] = order
+        return order
+
+    def _fill(self, order, fill_price):
+        """在持有 _lock 時調用：按成交價更新餘額與訂單，記錄成交"""
+        base = order['symbol'].split('/')[0]
+        amount = order['amount']
+        cost = amount * fill_price
+        sign = 1 if order['side'] == 'buy' else -1
+        self._balance[base] = self._balance.get(base, 0.0) + sign * amount
+        self._balance['USDT'] = self._balance.get('USDT', 0.0) - sign * cost
+        timestamp = self.milliseconds()
+        order.update(status='closed', lastTradeTimestamp=timestamp, filled=amount, remaining=0.0,
+                     price=order['price'] or fill_price, average=fill_price, cost=cost)
+        self._trades.append({
+            'id': f"t{order['id']}", 'order': order['id'], 'symbol': order['symbol'], 'side': order['side'],
+            'amount': amount, 'price': fill_price, 'cost': cost, 'timestamp': timestamp, 'fee': None
+        })
+
+    def _lock_funds(self, order, sign):
+        """掛單時從可用餘額移到佔用（sign=1），撤單或成交前移回（sign=-1）"""
+        base = order['symbol'].split('/')[0]
+        code, amount = (base, order['amount']) if order['side'] == 'sell' else ('USDT', order['amount'] * order['price'])
+        self._balance[code] = self._balance.get(code, 0.0) - sign * amount
+        self._locked[code] = self._locked.get(code, 0.0) + sign * amount
+
+    def _match(self, symbol, price):
+        """在持有 _lock 時調用：撮合該交易對的掛單，限價單按限價成交，止盈委託觸發後按市價成交"""
+        for order_id, order in list(self._resting.items()):
+            if order['symbol'] != symbol or not self._crosses(order, price):
+                continue
+            del self._resting[order_id]
+            self._lock_funds(order, -1)
+            self._fill(order, price * 0.9995 if order['takeProfitPrice'] else order['price'])
+
+    def create_order(self, symbol, type, side, amount, price=None, params={}):
+        self._call('create_order')
+        market_price = self._price(symbol, move=False)
+        code = 'USDT' if side == 'buy' else symbol.split('/')[0]
+        with self._lock:
+            needed = amount * (price or market_price * 1.0005) if side == 'buy' else amount
+            if self._balance.get(code, 0) < needed * (1 - 1e-9):
+                raise ccxt.InsufficientFunds(f"fake {code} 餘額不足: 需要 {needed}")
+            order = self._new_order(symbol, type, side, amount, 'open')
+            order.update(price=price if type == 'limit' else None, takeProfitPrice=params.get('takeProfitPrice'))
+            if (order['takeProfitPrice'] or order['price']) and not self._crosses(order, market_price):
+                self._lock_funds(order, 1)
+                self._resting[order['id']] = order
+            else:
+                self._fill(order, market_price * (1.0005 if side == 'buy' else 0.9995))
+        return dict(order)
+
+    def create_market_buy_order(self, symbol, amount, params={}):
+        return self.create_order(symbol, 'market', 'buy', amount, None, params)
+
+    def create_market_sell_order(self, symbol, amount, params={}):
+        return self.create_order(symbol, 'market', 'sell', amount, None, params)
+
+    def create_orders(self, orders, params={}):
+        return [self.create_order(o['symbol'], o['type'], o['side'], o['amount'], o.get('price')) for o in orders]
+
+    def cancel_order(self, id, symbol=None, params={}):
+        self._call('cancel_order')
+        with self._lock:
+            order = self._resting.pop(id, None)
+            if order is not None:
+                self._lock_funds(order, -1)
+                order['status'] = 'canceled'
+                return dict(order)
+            if id in self._orders and self._orders[id]['status'] == 'closed':
+                raise ccxt.OrderNotFound(f"fake 訂單 {id} 已成交")
+        return {'id': id, 'symbol': symbol, 'status': 'canceled'}
+
+    def edit_order(self, id, symbol, type, side, amount=None, price=None, params={}):
+        self._call('edit_order')
+        with self._lock:
+            order = self._resting.get(id)
+            if order is None:
+                raise ccxt.OrderNotFound(f"fake 訂單 {id} 不存在或已結束")
+            self._lock_funds(order, -1)
+            updated = dict(order, amount=amount or order['amount'], price=price or order['price'])
+            code = 'USDT' if order['side'] == 'buy' else symbol.split('/')[0]
+            needed = updated['amount'] * updated['price'] if order['side'] == 'buy' else updated['amount']
+            if self._balance.get(code, 0) < needed * (1 - 1e-9):
+                self._lock_funds(order, 1)
+                raise ccxt.InsufficientFunds(f"fake 修改訂單 {id} 餘額不足")
+            order.update(amount=updated['amount'], remaining=updated['amount'], price=updated['price'])
+            self._lock_funds(order, 1)
+            return dict(order)
+
+    def fetch_open_orders(self, symbol=None, since=None, limit=None, params={}):
+        """未成交掛單；params 含 trigger 時只返回止盈委託，否則只返回限價單（與 OKX 分開查詢一致）"""
+        self._call('fetch_open_orders')
+        algo = bool(params.get('trigger'))
+        with self._lock:
+            orders = [o for o in self._resting.values()
+                      if (symbol is None or o['symbol'] == symbol) and bool(o.get('takeProfitPrice')) == algo]
+        return [dict(o) for o in orders[:limit]]
+
+    def fetch_order(self, id, symbol=None, params={}):
+        self._call('fetch_order')
+        order = self._orders.get(id)
+        if order is None:
+            raise ccxt.OrderNotFound(f"fake 訂單 {id} 不存在")
+        return dict(order)
+
+    def fetch_my_trades(self, symbol=None, since=None, limit=None, params={}):
+        self._call('fetch_my_trades')
+        with self._lock:
+            trades = [t for t in self._trades
+                      if (symbol is None or t['symbol'] == symbol) and (since is None or t['timestamp'] >= since)]
+        return [dict(t) for t in trades[:limit]]
+
+    def fetch_closed_orders(self, symbol=None, since=None, limit=None, params={}):
+        self._call('fetch_closed_orders')
+        with self._lock:
+            orders = [o for o in self._orders.values()
+                      if (symbol is None or o['symbol'] == symbol) and (since is None or o['timestamp'] >= since)]
+        return [dict(o) for o in orders[:limit]]
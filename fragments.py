@@ -0,0 +1,72 @@
+import threading
+from datetime import datetime
+from flask import render_template
+from markupsafe import Markup
+from config import float_safe
+
+# 片段緩存：名稱 -> (緩存鍵, 已渲染的 HTML)，緩存鍵由狀態版本與顯示用到的數值組成
+_fragments = {}
+_lock = threading.Lock()
+
+
+def _cached(name, key, render):
+    """緩存鍵不變時直接返回已渲染的片段，否則重新渲染並替換"""
+    cached = _fragments.get(name)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    html = Markup(render())
+    with _lock:
+        _fragments[name] = (key, html)
+    return html
+
+
+def sort_currencies(trade_info):
+    """等待交易中的貨幣優先，其次是正在交易的貨幣，最後是未交易的貨幣"""
+    return sorted(trade_info, key=lambda c: (not trade_info[c].get('waiting_for_open', False),
+                                             not trade_info[c].get('is_trading', False)))
+
+
+def summary_cards(**values):
+    """首頁摘要卡片，數值按顯示精度取整後作為緩存鍵"""
+    key = tuple(sorted((name, round(float_safe(value), 2)) for name, value in values.items()))
+    return _cached('summary_cards', key, lambda: render_template('partials/summary_cards.html', **values))
+
+
+def currency_rows(trade_info, book):
+    """
+    首頁幣種列表：每個幣種一個行片段，只有持倉版本、價格、收益或狀態變化的幣種會重新渲染
+    總單位數直接讀取持倉匯總，不再逐倉位求和
+    """
+    rows = []
+    for currency in sort_currencies(trade_info):
+        info = trade_info[currency]
+        key = (book.version(currency), info.get('current_price'), round(float_safe(info.get('total_profit')), 2),
+               info.get('waiting_for_open', False), info.get('is_trading', False))
+        rows.append(_cached(f"row:{currency}", key, lambda: render_template(
+            'partials/currency_row.html', currency=currency, info=info,
+            total_amount=book.currency_exposure(currency)['units'])))
+    return Markup(''.join(rows))
+
+
+def _format_time(value):
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    return str(value)[:19].replace('T', ' ') if value else '尚未執行'
+
+
+def position_rows(currency, info, book):
+    """倉位管理頁面的倉位表格，持倉版本與價格不變時直接復用"""
+    key = (book.version(currency), info.get('current_price'))
+    return _cached(f"positions:{currency}", key, lambda: render_template(
+        'partials/position_rows.html', positions=info['positions']))
+
+
+def position_summary(currency, info, book, unrealized):
+    """倉位管理頁面的匯總區塊：總單位數來自持倉匯總，總收益來自收益帳本的未實現收益"""
+    key = (book.version(currency), round(unrealized, 2), info.get('rebalance_count', 0), str(info.get('last_rebalance_time')))
+    return _cached(f"position_summary:{currency}", key, lambda: render_template(
+        'partials/position_summary.html',
+        total_amount=book.currency_exposure(currency)['units'],
+        total_profit=unrealized,
+        rebalance_count=info.get('rebalance_count', 0),
+        last_rebalance_time=_format_time(info.get('last_rebalance_time'))))
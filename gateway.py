@@ -0,0 +1,375 @@
+import re
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import numpy as np
+import ccxt
+from config import GATEWAY_CONFIG, SYSTEM_CONFIG
+
+
+class EndpointUnavailable(ccxt.ExchangeNotAvailable):
+    """端點熔斷中或併發已滿，請求未發出即被拒絕"""
+
+
+class OutcomeUnknown(ccxt.RequestTimeout):
+    """下單/撤單類請求超時：請求可能已在交易所執行，結果未知，需要查詢訂單或成交確認後再處理"""
+
+
+# ---- 各方法的返回值驗證 ----
+
+def _is_ohlcv(result):
+    return isinstance(result, list) and all(isinstance(candle, list) and len(candle) >= 5 for candle in result)
+
+
+def _is_order_book(result):
+    return isinstance(result, dict) and isinstance(result.get('bids'), list) and isinstance(result.get('asks'), list)
+
+
+def _is_order(result):
+    return isinstance(result, dict) and result.get('id') is not None
+
+
+def _is_dict_list(result):
+    return isinstance(result, list) and all(isinstance(item, dict) for item in result)
+
+
+def _is_dict(result):
+    return isinstance(result, dict)
+
+
+VALIDATORS = {
+    'load_markets': _is_dict,
+    'fetch_status': lambda result: isinstance(result, dict) and 'status' in result,
+    'fetch_ohlcv': _is_ohlcv,
+    'fetch_ticker': lambda result: isinstance(result, dict) and result.get('last') is not None,
+    'fetch_tickers': _is_dict,
+    'fetch_order_book': _is_order_book,
+    'fetch_balance': _is_dict,
+    'fetch_order': _is_order,
+    'fetch_orders': _is_dict_list,
+    'fetch_open_orders': _is_dict_list,
+    'fetch_closed_orders': _is_dict_list,
+    'fetch_my_trades': _is_dict_list,
+    'create_order': _is_order,
+    'create_orders': _is_dict_list,
+    'create_market_buy_order': _is_order,
+    'create_market_sell_order': _is_order,
+    'create_limit_buy_order': _is_order,
+    'create_limit_sell_order': _is_order,
+    'edit_order': _is_order,
+    'cancel_order': _is_dict,
+}
+
+_ROUTED_PREFIXES = ('fetch_', 'create_', 'cancel_', 'edit_')
+
+
+def _normalize(name):
+    """fetchTicker -> fetch_ticker，camelCase 別名與 snake_case 共用同一個端點"""
+    return re.sub(r'(?<=[a-z0-9])([A-Z])', r'_\1', name).lower()
+
+
+def _is_read(endpoint):
+    """只讀請求可以重試與對沖，下單/撤單類請求只發一次"""
+    return endpoint.startswith('fetch_') or endpoint == 'load_markets'
+
+
+_PUBLIC = {'load_markets', 'fetch_status', 'fetch_ohlcv', 'fetch_ticker', 'fetch_tickers', 'fetch_order_book',
+           'fetch_trades', 'fetch_markets', 'fetch_currencies', 'fetch_time'}
+
+
+def _is_private(endpoint):
+    """需要簽名的端點：熔斷與統計按帳戶分開，一個子帳戶的認證或限頻錯誤不影響其他帳戶"""
+    return endpoint not in _PUBLIC
+
+
+# ---- 熔斷器與延遲統計 ----
+
+class CircuitBreaker:
+    """
+    單個端點的熔斷器：連續失敗 failure_threshold 次後打開，
+    cooldown 秒後半開，只放行一個探測請求，探測成功則關閉，失敗則重新打開；
+    探測進行中其他請求仍被拒絕
+    """
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probe_started = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            now = time.monotonic()
+            if self.state == 'open':
+                if now - self.opened_at < GATEWAY_CONFIG['cooldown']:
+                    return False
+                self.state = 'half_open'
+                self.probe_started = now
+                logging.info("%s 熔斷冷卻結束，進入半開狀態", self.endpoint)
+                return True
+            if self.state == 'half_open':
+                # 探測請求沒有回報結果（如被併發上限拒絕）超過一次調用時限後，允許新的探測
+                if self.probe_started is not None and now - self.probe_started < GATEWAY_CONFIG['call_budget']:
+                    return False
+                self.probe_started = now
+            return True
+
+    def abort_probe(self):
+        """探測請求未發出，下一個請求可以立即重新探測"""
+        with self._lock:
+            if self.state == 'half_open':
+                self.probe_started = None
+
+    def retry_in(self):
+        return max(GATEWAY_CONFIG['cooldown'] - (time.monotonic() - self.opened_at), 0.0)
+
+    def record_success(self):
+        with self._lock:
+            if self.state != 'closed':
+                logging.info("%s 恢復正常，熔斷器關閉", self.endpoint)
+            self.state = 'closed'
+            self.failures = 0
+            self.probe_started = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == 'half_open' or (self.state == 'closed' and self.failures >= GATEWAY_CONFIG['failure_threshold']):
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+                logging.warning("%s 連續失敗 %d 次，熔斷 %d 秒", self.endpoint, self.failures, GATEWAY_CONFIG['cooldown'])
+
+
+class EndpointStats:
+    """單個端點最近 latency_window 次請求的延遲與計數"""
+
+    def __init__(self):
+        self.latencies = deque(maxlen=GATEWAY_CONFIG['latency_window'])
+        self.counts = {'calls': 0, 'failures': 0, 'timeouts': 0, 'unknown': 0, 'invalid': 0, 'rejected': 0, 'hedged': 0}
+        self.inflight = threading.BoundedSemaphore(GATEWAY_CONFIG['max_inflight'])
+        self._lock = threading.Lock()
+
+    def record(self, elapsed):
+        with self._lock:
+            self.latencies.append(elapsed)
+
+    def count(self, key):
+        with self._lock:
+            self.counts[key] += 1
+
+    def _percentile(self, q):
+        with self._lock:
+            if len(self.latencies) < GATEWAY_CONFIG['min_samples']:
+                return None
+            samples = np.fromiter(self.latencies, dtype=float)
+        return float(np.percentile(samples, q))
+
+    def timeout(self):
+        """自適應超時：最近延遲 p95 的倍數，樣本不足時使用上限"""
+        p95 = self._percentile(95)
+        if p95 is None:
+            return GATEWAY_CONFIG['max_timeout']
+        return min(max(p95 * GATEWAY_CONFIG['timeout_multiplier'], GATEWAY_CONFIG['min_timeout']), GATEWAY_CONFIG['max_timeout'])
+
+    def hedge_delay(self):
+        """超過此延遲仍未返回時發出對沖請求，樣本不足時不對沖"""
+        delay = self._percentile(GATEWAY_CONFIG['hedge_percentile'])
+        if delay is None:
+            return None
+        return max(delay, GATEWAY_CONFIG['min_hedge_delay'])
+
+    def snapshot(self):
+        with self._lock:
+            samples = np.fromiter(self.latencies, dtype=float)
+            counts = dict(self.counts)
+        if len(samples):
+            counts['p50'] = float(np.percentile(samples, 50))
+            counts['p95'] = float(np.percentile(samples, 95))
+        return counts
+
+
+_breakers = {}  # 公共端點: endpoint，簽名端點: '帳戶/endpoint' -> CircuitBreaker
+_stats = {}
+_registry_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=GATEWAY_CONFIG['pool_size'], thread_name_prefix='gateway')
+
+
+def _endpoint_key(endpoint, scope):
+    return f"{scope}/{endpoint}" if scope is not None and _is_private(endpoint) else endpoint
+
+
+def _endpoint_state(key):
+    breaker = _breakers.get(key)
+    if breaker is None:
+        with _registry_lock:
+            breaker = _breakers.setdefault(key, CircuitBreaker(key))
+            _stats.setdefault(key, EndpointStats())
+    return breaker, _stats[key]
+
+
+def _invoke(stats, func, args, kwargs):
+    try:
+        return func(*args, **kwargs)
+    finally:
+        stats.inflight.release()
+
+
+def _submit(endpoint, stats, func, args, kwargs):
+    """佔用端點的併發名額後交給共用線程池執行，名額用盡時直接拒絕，慢端點不會佔滿線程池"""
+    if not stats.inflight.acquire(blocking=False):
+        stats.count('rejected')
+        raise EndpointUnavailable(f"{endpoint} 併發請求已達上限 {GATEWAY_CONFIG['max_inflight']}")
+    return _executor.submit(_invoke, stats, func, args, kwargs)
+
+
+def _run_once(endpoint, stats, func, args, kwargs, timeout, hedge_delay):
+    """
+    發出一次請求並最多等待 timeout 秒；hedge_delay 秒後仍未返回時再發一個相同請求，取先成功的結果
+    超時的請求在後台線程中自行結束（底層客戶端的超時為 max_timeout）
+    """
+    pending = {_submit(endpoint, stats, func, args, kwargs)}
+    deadline = time.monotonic() + timeout
+    if hedge_delay is not None and hedge_delay < timeout:
+        done, _ = wait(pending, timeout=hedge_delay)
+        if not done:
+            try:
+                pending.add(_submit(endpoint, stats, func, args, kwargs))
+                stats.count('hedged')
+            except EndpointUnavailable:
+                pass
+
+    error = None
+    while pending:
+        done, pending = wait(pending, timeout=max(deadline - time.monotonic(), 0), return_when=FIRST_COMPLETED)
+        if not done:
+            break
+        for future in done:
+            if future.exception() is None:
+                return future.result()
+            error = future.exception()
+    if error is not None:
+        raise error
+    stats.count('timeouts')
+    if not _is_read(endpoint):
+        stats.count('unknown')
+        raise OutcomeUnknown(f"{endpoint} 超過 {timeout:.1f} 秒未返回，請求可能已在交易所執行")
+    raise ccxt.RequestTimeout(f"{endpoint} 超過 {timeout:.1f} 秒未返回")
+
+
+def call(name, func, *args, **kwargs):
+    """
+    經由 gateway 調用交易所方法：熔斷檢查、自適應超時、只讀請求的重試與對沖、返回值驗證
+
+    只讀請求（fetch_* / load_markets）在 call_budget 秒內按指數退避重試；
+    下單/撤單類請求只發一次並等待完整的 max_timeout，避免重複下單，超時拋出 OutcomeUnknown。
+    公共端點所有帳戶共用熔斷器，簽名端點按 ExchangeGateway 的帳戶分開（直接調用時不區分帳戶）。
+    """
+    return _call(None, name, func, args, kwargs)
+
+
+def _call(scope, name, func, args, kwargs):
+    endpoint = _normalize(name)
+    key = _endpoint_key(endpoint, scope)
+    breaker, stats = _endpoint_state(key)
+    read = _is_read(endpoint)
+    validator = VALIDATORS.get(endpoint)
+    attempts = SYSTEM_CONFIG['max_retries'] if read else 1
+    deadline = time.monotonic() + (GATEWAY_CONFIG['call_budget'] if read else GATEWAY_CONFIG['max_timeout'])
+
+    for attempt in range(attempts):
+        if not breaker.allow():
+            stats.count('rejected')
+            raise EndpointUnavailable(f"{key} 熔斷中，{breaker.retry_in():.0f} 秒後恢復")
+        remaining = deadline - time.monotonic()
+        timeout = min(stats.timeout() if read else GATEWAY_CONFIG['max_timeout'], remaining)
+        hedge_delay = stats.hedge_delay() if read and GATEWAY_CONFIG['hedge_reads'] else None
+        stats.count('calls')
+        started = time.perf_counter()
+        try:
+            result = _run_once(endpoint, stats, func, args, kwargs, timeout, hedge_delay)
+            stats.record(time.perf_counter() - started)
+            if validator is not None and not validator(result):
+                stats.count('invalid')
+                logging.error("%s 返回了非預期格式的數據: %.200r", endpoint, result)
+                raise ccxt.BadResponse(f"{endpoint} 返回了非預期格式的數據")
+            breaker.record_success()
+            return result
+        except EndpointUnavailable:
+            breaker.abort_probe()
+            raise
+        except OutcomeUnknown:
+            stats.record(time.perf_counter() - started)
+            stats.count('failures')
+            breaker.record_failure()
+            logging.error("%s 請求超時，結果未知，需要查詢訂單或成交確認", key)
+            raise
+        except (ccxt.NetworkError, ccxt.BadResponse) as e:
+            if isinstance(e, ccxt.RequestTimeout):
+                stats.record(time.perf_counter() - started)  # 超時也計入延遲，讓自適應超時隨端點變慢而放寬
+            stats.count('failures')
+            breaker.record_failure()
+            delay = SYSTEM_CONFIG['retry_delay'] * (2 ** attempt)
+            if attempt >= attempts - 1 or time.monotonic() + delay >= deadline:
+                raise
+            logging.warning("%s 請求失敗，%s 秒後重試: %s", endpoint, delay, str(e))
+            time.sleep(delay)
+        except ccxt.BaseError:
+            breaker.record_success()  # 餘額不足、參數錯誤等業務錯誤說明端點本身可用
+            raise
+    raise ccxt.RequestTimeout(f"{endpoint} 在 {GATEWAY_CONFIG['call_budget']} 秒內未成功")
+
+
+class ExchangeGateway:
+    """
+    交易所客戶端代理：fetch_* / create_* / cancel_* / edit_* 與 load_markets 經由 call() 調用，
+    其他屬性（markets、has、set_markets 等）直接轉發到原客戶端
+    """
+
+    def __init__(self, client, scope=None):
+        object.__setattr__(self, '_client', client)
+        object.__setattr__(self, '_scope', scope if scope is not None else f"client-{id(client)}")
+        client.timeout = GATEWAY_CONFIG['max_timeout'] * 1000
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if not callable(attr) or not (_normalize(name).startswith(_ROUTED_PREFIXES) or name in ('load_markets', 'loadMarkets')):
+            return attr
+
+        def routed(*args, **kwargs):
+            return _call(self._scope, name, attr, args, kwargs)
+        routed.__name__ = name
+        routed.routed = True
+        return routed
+
+    def __setattr__(self, name, value):
+        setattr(self._client, name, value)
+
+    @property
+    def client(self):
+        """未經 gateway 的原客戶端"""
+        return self._client
+
+
+def wrap(client, scope=None):
+    """
+    將 ccxt 客戶端包裝為 ExchangeGateway
+    :param scope: 帳戶名，簽名端點的熔斷與統計按此分開
+    """
+    if client is None or isinstance(client, ExchangeGateway):
+        return client
+    return ExchangeGateway(client, scope)
+
+
+def stats():
+    """各端點的熔斷狀態、計數與延遲分位數"""
+    result = {}
+    for endpoint, breaker in list(_breakers.items()):
+        entry = _stats[endpoint].snapshot()
+        entry['state'] = breaker.state
+        entry['timeout'] = _stats[endpoint].timeout()
+        result[endpoint] = entry
+    return result
@@ -0,0 +1,355 @@
+"""
+Flask 端點壓力測試：在臨時目錄中以模擬交易所（EXCHANGE_MODE=fake）啟動 app.py，
+按配置的請求組合驅動多個並發客戶端，輸出吞吐量、p50/p95/p99 延遲、錯誤率與每個請求的交易所調用次數
+
+用法：
+    python loadtest.py --clients 20 --duration 30 --output before.json
+    python loadtest.py --clients 20 --duration 30 --compare before.json
+    python loadtest.py --url http://127.0.0.1:5000 --mix dashboard=1   # 壓測已在運行的服務
+"""
+import os
+import sys
+import json
+import time
+import random
+import socket
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+import urllib.error
+import urllib.request
+from collections import Counter, defaultdict
+from datetime import datetime
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# 請求類型 -> (方法, 路徑模板)
+OPERATIONS = {
+    'index': ('GET', '/'),
+    'dashboard': ('GET', '/api/dashboard'),
+    'manage': ('GET', '/manage_positions/{currency}'),
+    'universe': ('GET', '/api/universe'),
+    'start': ('POST', '/start_trading/{currency}'),
+    'close': ('POST', '/api/close_all_positions/{currency}'),
+}
+
+DEFAULT_MIX = 'index=4,dashboard=8,manage=2,universe=0,start=1,close=0'
+
+
+def parse_mix(text):
+    """'index=4,dashboard=8' -> {'index': 4.0, 'dashboard': 8.0}，權重為 0 的請求類型不發送"""
+    mix = {}
+    for item in text.split(','):
+        if not item.strip():
+            continue
+        name, _, weight = item.partition('=')
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f"未知的請求類型: {name}（可用: {', '.join(OPERATIONS)}）")
+        mix[name] = float(weight or 1)
+    mix = {name: weight for name, weight in mix.items() if weight > 0}
+    if not mix:
+        raise argparse.ArgumentTypeError("請求組合中至少需要一個權重大於 0 的請求類型")
+    return mix
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _request(base_url, method, path, timeout=30, headers=None):
+    """發送請求，返回 (狀態碼, 響應內容)；連線失敗時狀態碼為 None"""
+    req = urllib.request.Request(base_url + path, method=method, headers=headers or {},
+                                 data=b'' if method == 'POST' else None)
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            return resp.status, resp.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read()
+
+
+def _admin_headers():
+    token = os.getenv('ADMIN_TOKEN')
+    return {'X-Admin-Token': token} if token else {}
+
+
+def _exchange_calls(base_url):
+    """從 /api/admin/gateway 讀取所有交易所端點的累計調用次數，不可用時返回 None"""
+    try:
+        status, body = _request(base_url, 'GET', '/api/admin/gateway', headers=_admin_headers())
+        if status != 200:
+            return None
+        endpoints = json.loads(body).get('endpoints', {})
+        return {name: int(entry.get('calls', 0)) for name, entry in endpoints.items()}
+    except Exception:
+        return None
+
+
+def _currencies(base_url):
+    """從 /api/dashboard 讀取可用幣種，用於 manage/start/close 請求"""
+    try:
+        status, body = _request(base_url, 'GET', '/api/dashboard')
+        if status == 200:
+            data = json.loads(body)
+            currencies = list((data.get('trade_info') or data.get('currencies') or {}))
+            if currencies:
+                return currencies
+    except Exception:
+        pass
+    from config import currencies
+    return list(currencies)
+
+
+def start_server(port, strategy=True, exchange_latency=0.0):
+    """
+    在臨時工作目錄中啟動被測服務（狀態文件與日誌不寫入倉庫），等待首頁可訪問
+    :return: (進程, 工作目錄, 日誌文件路徑)
+    """
+    workdir = tempfile.mkdtemp(prefix='loadtest-')
+    log_path = os.path.join(workdir, 'server.log')
+    env = dict(os.environ,
+               EXCHANGE_MODE='fake',
+               FAKE_EXCHANGE_LATENCY=str(exchange_latency),
+               PYTHONPATH=ROOT + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    command = [sys.executable, os.path.join(ROOT, 'loadtest.py'), 'serve', '--port', str(port)]
+    if not strategy:
+        command.append('--no-strategy')
+    with open(log_path, 'wb') as log:
+        process = subprocess.Popen(command, cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"被測服務啟動失敗，詳見日誌 {log_path}")
+        try:
+            if _request(base_url, 'GET', '/', timeout=5)[0] == 200:
+                return process, workdir, log_path
+        except (urllib.error.URLError, ConnectionError, socket.timeout):
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f"被測服務 60 秒內未就緒，詳見日誌 {log_path}")
+
+
+def serve(port, strategy=True):
+    """子進程入口：以模擬交易所運行 app.py（多線程，不使用重載器）"""
+    import app
+    if strategy:
+        app.start_background_tasks()
+    else:
+        from accounts import load_accounts
+        load_accounts()
+    app.app.run(host='127.0.0.1', port=port, threaded=True, use_reloader=False)
+
+
+class Client(threading.Thread):
+    """單個並發客戶端：按權重隨機選擇請求類型，連續發送直到結束時間"""
+
+    def __init__(self, base_url, mix, currencies, stop_at, record_after, seed):
+        super().__init__(daemon=True)
+        self.base_url = base_url
+        self.names = list(mix)
+        self.weights = [mix[name] for name in self.names]
+        self.currencies = currencies
+        self.stop_at = stop_at
+        self.record_after = record_after
+        self.rng = random.Random(seed)
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(Counter)
+
+    def run(self):
+        while True:
+            now = time.monotonic()
+            if now >= self.stop_at:
+                return
+            name = self.rng.choices(self.names, self.weights)[0]
+            method, template = OPERATIONS[name]
+            path = template.format(currency=self.rng.choice(self.currencies))
+            started = time.perf_counter()
+            try:
+                status = _request(self.base_url, method, path)[0]
+            except Exception as e:
+                status = type(e).__name__
+            elapsed = time.perf_counter() - started
+            if now >= self.record_after:
+                self.latencies[name].append(elapsed)
+                self.statuses[name][str(status)] += 1
+
+
+def _percentiles(samples):
+    if not samples:
+        return {'p50': None, 'p95': None, 'p99': None, 'max': None}
+    values = np.asarray(samples) * 1000
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {'p50': round(float(p50), 2), 'p95': round(float(p95), 2),
+            'p99': round(float(p99), 2), 'max': round(float(values.max()), 2)}
+
+
+def _is_error(status):
+    return not status.isdigit() or int(status) >= 500
+
+
+def _git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def run(args):
+    """執行一次壓測並返回報告"""
+    process = workdir = None
+    base_url = args.url
+    if not base_url:
+        port = args.port or _free_port()
+        print(f"在模擬交易所上啟動被測服務（端口 {port}）...")
+        process, workdir, log_path = start_server(port, strategy=not args.no_strategy,
+                                                  exchange_latency=args.exchange_latency)
+        base_url = f"http://127.0.0.1:{port}"
+    try:
+        currencies = _currencies(base_url)
+        calls_before = _exchange_calls(base_url)
+        started = time.monotonic()
+        record_after = started + args.warmup
+        stop_at = record_after + args.duration
+        clients = [Client(base_url, args.mix, currencies, stop_at, record_after, args.seed + i)
+                   for i in range(args.clients)]
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+        calls_after = _exchange_calls(base_url)
+    finally:
+        if process is not None:
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+            if args.keep_logs:
+                print(f"服務日誌: {log_path}")
+            else:
+                shutil.rmtree(workdir, ignore_errors=True)
+
+    latencies = defaultdict(list)
+    statuses = defaultdict(Counter)
+    for client in clients:
+        for name, samples in client.latencies.items():
+            latencies[name].extend(samples)
+        for name, counts in client.statuses.items():
+            statuses[name].update(counts)
+
+    total = sum(len(samples) for samples in latencies.values())
+    errors = sum(count for counts in statuses.values() for status, count in counts.items() if _is_error(status))
+    exchange_calls = None
+    if calls_before is not None and calls_after is not None:
+        exchange_calls = {name: calls_after[name] - calls_before.get(name, 0)
+                          for name in calls_after if calls_after[name] - calls_before.get(name, 0)}
+
+    report = {
+        'timestamp': datetime.now().isoformat(),
+        'revision': _git_revision(),
+        'config': {'clients': args.clients, 'duration': args.duration, 'warmup': args.warmup,
+                   'mix': args.mix, 'seed': args.seed, 'exchange_latency': args.exchange_latency,
+                   'strategy': not args.no_strategy, 'url': args.url},
+        'requests': total,
+        'throughput': round(total / args.duration, 2),
+        'error_rate': round(errors / total, 4) if total else 0.0,
+        'latency_ms': _percentiles([s for samples in latencies.values() for s in samples]),
+        'operations': {name: dict(requests=len(latencies[name]),
+                                  errors=sum(c for s, c in statuses[name].items() if _is_error(s)),
+                                  statuses=dict(statuses[name]),
+                                  **_percentiles(latencies[name]))
+                       for name in sorted(latencies)},
+        'exchange_calls': exchange_calls,
+        # 包含後台策略線程的調用，--no-strategy 時只反映請求本身
+        'exchange_calls_per_request': round(sum(exchange_calls.values()) / total, 3) if exchange_calls is not None and total else None,
+    }
+    return report
+
+
+def _format(value, digits=2):
+    return '-' if value is None else f"{value:.{digits}f}"
+
+
+def _delta(new, old):
+    if new is None or old is None:
+        return ''
+    change = (new - old) / old * 100 if old else 0.0
+    return f" ({change:+.1f}%)"
+
+
+def print_report(report, baseline=None):
+    """打印報告；提供基準報告時在每個數值後顯示變化百分比"""
+    old = baseline or {}
+    old_ops = old.get('operations', {})
+    print(f"\n版本 {report['revision'] or '-'}  客戶端 {report['config']['clients']}  時長 {report['config']['duration']}s")
+    if baseline:
+        print(f"對比基準: 版本 {baseline.get('revision') or '-'} ({baseline.get('timestamp', '-')})")
+    print(f"請求數 {report['requests']}  吞吐量 {_format(report['throughput'])} req/s"
+          f"{_delta(report['throughput'], old.get('throughput'))}")
+    print(f"錯誤率 {report['error_rate'] * 100:.2f}%  每請求交易所調用 {_format(report['exchange_calls_per_request'], 3)}"
+          f"{_delta(report['exchange_calls_per_request'], old.get('exchange_calls_per_request'))}")
+
+    print(f"\n{'請求類型':<12}{'請求數':>8}{'錯誤':>6}{'p50 ms':>18}{'p95 ms':>18}{'p99 ms':>18}{'max ms':>10}")
+    rows = list(report['operations'].items()) + [('全部', dict(report['latency_ms'], requests=report['requests'],
+                                                               errors=round(report['error_rate'] * report['requests'])))]
+    for name, op in rows:
+        base = old.get('latency_ms', {}) if name == '全部' else old_ops.get(name, {})
+        cells = [f"{_format(op[p])}{_delta(op[p], base.get(p))}" for p in ('p50', 'p95', 'p99')]
+        print(f"{name:<12}{op['requests']:>8}{op['errors']:>6}{cells[0]:>18}{cells[1]:>18}{cells[2]:>18}{_format(op['max']):>10}")
+
+    if report['exchange_calls']:
+        print("\n交易所調用: " + ', '.join(f"{name} {count}" for name, count in
+                                          sorted(report['exchange_calls'].items(), key=lambda item: -item[1])))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Flask 端點壓力測試（模擬交易所）')
+    sub = parser.add_subparsers(dest='command')
+    serve_parser = sub.add_parser('serve', help='以模擬交易所運行被測服務（由壓測進程調用）')
+    serve_parser.add_argument('--port', type=int, required=True)
+    serve_parser.add_argument('--no-strategy', action='store_true')
+
+    parser.add_argument('--clients', type=int, default=10, help='並發客戶端數')
+    parser.add_argument('--duration', type=float, default=30, help='計入統計的壓測時長（秒）')
+    parser.add_argument('--warmup', type=float, default=3, help='預熱時長（秒），不計入統計')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help=f"請求組合權重，默認 {DEFAULT_MIX}")
+    parser.add_argument('--seed', type=int, default=0, help='隨機種子，保證不同版本的請求序列一致')
+    parser.add_argument('--exchange-latency', type=float, default=0.05, help='模擬交易所平均延遲（秒）')
+    parser.add_argument('--no-strategy', action='store_true', help='不啟動後台策略線程')
+    parser.add_argument('--port', type=int, help='被測服務端口，默認隨機')
+    parser.add_argument('--url', help='壓測已在運行的服務，不啟動模擬交易所')
+    parser.add_argument('--keep-logs', action='store_true', help='保留被測服務的臨時目錄與日誌')
+    parser.add_argument('--output', help='報告保存路徑（JSON）')
+    parser.add_argument('--compare', help='基準報告路徑，顯示與基準的差異')
+    args = parser.parse_args(argv)
+
+    if args.command == 'serve':
+        serve(args.port, strategy=not args.no_strategy)
+        return 0
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+    report = run(args)
+    print_report(report, baseline)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n報告已保存: {args.output}")
+    return 1 if report['requests'] == 0 else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,184 @@
+import os
+import sys
+import copy
+import gzip
+import json
+import time
+import queue
+import shutil
+import atexit
+import logging
+import threading
+import logging.handlers
+from datetime import datetime
+from config import LOG_CONFIG
+
+_listener = None
+_setup_lock = threading.Lock()
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """每條日誌輸出為一行 JSON，格式化在寫入線程中進行"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+            'module': record.module,
+            'line': record.lineno,
+            'thread': record.threadName
+        }
+        suppressed = getattr(record, 'suppressed', 0)
+        if suppressed:
+            entry['suppressed'] = suppressed
+        dropped = getattr(record, 'dropped', 0)
+        if dropped:
+            entry['dropped'] = dropped
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    按調用位置限流重複日誌：每個 (文件, 行號) 在 interval 秒內最多放行 burst 條，
+    WARNING 及以上級別不受限制。被丟棄的條數會附在下一條放行的日誌上。
+    """
+
+    def __init__(self, interval, burst):
+        super().__init__()
+        self.interval = interval
+        self.burst = burst
+        self._windows = {}  # key -> [窗口開始時間, 已放行條數, 已丟棄條數]
+        self._lock = threading.Lock()  # 引擎、Flask 與 gateway 線程同時記錄日誌
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or self.interval <= 0:
+            return True
+        key = (record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.interval:
+                suppressed = window[2] if window else 0
+                self._windows[key] = [now, 1, 0]
+                if suppressed:
+                    record.suppressed = suppressed
+                return True
+            if window[1] < self.burst:
+                window[1] += 1
+                return True
+            window[2] += 1
+            return False
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    隊列已滿時直接丟棄而不是阻塞。被丟棄的條數會附在下一條入隊的日誌上（JSON 的 dropped 欄位），
+    累計數量可從 stats() 查詢
+    """
+
+    def __init__(self, queue):
+        super().__init__(queue)
+        self.dropped = 0   # 啟動以來丟棄的總條數
+        self._unreported = 0
+        self._lock = threading.Lock()
+
+    def prepare(self, record):
+        # 在調用線程合併訊息參數（參數可能是之後會被修改的可變對象），
+        # 其餘格式化（時間、JSON、異常堆疊）留到寫入線程
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        with self._lock:
+            unreported = self._unreported
+        if unreported:
+            record.dropped = unreported
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+                self._unreported += 1
+            return
+        if unreported:
+            with self._lock:
+                self._unreported -= unreported
+
+
+def _compress(source, dest):
+    tmp = dest + '.tmp'
+    try:
+        with open(source, 'rb') as f_in, gzip.open(tmp, 'wb') as f_out:
+            shutil.copyfileobj(f_in, f_out)
+        os.replace(tmp, dest)
+        os.remove(source)
+    except OSError as e:
+        logging.warning("壓縮日誌文件 %s 失敗: %s", source, e)
+
+
+def _gzip_rotator(source, dest):
+    """輪替時只把舊日誌文件改名，壓縮交給後台線程，寫入線程不等待壓縮"""
+    raw = dest[:-len('.gz')] if dest.endswith('.gz') else dest + '.raw'
+    os.replace(source, raw)
+    threading.Thread(target=_compress, args=(raw, dest), name='log-gzip').start()
+
+
+def stats():
+    """日誌管道狀態：隊列中等待寫入的條數、容量與丟棄的總條數"""
+    handler = next((h for h in logging.getLogger().handlers if isinstance(h, NonBlockingQueueHandler)), None)
+    if handler is None:
+        return {'queued': 0, 'capacity': 0, 'dropped': 0}
+    return {'queued': handler.queue.qsize(), 'capacity': handler.queue.maxsize, 'dropped': handler.dropped}
+
+
+def setup_logging():
+    """
+    建立全局唯一的日誌管道：
+    根 logger 只掛 QueueHandler，由 QueueListener 線程寫入輪替壓縮的 JSON-lines 文件與控制台。
+    重複調用不會重複添加 handler。
+    """
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            return _listener
+
+        log_dir = os.path.dirname(LOG_CONFIG['filename'])
+        if log_dir and not os.path.exists(log_dir):
+            os.makedirs(log_dir)
+
+        file_handler = logging.handlers.RotatingFileHandler(
+            LOG_CONFIG['filename'],
+            maxBytes=LOG_CONFIG['max_bytes'],
+            backupCount=LOG_CONFIG['backup_count'],
+            encoding='utf-8'
+        )
+        file_handler.rotator = _gzip_rotator
+        file_handler.namer = lambda name: name + '.gz'
+        file_handler.setFormatter(JsonLinesFormatter())
+
+        handlers = [file_handler]
+        if LOG_CONFIG['console']:
+            console_handler = logging.StreamHandler(sys.stdout)
+            console_handler.setFormatter(logging.Formatter(LOG_CONFIG['format']))
+            handlers.append(console_handler)
+
+        log_queue = queue.Queue(LOG_CONFIG['queue_size'])
+        queue_handler = NonBlockingQueueHandler(log_queue)
+        queue_handler.addFilter(SamplingFilter(LOG_CONFIG['sample_interval'], LOG_CONFIG['sample_burst']))
+
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(queue_handler)
+        root.setLevel(LOG_CONFIG['level'])
+
+        _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        atexit.register(_listener.stop)
+        return _listener
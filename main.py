@@ -9,167 +9,203 @@ from utils import (
     get_bollinger
 )
 from strategies.entry_strategy import open_position
-from strategies.exit_strategy import calculate_target_price
+from strategies.exit_strategy import calculate_target_price, plan_exits, execute_exit_plan
+from strategies import kernel
+from strategies import take_profit_orders
+from profiler import profiled
+from log_setup import setup_logging
+from accounts import default_account, all_accounts
+from market_data import get_tickers
+import shadow
+import recovery
 
 
-# 設置日誌
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('trading.log'),
-        logging.StreamHandler()  # 同時輸出到控制台
-    ]
-)
+# 設置日誌（與 app.py 共用同一個非阻塞日誌管道）
+setup_logging()
 
 # 檢查交易所是否初始化
 if not exchange:
     logging.error("交易所未初始化，無法執行交易")
     raise RuntimeError("交易所未初始化")
 
-def process_open_position(currency: str, current_price: float):
+def process_open_position(currency: str, current_price: float, account=None):
     """根據條件開倉"""
+    account = account or default_account()
+    info = account.trade_info
     try:
         # 檢查是否為首倉
-        if len(trade_info[currency]['positions']) == 0:
-            success, error_msg = open_position(currency, current_price, first_position_amount)
+        if len(info[currency]['positions']) == 0:
+            success, error_msg = open_position(currency, current_price, first_position_amount, account=account)
             if success:
-                logging.info(f"{currency} 首倉建立成功")
+                logging.info("%s 首倉建立成功", currency)
             else:
-                logging.info(f"{currency} 首倉建立失敗: {error_msg}")
+                logging.info("%s 首倉建立失敗: %s", currency, error_msg)
             return
         
-        # 檢查是否滿足跌幅條件（第 2-12 倉位）
-        last_position = trade_info[currency]['positions'][-1]
-        last_entry_price = last_position['entry_price']
-        price_drop = (last_entry_price - current_price) / last_entry_price * 100
+        # 檢查是否滿足跌幅條件（第 2-12 倉位），先用策略核心判斷，避免無謂的餘額查詢
+        positions = info[currency]['positions']
+        signal = kernel.entry_signal(current_price, None, len(positions), positions[-1]['entry_price'])
         
-        if price_drop >= 6.0:
-            success, error_msg = open_position(currency, current_price, first_position_amount)
+        if signal == kernel.LADDER_ADD:
+            success, error_msg = open_position(currency, current_price, first_position_amount, account=account)
             if success:
-                logging.info(f"{currency} 新倉位建立成功，價格: {current_price:.4f}")
+                logging.info("%s 新倉位建立成功，價格: %.4f", currency, current_price)
             else:
-                logging.info(f"{currency} 新倉位建立失敗: {error_msg}")
+                logging.info("%s 新倉位建立失敗: %s", currency, error_msg)
         else:
-            logging.info(f"{currency} 價格跌幅未達 6%，不建立新倉位")
+            logging.info("%s 價格跌幅未達 %s%%，不建立新倉位", currency, strategy_params['ladder_drop_pct'])
     except Exception as e:
-        logging.error(f"{currency} 處理開倉時發生錯誤: {str(e)}")
+        logging.error("%s 處理開倉時發生錯誤: %s", currency, e)
 
-def process_manage_positions(currency: str, current_price: float):
-    """管理現有倉位"""
+def process_manage_positions(currency: str, current_price: float, account=None):
+    """管理現有倉位：該幣種所有達到止盈價格的倉位合併為一張賣單"""
+    account = account or default_account()
     try:
-        logging.info(f"開始管理 {currency} 倉位")
-        positions = trade_info[currency]['positions']
+        logging.info("開始管理 %s 倉位", currency)
+        positions = account.trade_info[currency]['positions']
         if not positions:
-            logging.info(f" {currency} 無持倉")
+            logging.info(" %s 無持倉", currency)
             return
         
-        logging.info(f" {currency} 當前持倉數量: {len(positions)}")
+        logging.info(" %s 當前持倉數量: %d", currency, len(positions))
         
-        for position in list(positions):  # 使用 list() 避免在迭代中修改列表
-            try:
-                
-                # 計算止盈價格
-                target_price = calculate_target_price(currency, position['entry_price'])
-                             
-                # 如果當前價格達到或超過止盈價格，則賣出該倉位
-                if target_price and current_price >= target_price:
-                    logging.info(f" {currency} 達到止盈價格: {target_price:.4f}")
-                     # 賣出該倉位
-                    amount = position.get('amount')                    
-                    if amount:
-                        order = exchange.create_market_sell_order(f"{currency}/USDT", amount)
-                        if order:
-                            logging.info(f" {currency} 成功賣出倉位")
-                                                       
-                            # 更新每日收益
-                            profit = (current_price - position['entry_price']) * amount
-                            trade_info[currency]['daily_profit'] += profit
-                            
-                            # 從持倉列表中移除該倉位
-                            trade_info[currency]['positions'].remove(position)
-                            save_trade_info_to_file(trade_info)  # 儲存到 JSON 文件
-                        else:
-                            logging.error(f" {currency} 賣出倉位失敗")
-                    else:
-                        logging.error(f" {currency} amount not found in position")
-                else:
-                    logging.info(f" {currency} 當前價格未達到止盈價格: {current_price:.4f} < {target_price:.4f}")
-            
-            except ccxt.InsufficientFunds as e:
-                logging.error(f" {currency} 餘額不足: {str(e)}")
-            except ccxt.NetworkError as e:
-                logging.error(f" {currency} 網路錯誤: {str(e)}")
-            except Exception as e:
-                logging.error(f" {currency} 管理持倉錯誤: {str(e)}")
+        plan = plan_exits({currency: current_price}, account=account)
+        if not plan:
+            logging.info(" %s 當前價格未達到任何倉位的止盈價格: %.4f", currency, current_price)
+            return
+        
+        logging.info(" %s 共 %d 個倉位達到止盈價格", currency, len(plan[currency]['positions']))
+        execute_exit_plan(plan, account=account)
     
     except Exception as e:
-        logging.error(f" {currency} 管理倉位時發生錯誤: {str(e)}")
+        logging.error(" %s 管理倉位時發生錯誤: %s", currency, e)
+
 
+def fetch_cycle_prices():
+    """一次批量獲取本週期所有幣種的最新價格（公共行情，所有帳戶共用）"""
+    tickers = get_tickers([f"{currency}/USDT" for currency in supported_currencies])
+    prices = {}
+    for currency in supported_currencies:
+        ticker = tickers.get(f"{currency}/USDT")
+        if ticker and ticker.get('last') is not None:
+            prices[currency] = float(ticker['last'])
+    return prices
 
-def trade_strategy():
-    """執行交易策略"""
-    if not exchange:
+
+@profiled('cycle')
+def trade_strategy(account=None, prices=None, currencies=None):
+    """
+    執行交易策略
+    :param account: 交易帳戶，預設為主帳戶
+    :param prices: 本週期價格 {currency: price}，未提供時批量獲取
+    :param currencies: 本週期需要檢查的幣種，預設為全部支援的幣種（自適應輪詢只傳入到期的幣種）
+    """
+    account = account or default_account()
+    info = account.trade_info
+    if not account.exchange:
         logging.error("交易所未初始化，無法執行交易策略")
         return
     try:
-        for currency in supported_currencies:
+        # 重試上個週期下單結果未知、尚未對帳的幣種（待對帳的幣種本週期不下單）
+        pending = recovery.reconcile_pending(account)
+        if prices is None:
+            prices = fetch_cycle_prices()
+        exit_prices = {}  # 本週期有持倉的幣種價格，循環結束後統一檢查止盈
+        # 空列表表示本週期沒有需要檢查的幣種（而非全部幣種）
+        for currency in (currencies if currencies is not None else supported_currencies):
             # 使用最新價格
-            ticker = exchange.fetch_ticker(f"{currency}/USDT")
-            current_price = float(ticker['last'])
+            current_price = prices.get(currency)
             if current_price is None:
-                logging.warning(f"{currency} 無法獲取價格，跳過該貨幣")
+                logging.warning("%s 無法獲取價格，跳過該貨幣", currency)
+                continue
+            if currency in pending:
+                logging.warning("%s 有結果未知的訂單待對帳，本週期不下單", currency)
                 continue
             
-            logging.info(f"正在處理 {currency}，當前價格: {current_price}")
+            logging.info("正在處理 %s，當前價格: %s", currency, current_price)
             
             # 檢查是否正在等待開倉
-            if trade_info[currency]['waiting_for_open']:
+            if info[currency]['waiting_for_open']:
                 # 立即檢查是否符合開倉條件
                 bollinger = get_bollinger(f"{currency}/USDT", timeframe='1h', period=20, deviation=2)
                 lower_band = bollinger['lower']  # 布林通道下軌價格
-                if current_price <= lower_band:
-                    success, error_msg = open_position(currency, current_price, first_position_amount)
+                if kernel.entry_signal(current_price, lower_band, 0, None) == kernel.FIRST_ENTRY:
+                    success, error_msg = open_position(currency, current_price, first_position_amount, account=account)
                     if success:
-                        logging.info(f" {currency} 首倉建立成功")
-                        trade_info[currency]['waiting_for_open'] = False  # 建立首倉後，取消等待狀態
+                        logging.info(" %s 首倉建立成功", currency)
+                        info[currency]['waiting_for_open'] = False  # 建立首倉後，取消等待狀態
                     else:
-                        logging.info(f" {currency} 首倉建立失敗: {error_msg}")
-                        trade_info[currency]['waiting_for_open'] = False  # 建立首倉失敗，取消等待狀態
+                        logging.info(" %s 首倉建立失敗: %s", currency, error_msg)
+                        info[currency]['waiting_for_open'] = False  # 建立首倉失敗，取消等待狀態
                 else:
-                    logging.info(f" {currency} 價格尚未觸及下軌，繼續等待")
+                    logging.info(" %s 價格尚未觸及下軌，繼續等待", currency)
                 continue 
             
-            if trade_info[currency]['is_trading'] and len(trade_info[currency]['positions']) < max_positions:
-                process_open_position(currency, current_price) 
+            if info[currency]['is_trading'] and len(info[currency]['positions']) < max_positions:
+                process_open_position(currency, current_price, account=account) 
                
-            if len(trade_info[currency]['positions']) > 0:
-                process_manage_positions(currency, current_price)                 
-              
-             
-            # 保存持倉數據到 JSON 文件
-            save_trade_info_to_file(trade_info)
+            if len(info[currency]['positions']) > 0:
+                exit_prices[currency] = current_price
+        
+        # 交易所端止盈掛單的成交記帳與補掛（按 sync_interval 節流，每次一個未成交訂單請求）
+        take_profit_orders.sync(account)
+        
+        # 所有幣種的止盈倉位合併下單（每個幣種一張賣單，或一次批量下單）
+        plan = plan_exits(exit_prices, account=account)
+        if plan:
+            logging.info("本週期共 %d 個幣種觸發止盈", len(plan))
+            execute_exit_plan(plan, save=False, account=account)
+        
+        # 以本週期價格標記未實現收益
+        for currency, current_price in prices.items():
+            account.pnl.mark(currency, current_price)
+        
+        # 本週期的組合價值、USDT 餘額與各幣種持倉市值追加到權益曲線
+        try:
+            account.equity.append(account.free('USDT'), prices, account.exposure, account.pnl.unrealized_pnl())
+        except Exception as e:
+            logging.error("[%s] 記錄權益曲線失敗: %s", account.name, e)
+        
+        # 影子評估：各組候選參數在同一價格快照上推進虛擬持倉（不下單）
+        shadow.observe(account, prices)
+        
+        # 保存持倉數據到 JSON 文件
+        account.save()
+        
+        # 調試模式下核對增量持倉匯總與全量計算是否一致
+        account.exposure.verify()
     except Exception as e:
-        logging.error(f"交易策略執行錯誤: {str(e)}")
+        logging.error("[%s] 交易策略執行錯誤: %s", account.name, e)
+
+
+def run_all_accounts():
+    """
+    對所有帳戶執行一個交易週期：公共行情只獲取一次，
+    每個帳戶只產生自己的私有 API 請求（餘額、下單）
+    """
+    prices = fetch_cycle_prices()
+    for account in all_accounts():
+        trade_strategy(account=account, prices=prices)
+    return prices
 
 def manage_positions(currency, current_price):
     """管理持倉，檢查是否達到目標價格或止損價格"""
     try:
-        logging.info(f"開始管理 {currency} 倉位")
+        logging.info("開始管理 %s 倉位", currency)
         positions = trade_info[currency]['positions']
         
         if not positions:
-            logging.info(f"{currency} 無持倉")
+            logging.info("%s 無持倉", currency)
             return
             
-        logging.info(f"{currency} 當前持倉數量: {len(positions)}")
+        logging.info("%s 當前持倉數量: %s", currency, len(positions))
         
         for position in positions:
             try:
                 # 檢查是否達到目標價格
                 target_price = calculate_target_price(currency, position['entry_price'])
                 if target_price and current_price >= target_price:
-                    logging.info(f"{currency} 達到目標價格: {target_price}")
+                    logging.info("%s 達到目標價格: %s", currency, target_price)
                     
                     # 將該持倉移除
                     trade_info[currency]['positions'].remove(position)
@@ -178,24 +214,9 @@ def manage_positions(currency, current_price):
                     trade_info[currency]['daily_profit'] += position['profit']
                     
             except Exception as e:
-                logging.error(f"管理持倉錯誤: {str(e)}")
+                logging.error("管理持倉錯誤: %s", e)
                 
     except Exception as e:
-        logging.error(f"管理持倉錯誤: {str(e)}")
-
-#def main():
-    """主程序，定期執行交易策略和更新統計資料"""
-    #while True:
-       # try:
-            # 執行交易策略
-           # trade_strategy()   
-            # 保存持倉數據到 JSON 文件
-           # save_trade_info_to_file(trade_info)
-            # 等待60秒後再次執行
-           # time.sleep(60)
-      #  except Exception as e:
-           # logging.error(f"主程序錯誤: {str(e)}")
-           # time.sleep(60)
+        logging.error("管理持倉錯誤: %s", e)
 
-#if __name__ == "__main__":
-   # main()
\ No newline at end of file
+# 命令行入口（不啟動 Web 服務）見 engine.py：python engine.py --help
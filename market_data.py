@@ -0,0 +1,174 @@
+import time
+import logging
+import threading
+import numpy as np
+from config import MARKET_DATA_CONFIG
+from utils import exchange
+import candles
+
+# 每個交易對的最新快照：symbol -> {'fetched_at': ..., ...}
+_book_cache = {}
+_ticker_cache = {}
+_lock = threading.Lock()
+
+
+def _build_book_snapshot(symbol, orderbook, depth):
+    """從原始訂單簿計算一次流動性指標，之後所有檢查共用"""
+    bids = np.array([level[:2] for level in (orderbook.get('bids') or [])[:depth]], dtype=float).reshape(-1, 2)
+    asks = np.array([level[:2] for level in (orderbook.get('asks') or [])[:depth]], dtype=float).reshape(-1, 2)
+    best_bid = bids[0, 0] if len(bids) else 0.0
+    best_ask = asks[0, 0] if len(asks) else float('inf')
+    spread_pct = (best_ask - best_bid) / best_bid * 100 if best_bid > 0 and len(asks) else float('inf')
+    return {
+        'symbol': symbol,
+        'fetched_at': time.monotonic(),
+        'depth': depth,
+        'bids': bids,
+        'asks': asks,
+        'best_bid': best_bid,
+        'best_ask': best_ask,
+        'mid': (best_bid + best_ask) / 2 if len(bids) and len(asks) else best_bid,
+        'spread_pct': spread_pct,
+        'bid_depth': float(bids[:, 1].sum()) if len(bids) else 0.0,
+        'ask_depth': float(asks[:, 1].sum()) if len(asks) else 0.0,
+        'bid_notional': float((bids[:, 0] * bids[:, 1]).sum()) if len(bids) else 0.0,
+        'ask_notional': float((asks[:, 0] * asks[:, 1]).sum()) if len(asks) else 0.0,
+        # 累計數量與金額，估算滑價時直接查表
+        'bid_cum_amount': np.cumsum(bids[:, 1]) if len(bids) else np.zeros(0),
+        'bid_cum_cost': np.cumsum(bids[:, 0] * bids[:, 1]) if len(bids) else np.zeros(0),
+        'ask_cum_amount': np.cumsum(asks[:, 1]) if len(asks) else np.zeros(0),
+        'ask_cum_cost': np.cumsum(asks[:, 0] * asks[:, 1]) if len(asks) else np.zeros(0)
+    }
+
+
+def get_book_snapshot(symbol, depth=None, max_age=None):
+    """
+    獲取訂單簿快照，在 TTL 內重複調用不會再次請求交易所
+    :param symbol: 交易對（如 'BTC/USDT'）
+    :param depth: 需要的檔位數，超過緩存的檔位數時重新獲取
+    :param max_age: 快照最長有效時間（秒）
+    :return: 快照字典，獲取失敗時返回 None
+    """
+    depth = depth or MARKET_DATA_CONFIG['book_depth']
+    max_age = MARKET_DATA_CONFIG['book_ttl'] if max_age is None else max_age
+    snapshot = _book_cache.get(symbol)
+    if snapshot and snapshot['depth'] >= depth and time.monotonic() - snapshot['fetched_at'] < max_age:
+        return snapshot
+
+    try:
+        orderbook = exchange.fetch_order_book(symbol, limit=depth)
+    except Exception as e:
+        logging.error("%s 獲取訂單簿失敗: %s", symbol, e)
+        return None
+    snapshot = _build_book_snapshot(symbol, orderbook, depth)
+    with _lock:
+        _book_cache[symbol] = snapshot
+    return snapshot
+
+
+def get_ticker(symbol, max_age=None):
+    """獲取行情，在 TTL 內復用上一次的結果"""
+    max_age = MARKET_DATA_CONFIG['ticker_ttl'] if max_age is None else max_age
+    cached = _ticker_cache.get(symbol)
+    if cached and time.monotonic() - cached[0] < max_age:
+        return cached[1]
+    ticker = exchange.fetch_ticker(symbol)
+    with _lock:
+        _ticker_cache[symbol] = (time.monotonic(), ticker)
+    candles.on_ticker(symbol, ticker)
+    return ticker
+
+
+def get_tickers(symbols, max_age=None):
+    """
+    一次批量獲取多個交易對的行情並寫入緩存，所有帳戶共用
+    :return: {symbol: ticker}
+    """
+    max_age = MARKET_DATA_CONFIG['ticker_ttl'] if max_age is None else max_age
+    now = time.monotonic()
+    result = {}
+    missing = []
+    for symbol in symbols:
+        cached = _ticker_cache.get(symbol)
+        if cached and now - cached[0] < max_age:
+            result[symbol] = cached[1]
+        else:
+            missing.append(symbol)
+    if not missing:
+        return result
+
+    try:
+        fetched = exchange.fetch_tickers(missing)
+    except Exception as e:
+        logging.warning("批量獲取行情失敗，改為逐個獲取: %s", e)
+        fetched = {}
+        for symbol in missing:
+            try:
+                fetched[symbol] = exchange.fetch_ticker(symbol)
+            except Exception as inner:
+                logging.error("%s 獲取行情失敗: %s", symbol, inner)
+    now = time.monotonic()
+    with _lock:
+        for symbol, ticker in fetched.items():
+            _ticker_cache[symbol] = (now, ticker)
+    for symbol, ticker in fetched.items():
+        candles.on_ticker(symbol, ticker)
+    result.update({symbol: ticker for symbol, ticker in fetched.items() if symbol in missing})
+    return result
+
+
+def estimate_slippage(snapshot, amount, side='sell'):
+    """
+    估算市價單吃掉訂單簿的平均成交價與滑價
+    :param snapshot: get_book_snapshot 返回的快照
+    :param amount: 下單數量（基礎貨幣）
+    :param side: 'sell' 吃買盤，'buy' 吃賣盤
+    :return: (平均成交價, 相對最優價的滑價百分比)，深度不足時返回 (None, None)
+    """
+    if side == 'sell':
+        levels, cum_amount, cum_cost, best = snapshot['bids'], snapshot['bid_cum_amount'], snapshot['bid_cum_cost'], snapshot['best_bid']
+    else:
+        levels, cum_amount, cum_cost, best = snapshot['asks'], snapshot['ask_cum_amount'], snapshot['ask_cum_cost'], snapshot['best_ask']
+    if amount <= 0 or not len(levels) or cum_amount[-1] < amount:
+        return None, None
+
+    # 找到第一個累計數量足夠的檔位，前面的檔位全部成交，該檔位只成交剩餘部分
+    idx = int(np.searchsorted(cum_amount, amount))
+    filled_before = cum_amount[idx - 1] if idx > 0 else 0.0
+    cost_before = cum_cost[idx - 1] if idx > 0 else 0.0
+    average_price = (cost_before + (amount - filled_before) * levels[idx, 0]) / amount
+    slippage_pct = abs(average_price - best) / best * 100 if best else 0.0
+    return average_price, slippage_pct
+
+
+def check_liquidity(symbol, amount=None, side='sell', max_spread_pct=None, min_quote_volume=None, max_slippage_pct=None):
+    """
+    統一的流動性檢查：買賣差價、24 小時成交額、（給定數量時）預估滑價
+    :return: (是否通過, 原因, 快照)
+    """
+    max_spread_pct = MARKET_DATA_CONFIG['max_spread_pct'] if max_spread_pct is None else max_spread_pct
+    max_slippage_pct = MARKET_DATA_CONFIG['max_slippage_pct'] if max_slippage_pct is None else max_slippage_pct
+
+    snapshot = get_book_snapshot(symbol)
+    if snapshot is None:
+        return False, f"{symbol} 無法獲取訂單簿", None
+
+    if snapshot['spread_pct'] > max_spread_pct:
+        return False, f"{symbol} 買賣差價過大({snapshot['spread_pct']:.2f}%)", snapshot
+
+    if min_quote_volume:
+        try:
+            quote_volume = float(get_ticker(symbol).get('quoteVolume') or 0)
+        except Exception as e:
+            return False, f"{symbol} 獲取行情失敗: {str(e)}", snapshot
+        if quote_volume < min_quote_volume:
+            return False, f"{symbol} 24小時交易量過低({quote_volume:.2f} USDT)", snapshot
+
+    if amount:
+        _, slippage_pct = estimate_slippage(snapshot, amount, side)
+        if slippage_pct is None:
+            return False, f"{symbol} 前 {snapshot['depth']} 檔深度不足以成交 {amount}", snapshot
+        if slippage_pct > max_slippage_pct:
+            return False, f"{symbol} 預估滑價過大({slippage_pct:.2f}%)", snapshot
+
+    return True, None, snapshot
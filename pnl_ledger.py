@@ -0,0 +1,168 @@
+import os
+import json
+import time
+import logging
+import threading
+from datetime import datetime
+from config import PNL_CONFIG, float_safe
+
+_BUCKET_FORMATS = {'hour': '%Y-%m-%dT%H', 'day': '%Y-%m-%d', 'month': '%Y-%m'}
+_RETENTION = {'hour': 'hour_retention', 'day': 'day_retention', 'month': 'month_retention'}
+
+
+def _bucket_keys(ts=None):
+    moment = datetime.fromtimestamp(ts) if ts else datetime.now()
+    return {period: moment.strftime(fmt) for period, fmt in _BUCKET_FORMATS.items()}
+
+
+def ledger_path(state_file):
+    """帳戶持倉文件對應的收益帳本文件，如 trade_info.json -> trade_info_pnl.json"""
+    return os.path.splitext(state_file)[0] + '_pnl.json'
+
+
+class PnLLedger:
+    """
+    一個帳戶的收益帳本：
+    已實現收益在每次成交時按 小時/日/月 預先累加到各幣種與組合的桶中，
+    未實現收益在每次標記價格時按持倉匯總（ExposureBook）計算並增量更新組合合計，
+    儀表板讀取都是字典查找，與倉位和歷史長度無關
+    """
+
+    def __init__(self, path, book, info_by_currency=None):
+        self.path = path
+        self.book = book
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+        self.realized = {}          # currency -> {'total': x, 'hour': {key: x}, 'day': {...}, 'month': {...}}
+        self.portfolio = self._empty()
+        self.unrealized = {}        # currency -> 最近一次標記的未實現收益
+        self.unrealized_total = 0.0
+        self.marks = {}             # currency -> 最近一次標記價格
+        if not self._load() and info_by_currency:
+            self._seed(info_by_currency)
+
+    @staticmethod
+    def _empty():
+        return {'total': 0.0, 'hour': {}, 'day': {}, 'month': {}}
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return False
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.started_at = float_safe(data.get('started_at')) or self.started_at
+            self.realized = data.get('realized', {})
+            self.portfolio = data.get('portfolio') or self._empty()
+            return True
+        except Exception as e:
+            logging.error("載入收益帳本 %s 失敗: %s", self.path, e)
+            return False
+
+    def _seed(self, info_by_currency):
+        """沒有帳本文件時，以 trade_info 中已累計的 total_profit 與最早倉位時間作為起點"""
+        timestamps = []
+        for currency, info in info_by_currency.items():
+            total = float_safe(info.get('total_profit'))
+            if total:
+                self.realized.setdefault(currency, self._empty())['total'] = total
+                self.portfolio['total'] += total
+            timestamps.extend(float_safe(p.get('timestamp')) / 1000 for p in info.get('positions', []) if p.get('timestamp'))
+        if timestamps:
+            self.started_at = min(min(timestamps), self.started_at)
+
+    def save(self):
+        # 在鎖內序列化，避免與其他線程的 record_realized 同時修改桶字典；
+        # 先寫臨時文件再原子替換，中途崩潰不會留下寫了一半的帳本
+        tmp = self.path + '.tmp'
+        with self._lock:
+            try:
+                with open(tmp, 'w', encoding='utf-8') as f:
+                    json.dump({'started_at': self.started_at, 'realized': self.realized, 'portfolio': self.portfolio},
+                              f, ensure_ascii=False)
+                os.replace(tmp, self.path)
+            except Exception as e:
+                logging.error("保存收益帳本 %s 失敗: %s", self.path, e)
+
+    def record_realized(self, currency, profit, ts=None):
+        """
+        一筆成交的已實現收益計入 小時/日/月 桶
+        :param ts: 成交時間（秒），預設為現在
+        """
+        profit = float_safe(profit)
+        if not profit:
+            return
+        keys = _bucket_keys(ts)
+        with self._lock:
+            entry = self.realized.setdefault(currency, self._empty())
+            for target in (entry, self.portfolio):
+                target['total'] += profit
+                for period, key in keys.items():
+                    buckets = target[period]
+                    if key not in buckets:
+                        self._prune(buckets, period)
+                    buckets[key] = buckets.get(key, 0.0) + profit
+
+    @staticmethod
+    def _prune(buckets, period):
+        """新桶建立時（即跨小時/日/月時）順帶清理過期的桶"""
+        excess = len(buckets) + 1 - PNL_CONFIG[_RETENTION[period]]
+        if excess > 0:
+            for key in sorted(buckets)[:excess]:
+                del buckets[key]
+
+    def mark(self, currency, price):
+        """按最新價格重新計算該幣種的未實現收益"""
+        price = float_safe(price)
+        if price <= 0:
+            return
+        totals = self.book.currency_exposure(currency)
+        value = totals['units'] * price - totals['invested']
+        with self._lock:
+            self.unrealized_total += value - self.unrealized.get(currency, 0.0)
+            self.unrealized[currency] = value
+            self.marks[currency] = price
+
+    def _bucket(self, period, currency=None):
+        key = _bucket_keys()[period]
+        target = self.portfolio if currency is None else self.realized.get(currency)
+        return target[period].get(key, 0.0) if target else 0.0
+
+    def hourly(self, currency=None):
+        """本小時已實現收益，currency 為空時為組合合計"""
+        return self._bucket('hour', currency)
+
+    def daily(self, currency=None):
+        """今日已實現收益"""
+        return self._bucket('day', currency)
+
+    def monthly(self, currency=None):
+        """本月已實現收益"""
+        return self._bucket('month', currency)
+
+    def total(self, currency=None):
+        """累計已實現收益"""
+        target = self.portfolio if currency is None else self.realized.get(currency)
+        return target['total'] if target else 0.0
+
+    def unrealized_pnl(self, currency=None):
+        """最近一次標記價格下的未實現收益"""
+        return self.unrealized_total if currency is None else self.unrealized.get(currency, 0.0)
+
+    def annual_return(self, equity):
+        """
+        年化收益率（%）：帳本起點以來的已實現 + 未實現收益相對當前總資產，按運行天數線性年化
+        """
+        if not equity or equity <= 0:
+            return 0.0
+        days = max((time.time() - self.started_at) / 86400, 1.0)
+        return (self.portfolio['total'] + self.unrealized_total) / equity * 365 / days * 100
+
+    def summary(self, currency=None):
+        """儀表板卡片所需的全部收益數字"""
+        return {
+            'daily_profit': self.daily(currency),
+            'monthly_profit': self.monthly(currency),
+            'total_profit': self.total(currency),
+            'unrealized_profit': self.unrealized_pnl(currency)
+        }
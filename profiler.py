@@ -0,0 +1,164 @@
+import os
+import io
+import time
+import signal
+import logging
+import cProfile
+import pstats
+import threading
+import tracemalloc
+from datetime import datetime
+from functools import wraps
+from config import PROFILE_CONFIG
+
+# 剩餘需要分析的次數：'cycle' 對應 trade_strategy 週期，'request' 對應 Flask 請求
+_remaining = {'cycle': 0, 'request': 0}
+_lock = threading.Lock()
+_tracemalloc_started = False
+
+
+def arm(cycles=0, requests=0):
+    """
+    開啟接下來 N 次交易週期 / N 次請求的性能分析
+    :param cycles: 需要分析的 trade_strategy 週期數
+    :param requests: 需要分析的 Flask 請求數
+    :return: 當前狀態
+    """
+    global _tracemalloc_started
+    with _lock:
+        _remaining['cycle'] = max(0, int(cycles))
+        _remaining['request'] = max(0, int(requests))
+        if (cycles or requests) and PROFILE_CONFIG['tracemalloc'] and not tracemalloc.is_tracing():
+            tracemalloc.start(PROFILE_CONFIG['tracemalloc_frames'])
+            _tracemalloc_started = True
+    # 兩類名額都為 0 時視為關閉分析，停止由本模組啟動的 tracemalloc
+    _maybe_stop_tracemalloc()
+    logging.info("性能分析已開啟: 週期 %s 次, 請求 %s 次", cycles, requests)
+    return status()
+
+
+def status():
+    """返回性能分析狀態與已產生的報告文件"""
+    output_dir = PROFILE_CONFIG['output_dir']
+    files = sorted(os.listdir(output_dir)) if os.path.isdir(output_dir) else []
+    return {
+        'remaining_cycles': _remaining['cycle'],
+        'remaining_requests': _remaining['request'],
+        'tracemalloc': tracemalloc.is_tracing(),
+        'output_dir': output_dir,
+        'files': files[-50:]
+    }
+
+
+def _claim(kind):
+    """預留一次分析名額，未開啟時只做一次字典讀取"""
+    if not _remaining[kind]:
+        return False
+    with _lock:
+        if _remaining[kind] <= 0:
+            return False
+        _remaining[kind] -= 1
+        return True
+
+
+def _maybe_stop_tracemalloc():
+    global _tracemalloc_started
+    with _lock:
+        if _tracemalloc_started and not any(_remaining.values()):
+            tracemalloc.stop()
+            _tracemalloc_started = False
+
+
+def begin(kind, label=''):
+    """
+    若該類型仍有分析名額，開始一次分析並返回會話；否則返回 None
+    """
+    if not _claim(kind):
+        return None
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError as e:
+        # 同一時間只能有一個 cProfile 啟用（例如並發請求），歸還名額
+        logging.warning("無法啟動性能分析: %s", e)
+        with _lock:
+            _remaining[kind] += 1
+        return None
+    return {
+        'kind': kind,
+        'label': label or kind,
+        'profiler': profiler,
+        'snapshot': tracemalloc.take_snapshot() if tracemalloc.is_tracing() else None,
+        'started': time.perf_counter()
+    }
+
+
+def end(session):
+    """結束分析會話並寫出報告文件"""
+    if session is None:
+        return None
+    profiler = session['profiler']
+    profiler.disable()
+    elapsed = time.perf_counter() - session['started']
+
+    try:
+        output_dir = PROFILE_CONFIG['output_dir']
+        os.makedirs(output_dir, exist_ok=True)
+        label = ''.join(c if c.isalnum() or c in '-_' else '_' for c in session['label'])
+        base = os.path.join(output_dir, f"{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}_{session['kind']}_{label}")
+
+        # 原始數據可用 snakeviz / pstats 打開
+        profiler.dump_stats(base + '.prof')
+
+        stream = io.StringIO()
+        stream.write(f"{session['kind']} {session['label']} 耗時 {elapsed:.3f} 秒\n\n")
+        stats = pstats.Stats(profiler, stream=stream)
+        stats.sort_stats('cumulative').print_stats(PROFILE_CONFIG['top_n'])
+
+        if session['snapshot'] is not None and tracemalloc.is_tracing():
+            diff = tracemalloc.take_snapshot().compare_to(session['snapshot'], 'lineno')
+            stream.write("\n記憶體變化 (tracemalloc):\n")
+            for stat in diff[:PROFILE_CONFIG['top_n']]:
+                stream.write(f"{stat}\n")
+
+        with open(base + '.txt', 'w', encoding='utf-8') as f:
+            f.write(stream.getvalue())
+        logging.info("性能分析報告已寫入 %s.txt (%.3f 秒)", base, elapsed)
+        return base
+    except Exception as e:
+        logging.error("寫出性能分析報告失敗: %s", e)
+        return None
+    finally:
+        _maybe_stop_tracemalloc()
+
+
+def profiled(kind):
+    """裝飾器：有分析名額時對被裝飾函數進行分析，否則直接調用"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _remaining[kind]:
+                return func(*args, **kwargs)
+            session = begin(kind, func.__name__)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                end(session)
+        return wrapper
+    return decorator
+
+
+def install_signal_handler():
+    """
+    註冊 SIGUSR1：收到信號後分析接下來 PROFILE_CONFIG['signal_cycles'] 個交易週期
+    只能在主線程調用，Windows 上沒有 SIGUSR1 時直接略過
+    """
+    sig = getattr(signal, 'SIGUSR1', None)
+    if sig is None or threading.current_thread() is not threading.main_thread():
+        return False
+
+    def _handler(signum, frame):
+        arm(cycles=PROFILE_CONFIG['signal_cycles'], requests=_remaining['request'])
+
+    signal.signal(sig, _handler)
+    return True
@@ -0,0 +1,213 @@
+import time
+import logging
+from config import RECOVERY_CONFIG, float_safe
+from accounts import default_account, all_accounts
+from strategies.exit_strategy import calculate_target_price, _allocate_fill
+
+DAY_MS = 86400000
+
+
+def _fetch_trades(client, since, symbols):
+    """
+    拉取 since 之後的所有成交；交易所不支援全市場查詢時逐交易對查詢，
+    不支援成交查詢時改用已完成訂單
+    :return: (按訂單匯總的成交 {order_id: {...}}, 請求次數)
+    """
+    if client.has.get('fetchMyTrades'):
+        try:
+            trades = client.fetch_my_trades(None, since, None, {'paginate': True})
+            return _orders_from_trades(trades), 1
+        except Exception as e:
+            logging.warning("全市場成交查詢失敗，改為逐交易對查詢: %s", e)
+            trades = []
+            for symbol in symbols:
+                trades.extend(client.fetch_my_trades(symbol, since, None, {'paginate': True}))
+            return _orders_from_trades(trades), 1 + len(symbols)
+
+    orders = {}
+    for symbol in symbols:
+        for order in client.fetch_closed_orders(symbol, since):
+            filled = float_safe(order.get('filled'))
+            if filled > 0:
+                orders[order['id']] = {
+                    'id': order['id'],
+                    'symbol': order['symbol'],
+                    'side': order['side'],
+                    'amount': filled,
+                    'cost': float_safe(order.get('cost')) or filled * float_safe(order.get('average')),
+                    'base_fee': _base_fee(order),
+                    'timestamp': order.get('lastTradeTimestamp') or order.get('timestamp')
+                }
+    return orders, len(symbols)
+
+
+def _base_fee(item):
+    """以基礎幣種收取的手續費（會減少實際到帳的數量）"""
+    fee = item.get('fee') or {}
+    symbol = item.get('symbol') or ''
+    if fee.get('currency') and fee['currency'] == symbol.split('/')[0]:
+        return abs(float_safe(fee.get('cost')))
+    return 0.0
+
+
+def _orders_from_trades(trades):
+    """同一訂單的多筆成交合併為一筆，成交號去重（分頁邊界可能重複）"""
+    seen = set()
+    orders = {}
+    for trade in trades:
+        if trade.get('id') in seen:
+            continue
+        seen.add(trade.get('id'))
+        order_id = trade.get('order') or trade.get('id')
+        order = orders.setdefault(order_id, {
+            'id': order_id, 'symbol': trade['symbol'], 'side': trade['side'],
+            'amount': 0.0, 'cost': 0.0, 'base_fee': 0.0, 'timestamp': trade['timestamp']
+        })
+        order['amount'] += float_safe(trade.get('amount'))
+        order['cost'] += float_safe(trade.get('cost')) or float_safe(trade.get('amount')) * float_safe(trade.get('price'))
+        order['base_fee'] += _base_fee(trade)
+        order['timestamp'] = max(order['timestamp'], trade['timestamp'])
+    return orders
+
+
+def _replay(account, currency, order):
+    """將一筆未反映到持倉的訂單回放到 trade_info"""
+    info = account.trade_info[currency]
+    price = order['cost'] / order['amount']
+    if order['side'] == 'buy':
+        amount = order['amount'] - order['base_fee']
+        info['positions'].append({
+            'entry_price': price,
+            'amount': amount,
+            'target_price': calculate_target_price(currency, price),
+            'profit': 0,
+            'timestamp': order['timestamp']
+        })
+        logging.info("%s 回放買入訂單 %s: %.6f @ %.4f", currency, order['id'], amount, price)
+    else:
+        # 交易所端止盈掛單的成交分配給掛單所屬的倉位；其他賣出無法得知是止盈還是再平衡，
+        # 按入場價從低到高分配（止盈總是先觸發低入場價的倉位）
+        matched = [p for p in info['positions'] if (p.get('tp_order') or {}).get('id') == order['id']]
+        entry = {'positions': matched + sorted((p for p in info['positions'] if p not in matched),
+                                               key=lambda p: float_safe(p['entry_price']))}
+        realized = _allocate_fill(account, currency, entry, order['amount'], price, order['timestamp'] / 1000)
+        logging.info("%s 回放賣出訂單 %s: %.6f @ %.4f, 實現收益 %.2f", currency, order['id'], order['amount'], price, realized)
+    info['is_trading'] = bool(info['positions'])
+
+
+def recover(account=None, currencies=None):
+    """
+    重啟恢復：只拉取各幣種成交檢查點之後的成交，回放檢查點中沒有記錄的訂單，
+    耗時只與停機期間的成交數量有關，與運行時長無關
+
+    沒有檢查點的幣種：已有持倉時從現在開始記錄；沒有持倉時從 bootstrap_days 天前的成交重建，
+    以實際成交價作為入場價格
+
+    Args:
+        currencies (list): 只恢復這些幣種（分片模式下為本分片的幣種），預設為全部
+
+    Returns:
+        dict: 恢復報告（掃描/回放的訂單數、請求次數、耗時）
+    """
+    account = account or default_account()
+    started = time.perf_counter()
+    report = {'account': account.name, 'orders_scanned': 0, 'orders_replayed': 0, 'requests': 0, 'elapsed': 0.0}
+    client = account.exchange
+    if not client:
+        logging.error("帳戶 %s 交易所未初始化，跳過恢復", account.name)
+        return report
+
+    info = account.trade_info
+    now_ms = int(time.time() * 1000)
+    overlap_ms = RECOVERY_CONFIG['overlap_seconds'] * 1000
+    checkpoints = {}
+    for currency, currency_info in info.items():
+        if currencies is not None and currency not in currencies:
+            continue
+        checkpoint = currency_info.setdefault('fill_checkpoint', {'timestamp': None, 'order_ids': []})
+        if checkpoint['timestamp'] is None:
+            checkpoint['timestamp'] = now_ms if currency_info['positions'] else now_ms - RECOVERY_CONFIG['bootstrap_days'] * DAY_MS
+        checkpoints[currency] = checkpoint
+
+    try:
+        since = min(cp['timestamp'] for cp in checkpoints.values()) - overlap_ms
+        orders, report['requests'] = _fetch_trades(client, since, [f"{c}/USDT" for c in checkpoints])
+    except Exception as e:
+        logging.error("帳戶 %s 拉取成交失敗，沿用已保存的持倉: %s", account.name, e)
+        report['error'] = str(e)
+        return report
+
+    report['orders_scanned'] = len(orders)
+    for order in sorted(orders.values(), key=lambda o: o['timestamp']):
+        currency = order['symbol'].split('/')[0]
+        checkpoint = checkpoints.get(currency)
+        if checkpoint is None or not order['symbol'].endswith('/USDT') or order['amount'] <= 0:
+            continue
+        if order['id'] in checkpoint['order_ids'] or order['timestamp'] < checkpoint['timestamp'] - overlap_ms:
+            continue
+        try:
+            _replay(account, currency, order)
+            account.mark_applied(currency, order)
+            report['orders_replayed'] += 1
+        except Exception as e:
+            logging.error("%s 回放訂單 %s 失敗: %s", currency, order['id'], e)
+
+    for checkpoint in checkpoints.values():
+        checkpoint['timestamp'] = max(checkpoint['timestamp'], now_ms - overlap_ms)
+    account.exposure.rebuild()
+    account.save()
+
+    report['elapsed'] = time.perf_counter() - started
+    logging.info("帳戶 %s 恢復完成: 掃描訂單 %d, 回放 %d, 請求 %d, 耗時 %.2f 秒",
+                 account.name, report['orders_scanned'], report['orders_replayed'], report['requests'], report['elapsed'])
+    return report
+
+
+def reconcile_unknown(account, currency):
+    """
+    下單請求超時、結果未知（gateway.OutcomeUnknown）時調用：標記該幣種待對帳並立即從成交檢查點查詢一次，
+    訂單已在交易所成交時回放到持倉；還查不到時由 reconcile_pending 在之後的週期重試，
+    待對帳期間該幣種不再下新訂單，避免重複買入或賣出
+
+    Returns:
+        bool: 是否已完成對帳
+    """
+    info = account.trade_info[currency]
+    if not info.get('pending_reconcile'):
+        info['pending_reconcile'] = {'since': int(time.time() * 1000)}
+    logging.warning("%s 下單結果未知，從成交記錄對帳", currency)
+    return _reconcile(account, currency)
+
+
+def _reconcile(account, currency):
+    info = account.trade_info[currency]
+    report = recover(account, [currency])
+    if report.get('error'):
+        return False
+    if report['orders_replayed']:
+        logging.info("%s 對帳完成: 回放 %d 張訂單", currency, report['orders_replayed'])
+    elif time.time() * 1000 - info['pending_reconcile']['since'] > RECOVERY_CONFIG['unknown_grace_seconds'] * 1000:
+        logging.warning("%s 超過 %d 秒未查到成交，視為訂單未執行", currency, RECOVERY_CONFIG['unknown_grace_seconds'])
+    else:
+        return False
+    info['pending_reconcile'] = None
+    account.save()
+    return True
+
+
+def reconcile_pending(account=None):
+    """重試所有待對帳的幣種（每個交易週期開始時調用），返回仍待對帳的幣種"""
+    account = account or default_account()
+    pending = []
+    for currency, info in account.trade_info.items():
+        if info.get('pending_reconcile') and not _reconcile(account, currency):
+            pending.append(currency)
+    return pending
+
+
+def recover_all():
+    """恢復所有已載入的帳戶，返回各帳戶的恢復報告"""
+    started = time.perf_counter()
+    reports = [recover(account) for account in all_accounts()]
+    logging.info("所有帳戶恢復完成，可開始交易，耗時 %.2f 秒", time.perf_counter() - started)
+    return reports
@@ -0,0 +1,207 @@
+import math
+import time
+import logging
+import threading
+import numpy as np
+from config import SCANNER_CONFIG, MARKET_DATA_CONFIG, indicator_params
+from utils import exchange
+
+# OHLCV 收盤價緩存：symbol -> {'closes': ndarray, 'last_ts': 最後一根K線開盤時間(ms), 'fetched_at': ...}
+_closes_cache = {}
+_last_scan = {'time': 0.0, 'results': [], 'stats': {}}
+_lock = threading.Lock()
+_scan_lock = threading.Lock()  # 同一時間只有一個掃描在執行（single-flight）
+
+_TIMEFRAME_MS = {'1m': 60000, '5m': 300000, '15m': 900000, '1h': 3600000, '4h': 14400000, '1d': 86400000}
+
+
+def _prefilter(tickers):
+    """
+    第一步：只用一次批量行情做篩選，與 rebalance 相同的成交額與買賣差價門檻
+    :return: [(symbol, last, quote_volume, spread_pct), ...]，按成交額從大到小
+    """
+    markets = getattr(exchange, 'markets', None) or {}
+    survivors = []
+    for symbol, ticker in tickers.items():
+        if not symbol.endswith('/USDT'):
+            continue
+        market = markets.get(symbol)
+        if market and (market.get('type') != 'spot' or market.get('active') is False):
+            continue
+        if symbol.split('/')[0] in SCANNER_CONFIG['exclude']:
+            continue
+        last = ticker.get('last')
+        bid, ask = ticker.get('bid'), ticker.get('ask')
+        quote_volume = float(ticker.get('quoteVolume') or 0)
+        if not last or not bid or not ask or bid <= 0:
+            continue
+        spread_pct = (ask - bid) / bid * 100
+        if quote_volume < MARKET_DATA_CONFIG['min_quote_volume'] or spread_pct > MARKET_DATA_CONFIG['max_spread_pct']:
+            continue
+        survivors.append((symbol, float(last), quote_volume, spread_pct))
+    survivors.sort(key=lambda item: -item[2])
+    return survivors
+
+
+def _refresh_closes(symbols, budget):
+    """
+    第二步：在請求預算內刷新K線，只刷新已經開始新K線的交易對，
+    最久未刷新的優先，剩餘的交易對留到下一次掃描
+    :return: 本次實際發出的請求數
+    """
+    timeframe = SCANNER_CONFIG['timeframe']
+    frame_ms = _TIMEFRAME_MS.get(timeframe, 3600000)
+    limit = indicator_params['bollinger']['period'] + 1
+    now_ms = time.time() * 1000
+
+    stale = []
+    for symbol in symbols:
+        cached = _closes_cache.get(symbol)
+        if cached is None:
+            stale.append((0, symbol))
+        elif now_ms >= cached['last_ts'] + frame_ms:
+            stale.append((cached['fetched_at'], symbol))
+    stale.sort()
+
+    requests = 0
+    for _, symbol in stale[:budget]:
+        try:
+            ohlcv = exchange.fetch_ohlcv(symbol, timeframe=timeframe, limit=limit)
+            requests += 1
+            closes = np.array([candle[4] for candle in ohlcv if len(candle) >= 5], dtype=float)
+            if len(ohlcv):
+                with _lock:
+                    _closes_cache[symbol] = {'closes': closes, 'last_ts': ohlcv[-1][0], 'fetched_at': time.monotonic()}
+        except Exception as e:
+            requests += 1
+            logging.warning("%s 獲取K線失敗: %s", symbol, e)
+    return requests
+
+
+def _score(survivors):
+    """
+    第三步：所有交易對的收盤價拼成一個矩陣，一次計算布林通道與波動率並排序
+    """
+    period = indicator_params['bollinger']['period']
+    deviation = indicator_params['bollinger']['deviation']
+    rows, meta = [], []
+    for symbol, last, quote_volume, spread_pct in survivors:
+        cached = _closes_cache.get(symbol)
+        if cached is None or len(cached['closes']) < period + 1:
+            continue
+        rows.append(cached['closes'][-(period + 1):])
+        meta.append((symbol, last, quote_volume, spread_pct))
+    if not rows:
+        return []
+
+    closes = np.vstack(rows)                     # (n, period + 1)
+    window = closes[:, 1:]
+    sma = window.mean(axis=1)
+    std = window.std(axis=1)
+    lower = sma - deviation * std
+    upper = sma + deviation * std
+    log_returns = np.diff(np.log(closes), axis=1)
+    volatility = log_returns.std(axis=1)
+    last = np.array([m[1] for m in meta])
+    width = np.where(upper > lower, upper - lower, np.nan)
+    percent_b = (last - lower) / width          # < 0 表示跌破下軌
+    # 跌破下軌越深、相對波動越小的交易對排名越前
+    with np.errstate(divide='ignore', invalid='ignore'):
+        score = np.where(volatility > 0, -percent_b / (1 + volatility * 100), -percent_b)
+
+    order = np.argsort(-np.nan_to_num(score, nan=-np.inf))
+    results = []
+    for i in order:
+        symbol, price, quote_volume, spread_pct = meta[i]
+        results.append({
+            'symbol': symbol,
+            'price': price,
+            'quote_volume': quote_volume,
+            'spread_pct': spread_pct,
+            'lower': float(lower[i]),
+            'middle': float(sma[i]),
+            'upper': float(upper[i]),
+            'percent_b': float(percent_b[i]),
+            'volatility': float(volatility[i]),
+            'score': float(score[i]),
+            'below_lower_band': bool(price <= lower[i])
+        })
+    return results
+
+
+def scan_universe(force=False):
+    """
+    掃描所有 USDT 現貨交易對並排序入場候選
+    一次批量行情 + 預算內的K線請求，K線按收盤週期緩存，500+ 交易對會在數個週期內輪流刷新
+
+    覆蓋範圍：每次掃描最多刷新 ohlcv_budget 個交易對的K線，只有已緩存K線的交易對參與評分。
+    通過篩選的 N 個交易對需要 ceil(N / ohlcv_budget) 次掃描才全部有數據；每根K線收盤後每個交易對
+    需要再刷新一次，所以每個K線週期內最多能保持 ohlcv_budget * (K線週期 / scan_interval) 個交易對
+    為最新數據（預設 40 * 60 = 2400），超出的交易對按最久未刷新優先輪流使用上一根K線評分。
+    本次的覆蓋情況見 last_scan_stats() 的 cached / scans_to_cover
+    :return: 排序後的候選列表
+    """
+    if not force and time.monotonic() - _last_scan['time'] < SCANNER_CONFIG['scan_interval']:
+        return _last_scan['results']
+    if not exchange:
+        logging.error("交易所未初始化，無法掃描交易對")
+        return []
+
+    started = time.perf_counter()
+    try:
+        tickers = exchange.fetch_tickers()
+    except Exception as e:
+        logging.error("批量獲取行情失敗: %s", e)
+        return _last_scan['results']
+
+    survivors = _prefilter(tickers)[:SCANNER_CONFIG['max_symbols']]
+    requests = _refresh_closes([s[0] for s in survivors], SCANNER_CONFIG['ohlcv_budget'])
+    results = _score(survivors)
+    missing = sum(1 for s in survivors if s[0] not in _closes_cache)
+
+    stats = {
+        'tickers': len(tickers),
+        'survivors': len(survivors),
+        'scored': len(results),
+        'cached': len(survivors) - missing,
+        'scans_to_cover': math.ceil(missing / SCANNER_CONFIG['ohlcv_budget']) if missing else 0,
+        'ohlcv_requests': requests,
+        'elapsed': time.perf_counter() - started
+    }
+    with _lock:
+        _last_scan.update({'time': time.monotonic(), 'results': results, 'stats': stats})
+    logging.info("交易對掃描完成: 行情 %d, 通過篩選 %d, 已評分 %d, K線請求 %d, 耗時 %.2f 秒",
+                 stats['tickers'], stats['survivors'], stats['scored'], requests, stats['elapsed'])
+    return results
+
+
+def scan_in_background():
+    """
+    Web 請求使用：立即返回上一次的掃描結果，到期時由一個後台線程掃描，請求不等待K線請求
+    """
+    if time.monotonic() - _last_scan['time'] >= SCANNER_CONFIG['scan_interval'] and _scan_lock.acquire(blocking=False):
+        try:
+            threading.Thread(target=_background_scan, daemon=True, name='universe-scan').start()
+        except Exception as e:
+            # 線程未啟動時 _background_scan 不會釋放鎖，否則之後再也不會掃描
+            _scan_lock.release()
+            logging.error("啟動後台掃描失敗: %s", e)
+    return _last_scan['results']
+
+
+def _background_scan():
+    """後台掃描，調用方已持有 _scan_lock"""
+    try:
+        scan_universe()
+    except Exception as e:
+        logging.error("後台掃描交易對失敗: %s", e)
+    finally:
+        _scan_lock.release()
+
+
+def scanning():
+    return _scan_lock.locked()
+
+
+def last_scan_stats():
+    return dict(_last_scan['stats'])
@@ -0,0 +1,252 @@
+import math
+import time
+import logging
+from config import SCHEDULER_CONFIG, strategy_params, max_positions, supported_currencies, float_safe
+from accounts import all_accounts
+from market_data import get_tickers
+from utils import exchange, get_bollinger
+from strategies.kernel import take_profit_prices
+from main import trade_strategy
+import commands
+
+
+class TokenBucket:
+    """每分鐘請求預算：容量為 requests_per_minute，按秒均勻補充"""
+
+    def __init__(self, per_minute, clock=time.monotonic):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self.clock = clock
+        self.updated = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def available(self):
+        self._refill()
+        return self.tokens
+
+    def take(self, cost=1.0):
+        self._refill()
+        if self.tokens < cost:
+            return False
+        self.tokens -= cost
+        return True
+
+    def wait_time(self, cost=1.0):
+        """距離可以支付 cost 還需要等待的秒數"""
+        self._refill()
+        return 0.0 if self.tokens >= cost else (cost - self.tokens) / self.rate
+
+
+class PollScheduler:
+    """
+    自適應輪詢：每個幣種的下次檢查時間由價格到最近觸發價的距離與近期波動率決定，
+    把價格波動近似為隨機遊走，預期觸及時間 ≈ (距離 / 每秒波動率)^2，檢查間隔取其 time_fraction 倍，
+    限制在 [min_interval, max_interval] 之間；到期的幣種合併為一次批量行情請求，受全局請求預算限制
+    """
+
+    def __init__(self, currencies=None, requests_per_minute=None, clock=time.monotonic):
+        config = SCHEDULER_CONFIG
+        self.currencies = list(currencies or supported_currencies)
+        self.clock = clock
+        self.budget = TokenBucket(requests_per_minute or config['requests_per_minute'], clock)
+        self.batch = bool(exchange is None or exchange.has.get('fetchTickers'))
+        default_var = (config['default_hourly_vol'] ** 2) / 3600
+        self._alpha = 1 - 0.5 ** (1 / config['vol_halflife'])
+        now = clock()
+        self.state = {c: {'next_check': now, 'price': None, 'observed': None, 'var': default_var,
+                          'distance': None, 'trigger': None, 'interval': None} for c in self.currencies}
+        self._bands = {}
+        self.counts = {'polls': 0, 'requests': 0, 'checks': 0, 'throttled': 0}
+        self.started = now
+
+    def observe(self, currency, price, now=None):
+        """記錄一次報價，以對數收益率平方 / 間隔秒數更新每秒方差的 EWMA"""
+        now = self.clock() if now is None else now
+        entry = self.state[currency]
+        if entry['price'] and entry['observed'] is not None and price > 0 and now > entry['observed']:
+            sample = math.log(price / entry['price']) ** 2 / (now - entry['observed'])
+            entry['var'] += self._alpha * (sample - entry['var'])
+        entry['price'], entry['observed'] = price, now
+
+    def _lower_band(self, currency, now):
+        cached = self._bands.get(currency)
+        if cached and now - cached[0] < SCHEDULER_CONFIG['band_ttl']:
+            return cached[1]
+        bollinger = get_bollinger(f"{currency}/USDT", timeframe='1h', period=20, deviation=2)
+        lower = bollinger.get('lower') if bollinger else None
+        self._bands[currency] = (now, lower)
+        return lower
+
+    def triggers(self, currency, now=None):
+        """
+        該幣種在所有帳戶中的觸發價：止盈價格（最低的一個）、下一加倉價、首倉的布林通道下軌
+        :return: [(名稱, 價格), ...]
+        """
+        now = self.clock() if now is None else now
+        result = []
+        need_band = False
+        for account in all_accounts():
+            info = account.trade_info.get(currency)
+            if not info:
+                continue
+            positions = info['positions']
+            if positions:
+                # 有交易所端止盈掛單的倉位不需要輪詢止盈
+                targets = take_profit_prices([float_safe(p.get('entry_price')) for p in positions if not p.get('tp_order')])
+                targets = targets[targets == targets]
+                if len(targets):
+                    result.append(('take_profit', float(targets.min())))
+                if info.get('is_trading') and len(positions) < max_positions:
+                    last_entry = float_safe(positions[-1].get('entry_price'))
+                    if last_entry > 0:
+                        result.append(('ladder', last_entry * (1 - strategy_params['ladder_drop_pct'] / 100)))
+            elif info.get('waiting_for_open') or info.get('is_trading'):
+                need_band = True
+        if need_band:
+            lower = self._lower_band(currency, now)
+            if lower:
+                result.append(('lower_band', float(lower)))
+        return result
+
+    def schedule(self, currency, now=None):
+        """根據最新價格重新計算該幣種的下次檢查時間"""
+        now = self.clock() if now is None else now
+        config = SCHEDULER_CONFIG
+        entry = self.state[currency]
+        price = entry['price']
+        triggers = self.triggers(currency, now) if price else []
+        if not triggers:
+            entry.update(distance=None, trigger=None, interval=config['max_interval'])
+        else:
+            name, level = min(triggers, key=lambda t: abs(price - t[1]))
+            distance = abs(price - level) / price
+            # 已越過觸發價（止盈價在下方、加倉價/下軌在上方）時距離為 0，盡快檢查
+            crossed = price >= level if name == 'take_profit' else price <= level
+            distance = 0.0 if crossed else distance
+            expected = (distance ** 2) / max(entry['var'], 1e-18)
+            interval = min(config['max_interval'], max(config['min_interval'], expected * config['time_fraction']))
+            entry.update(distance=distance, trigger=name, interval=interval)
+        entry['next_check'] = now + entry['interval']
+        return entry['interval']
+
+    def due(self, now=None):
+        """到期需要檢查的幣種，越接近觸發價的越靠前"""
+        now = self.clock() if now is None else now
+        due = [c for c in self.currencies if self.state[c]['next_check'] <= now]
+        return sorted(due, key=lambda c: self.state[c]['distance'] if self.state[c]['distance'] is not None else 1.0)
+
+    def poll(self, now=None):
+        """
+        在預算內批量獲取到期幣種的行情
+        :return: (到期並已更新價格的幣種, {currency: price})；預算不足時返回 ([], {})
+        """
+        now = self.clock() if now is None else now
+        due = self.due(now)
+        if not due:
+            return [], {}
+        if self.batch:
+            if not self.budget.take(1):
+                self.counts['throttled'] += 1
+                return [], {}
+            cost = 1
+        else:
+            # 不支援批量行情時每個交易對一個請求，預算不足時只檢查最接近觸發價的幾個
+            affordable = int(self.budget.available())
+            if affordable < 1:
+                self.counts['throttled'] += 1
+                return [], {}
+            due = due[:affordable]
+            cost = len(due)
+            self.budget.take(cost)
+
+        tickers = get_tickers([f"{c}/USDT" for c in due], max_age=0)
+        self.counts['polls'] += 1
+        self.counts['requests'] += cost
+        prices = {}
+        for currency in due:
+            ticker = tickers.get(f"{currency}/USDT")
+            if ticker and ticker.get('last') is not None:
+                prices[currency] = float(ticker['last'])
+                self.observe(currency, prices[currency], now)
+        return due, prices
+
+    def step(self):
+        """
+        執行一次輪詢與策略檢查
+        :return: 距離下次需要執行的秒數
+        """
+        now = self.clock()
+        due, prices = self.poll(now)
+        if due and not prices:
+            # 行情請求沒有返回任何到期幣種的價格：不以舊價格運行策略，到期幣種保持到期，下一步重試
+            logging.warning("到期的 %s 個幣種均未獲取到最新價格，跳過本次策略檢查", len(due))
+            return self.sleep_time()
+        if due:
+            # 策略只檢查到期的幣種；未到期幣種沿用最近價格，用於收益標記與權益曲線
+            all_prices = {c: e['price'] for c, e in self.state.items() if e['price']}
+            all_prices.update(prices)
+            for account in all_accounts():
+                trade_strategy(account=account, prices=all_prices, currencies=[c for c in due if c in prices])
+            self.counts['checks'] += len(prices)
+            for currency in due:
+                self.schedule(currency, self.clock())
+        return self.sleep_time()
+
+    def sleep_time(self):
+        now = self.clock()
+        next_due = min(entry['next_check'] for entry in self.state.values()) - now
+        wait = max(next_due, self.budget.wait_time(1))
+        return max(SCHEDULER_CONFIG['idle_sleep'], wait)
+
+    def run(self, stop=None, max_steps=None):
+        """主循環，stop 為 threading.Event；max_steps 用於測試與基準"""
+        steps = 0
+        while not (stop and stop.is_set()) and (max_steps is None or steps < max_steps):
+            try:
+                delay = self.step()
+            except Exception as e:
+                logging.error("自適應輪詢執行錯誤: %s", e)
+                delay = SCHEDULER_CONFIG['min_interval']
+            steps += 1
+            # 等待期間執行手動交易命令，涉及的幣種在下一步立即檢查
+            for job in commands.serve(delay, stop):
+                if job and job['currency'] in self.state:
+                    self.state[job['currency']]['next_check'] = self.clock()
+
+    def status(self):
+        """每個幣種的觸發類型、距離、檢查間隔與下次檢查時間，以及輪詢統計"""
+        now = self.clock()
+        elapsed_minutes = max((now - self.started) / 60, 1e-9)
+        return {
+            'requests_per_minute': round(self.counts['requests'] / elapsed_minutes, 2),
+            'budget': self.budget.capacity,
+            'tokens': round(self.budget.available(), 2),
+            'counts': dict(self.counts),
+            'currencies': {
+                currency: {
+                    'price': entry['price'],
+                    'trigger': entry['trigger'],
+                    'distance_pct': round(entry['distance'] * 100, 3) if entry['distance'] is not None else None,
+                    'hourly_vol_pct': round(math.sqrt(entry['var'] * 3600) * 100, 3),
+                    'interval': round(entry['interval'], 1) if entry['interval'] is not None else None,
+                    'next_check_in': round(entry['next_check'] - now, 1)
+                }
+                for currency, entry in self.state.items()
+            }
+        }
+
+
+_scheduler = None
+
+
+def get_scheduler():
+    """進程內共用的輪詢調度器"""
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = PollScheduler()
+    return _scheduler
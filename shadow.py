@@ -0,0 +1,259 @@
+import os
+import json
+import time
+import logging
+import itertools
+import threading
+import numpy as np
+from config import (SHADOW_CONFIG, supported_currencies, strategy_params, max_positions,
+                    total_investment_limit, first_position_amount, float_safe)
+from utils import get_bollinger
+from strategies import kernel
+
+
+def build_variants():
+    """網格組合加上額外的參數組，每組補齊預設值；實盤參數（baseline）始終包含在內"""
+    grid = SHADOW_CONFIG['grid']
+    keys = sorted(grid)
+    candidates = [dict(zip(keys, values)) for values in itertools.product(*(grid[k] for k in keys))]
+    candidates.append({})  # 實盤參數
+    candidates.extend(SHADOW_CONFIG['variants'])
+    variants = []
+    seen = set()
+    for candidate in candidates:
+        variant = {
+            'ladder_drop_pct': float(candidate.get('ladder_drop_pct', strategy_params['ladder_drop_pct'])),
+            'take_profit_pct': float(candidate.get('take_profit_pct', strategy_params['take_profit_pct'])),
+            'max_positions': int(candidate.get('max_positions', max_positions)),
+            'amount': float(candidate.get('amount', first_position_amount)),
+            'investment_limit': float(candidate.get('investment_limit', total_investment_limit))
+        }
+        key = tuple(sorted(variant.items()))
+        if key not in seen:
+            seen.add(key)
+            variants.append(variant)
+    return variants
+
+
+def shadow_path(state_file):
+    """帳戶持倉文件對應的影子持倉文件，如 trade_info.json -> trade_info_shadow.npz"""
+    return os.path.splitext(state_file)[0] + '_shadow.npz'
+
+
+def variant_name(variant):
+    name = f"L{variant['ladder_drop_pct']:g}/T{variant['take_profit_pct']:g}"
+    if variant['max_positions'] != max_positions:
+        name += f"/P{variant['max_positions']}"
+    if variant['amount'] != first_position_amount:
+        name += f"/A{variant['amount']:g}"
+    return name
+
+
+class ShadowBook:
+    """
+    K 組參數的虛擬持倉：倉位以 (K, 幣種, 倉位槽) 的數組保存，每個週期由 kernel.step_variants
+    一次更新所有變體。啟動時每組都從實盤持倉出發，之後只按各自參數建倉與止盈，不下單
+    """
+
+    def __init__(self, path, variants=None, currencies=None):
+        self.path = path
+        self.variants = variants or build_variants()
+        self.currencies = list(currencies or supported_currencies)
+        self._lock = threading.Lock()
+        self._bands = {}
+        self._saved_at = 0.0
+        self.last_prices = np.full(len(self.currencies), np.nan)
+        self.step_ms = []
+        params = {key: np.array([v[key] for v in self.variants], dtype=float) for key in self.variants[0]}
+        self.ladder = params['ladder_drop_pct']
+        self.take_profit = params['take_profit_pct']
+        self.position_limit = params['max_positions'].astype(int)
+        self.amount = params['amount']
+        self.limit = params['investment_limit']
+        self.signature = json.dumps({'variants': self.variants, 'currencies': self.currencies}, sort_keys=True)
+        self.seeded = False
+        if not self._load():
+            self._reset_arrays()
+
+    def _reset_arrays(self):
+        K, n = len(self.variants), len(self.currencies)
+        P = max(int(self.position_limit.max()), max_positions)
+        self.entries = np.full((K, n, P), np.nan)
+        self.units = np.zeros((K, n, P))
+        self.counts = np.zeros((K, n), dtype=np.int64)
+        self.invested = np.zeros(K)
+        self.realized = np.zeros(K)
+        self.fees = np.zeros(K)
+        self.opened = np.zeros(K, dtype=np.int64)
+        self.closed = np.zeros(K, dtype=np.int64)
+        self.baseline = {'started_at': time.time(), 'unrealized': None, 'live_realized': 0.0, 'live_unrealized': None}
+        self.cycles = 0
+        self.seeded = False
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return False
+        try:
+            with np.load(self.path, allow_pickle=False) as data:
+                if str(data['signature']) != self.signature:
+                    logging.info("影子評估參數組已變更，重新從實盤持倉開始")
+                    return False
+                for name in ('entries', 'units', 'counts', 'invested', 'realized', 'fees', 'opened', 'closed'):
+                    setattr(self, name, data[name].copy())
+                self.baseline = json.loads(str(data['baseline']))
+                self.cycles = int(data['cycles'])
+            self.seeded = True
+            return True
+        except Exception as e:
+            logging.error("載入影子持倉 %s 失敗: %s", self.path, e)
+            return False
+
+    def save(self):
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            tmp = self.path + '.tmp.npz'
+            with self._lock:
+                np.savez(tmp, signature=self.signature, baseline=json.dumps(self.baseline), cycles=self.cycles,
+                         entries=self.entries, units=self.units, counts=self.counts, invested=self.invested,
+                         realized=self.realized, fees=self.fees, opened=self.opened, closed=self.closed)
+            os.replace(tmp, self.path)
+            self._saved_at = time.time()
+        except OSError as e:
+            logging.error("保存影子持倉失敗: %s", e)
+
+    def seed(self, account):
+        """每組參數都從實盤當前持倉出發（超出該組倉位上限的部分按建倉順序截斷）"""
+        P = self.entries.shape[2]
+        for i, currency in enumerate(self.currencies):
+            positions = account.trade_info.get(currency, {}).get('positions', [])
+            for j, position in enumerate(positions[:P]):
+                keep = self.position_limit > j
+                self.entries[keep, i, j] = float_safe(position.get('entry_price'))
+                self.units[keep, i, j] = float_safe(position.get('amount'))
+                self.counts[keep, i] += 1
+        with np.errstate(invalid='ignore'):
+            self.invested = np.nansum(self.entries * self.units, axis=(1, 2))
+        self.baseline['live_realized'] = account.pnl.total()
+        self.seeded = True
+
+    def _lower_bands(self, active, now):
+        """只為有變體需要首倉判斷的交易對取下軌，按 band_ttl 緩存"""
+        bands = np.full(len(self.currencies), np.nan)
+        need = active & (self.counts == 0).any(axis=0)
+        for i in np.flatnonzero(need):
+            currency = self.currencies[i]
+            cached = self._bands.get(currency)
+            if not cached or now - cached[0] >= SHADOW_CONFIG['band_ttl']:
+                bollinger = get_bollinger(f"{currency}/USDT", timeframe='1h', period=20, deviation=2)
+                cached = self._bands[currency] = (now, (bollinger or {}).get('lower'))
+            if cached[1]:
+                bands[i] = cached[1]
+        return bands
+
+    def unrealized(self, prices=None):
+        prices = self.last_prices if prices is None else prices
+        with np.errstate(invalid='ignore'):
+            value = (prices[None, :, None] - self.entries) * self.units
+        return np.nansum(value, axis=(1, 2))
+
+    def observe(self, account, prices):
+        """
+        以實盤本週期的價格快照推進所有變體一個週期
+        :param prices: {currency: price}（與實盤 trade_strategy 相同的快照）
+        """
+        now = time.time()
+        if not self.seeded:
+            self.seed(account)
+        price_array = np.array([float_safe(prices.get(c)) or np.nan for c in self.currencies])
+        price_array = np.where(np.isnan(price_array), self.last_prices, price_array)
+        active = np.array([bool(account.trade_info[c].get('is_trading') or account.trade_info[c].get('waiting_for_open'))
+                           for c in self.currencies])
+        bands = self._lower_bands(active, now)
+
+        started = time.perf_counter()
+        with self._lock:
+            if self.baseline['unrealized'] is None:
+                # 起點的未實現收益（各組截斷後的實盤持倉），前向收益從此刻起算
+                self.baseline['unrealized'] = self.unrealized(price_array).tolist()
+                self.baseline['live_unrealized'] = account.pnl.unrealized_pnl()
+            result = kernel.step_variants(price_array, bands, active, self.entries, self.units, self.counts,
+                                          self.invested, self.ladder, self.take_profit, self.position_limit,
+                                          self.amount, self.limit, SHADOW_CONFIG['fee_rate'])
+            self.invested = result['invested']
+            self.realized += result['realized']
+            self.fees += result['fees']
+            self.opened += result['opened']
+            self.closed += result['closed']
+            self.last_prices = price_array
+            self.cycles += 1
+        self.step_ms.append((time.perf_counter() - started) * 1000)
+        del self.step_ms[:-100]
+        if now - self._saved_at >= SHADOW_CONFIG['save_interval']:
+            self.save()
+
+    def report(self, account):
+        """各組參數的前向收益（已實現 - 手續費 + 未實現變化），按收益從高到低，附實盤同期收益"""
+        with self._lock:
+            base_unrealized = np.asarray(self.baseline['unrealized'] or 0.0)
+            unrealized = self.unrealized()
+            pnl = self.realized - self.fees + unrealized - base_unrealized
+            rows = [{
+                'name': variant_name(variant),
+                'params': variant,
+                'pnl': round(float(pnl[k]), 4),
+                'return_pct': round(float(pnl[k] / self.limit[k] * 100), 4),
+                'realized': round(float(self.realized[k]), 4),
+                'fees': round(float(self.fees[k]), 4),
+                'unrealized': round(float(unrealized[k]), 4),
+                'invested': round(float(self.invested[k]), 4),
+                'positions': int(self.counts[k].sum()),
+                'opened': int(self.opened[k]),
+                'closed': int(self.closed[k]),
+                'live_params': variant['ladder_drop_pct'] == strategy_params['ladder_drop_pct']
+                               and variant['take_profit_pct'] == strategy_params['take_profit_pct']
+                               and variant['max_positions'] == max_positions
+                               and variant['amount'] == first_position_amount
+            } for k, variant in enumerate(self.variants)]
+        rows.sort(key=lambda row: -row['pnl'])
+        live_pnl = None
+        if self.baseline['live_unrealized'] is not None:
+            live_pnl = (account.pnl.total() - self.baseline['live_realized']
+                        + account.pnl.unrealized_pnl() - self.baseline['live_unrealized'])
+        return {
+            'started_at': self.baseline['started_at'],
+            'cycles': self.cycles,
+            'variants': len(self.variants),
+            'step_ms': round(float(np.mean(self.step_ms)), 3) if self.step_ms else None,
+            'live': {'pnl': round(live_pnl, 4) if live_pnl is not None else None},
+            'results': rows
+        }
+
+    def reset(self):
+        """清空虛擬持倉，下一個週期重新從實盤持倉開始"""
+        with self._lock:
+            self._reset_arrays()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+_books = {}
+_books_lock = threading.Lock()
+
+
+def get_book(account):
+    """帳戶的影子評估（每個持倉文件一份）"""
+    with _books_lock:
+        book = _books.get(account.state_file)
+        if book is None:
+            book = _books[account.state_file] = ShadowBook(shadow_path(account.state_file))
+        return book
+
+
+def observe(account, prices):
+    """trade_strategy 每個週期調用；未啟用時不做任何事"""
+    if not SHADOW_CONFIG['enabled'] or not prices:
+        return
+    try:
+        get_book(account).observe(account, prices)
+    except Exception as e:
+        logging.error("[%s] 影子評估失敗: %s", account.name, e)
@@ -0,0 +1,320 @@
+"""
+分片運行：幣種分配到多個工作進程，每個進程只處理自己的幣種、使用自己的交易所客戶端與持倉文件
+(trade_info_shard{k}.json)，全局投資限額由父進程中的協調器分配。
+
+    python sharding.py --workers 4                         # 持續運行
+    python sharding.py --workers 4 --cycles 10 --interval 0 --exchange paper
+
+建倉時工作進程只和本地已分配的額度比較（沒有跨進程鎖），額度不足時才向協調器申請一塊
+lease_chunk；每個週期結束後把超出「已投資 + lease_chunk」的額度歸還。所有分片已分配額度之和
+不超過 total_investment_limit，因此全局限額始終成立。
+
+max_positions 在本倉庫中是每個幣種的倉位上限，幣種只屬於一個分片，由分片本地檢查即可。
+協調器每 merge_interval 秒把各分片負責的幣種合併回主持倉文件，供儀表板讀取。
+"""
+import os
+import sys
+import json
+import time
+import signal
+import logging
+import argparse
+import threading
+import multiprocessing
+from multiprocessing.connection import wait
+
+# --exchange 對應 config.CASSETTE_CONFIG['mode']，必須在導入 config 之前設置
+EXCHANGE_MODES = {'live': 'live', 'paper': 'fake', 'replay': 'replay'}
+
+
+def shard_file(index):
+    return f"trade_info_shard{index}.json"
+
+
+class ShardBudget:
+    """工作進程中的額度：granted 為協調器已分配給本分片的投資額度"""
+
+    def __init__(self, conn, granted, lease_chunk):
+        self.conn = conn
+        self.granted = granted
+        self.lease_chunk = lease_chunk
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.denied = 0
+
+    def ensure(self, required):
+        """本分片投資額將達到 required 時調用：本地額度足夠直接返回 True，否則向協調器申請"""
+        if required <= self.granted:
+            return True
+        with self._lock:
+            if required <= self.granted:
+                return True
+            needed = required - self.granted
+            self.conn.send(('reserve', needed, max(needed, self.lease_chunk)))
+            _, amount = self.conn.recv()
+            self.requests += 1
+            self.granted += amount
+            if required > self.granted:
+                self.denied += 1
+                return False
+            return True
+
+    def trim(self, invested):
+        """歸還超出「已投資 + lease_chunk」的額度，讓其他分片可以使用"""
+        with self._lock:
+            excess = self.granted - max(invested, 0.0) - self.lease_chunk
+            if excess > 0:
+                self.conn.send(('release', excess))
+                self.granted -= excess
+
+
+class Coordinator:
+    """父進程中的額度分配：只處理申請 / 歸還消息，不參與交易"""
+
+    def __init__(self, limit, granted):
+        self.limit = limit
+        self.granted = dict(granted)   # shard -> 已分配額度（初始為各分片已有的投資額）
+        self.counts = {'reserve': 0, 'denied': 0, 'release': 0}
+        self.reports = {}
+
+    def available(self):
+        return self.limit - sum(self.granted.values())
+
+    def handle(self, shard, message):
+        """處理一條消息，需要回覆時返回回覆內容"""
+        kind = message[0]
+        if kind == 'reserve':
+            _, needed, preferred = message
+            available = self.available()
+            amount = min(preferred, available) if available >= needed else 0.0
+            self.granted[shard] += amount
+            self.counts['reserve'] += 1
+            if not amount:
+                self.counts['denied'] += 1
+                logging.info("分片 %s 申請 %.2f USDT 被拒絕，全局剩餘額度 %.2f", shard, needed, available)
+            return ('grant', amount)
+        if kind == 'release':
+            self.granted[shard] = max(0.0, self.granted[shard] - message[1])
+            self.counts['release'] += 1
+        elif kind == 'report':
+            self.reports[shard] = message[1]
+        return None
+
+
+def partition(trade_info, currencies, workers):
+    """按倉位數（+1）做最長處理時間優先分配，使各分片的工作量接近"""
+    loads = [0] * workers
+    assignment = {}
+    weighted = sorted(currencies, key=lambda c: -(1 + len(trade_info[c]['positions'])))
+    for currency in weighted:
+        shard = loads.index(min(loads))
+        assignment[currency] = shard
+        loads[shard] += 1 + len(trade_info[currency]['positions'])
+    return assignment
+
+
+def merge(assignment):
+    """把各分片負責的幣種寫回主持倉文件；讀取失敗的分片本次不合併，保留主持倉文件中的舊數據"""
+    from config import load_trade_info_from_file, save_trade_info_to_file
+    merged = load_trade_info_from_file()
+    shards = {}
+    for currency, shard in assignment.items():
+        if shard not in shards:
+            shards[shard] = None
+            if os.path.exists(shard_file(shard)):
+                try:
+                    shards[shard] = load_trade_info_from_file(shard_file(shard), strict=True)
+                except Exception:
+                    logging.warning("分片 %s 持倉文件讀取失敗，本次不合併", shard)
+        if shards[shard] is None:
+            continue
+        merged[currency] = shards[shard][currency]
+    save_trade_info_to_file(merged)
+    return merged
+
+
+def prepare(workers):
+    """
+    確定幣種分配並建立分片持倉文件：分配表與工作進程數不變時沿用，否則先把舊分片合併回
+    主持倉文件再重新分配（舊分片的收益帳本按 total_profit 重新起算）
+    :return: (assignment, {shard: 已投資額})
+    """
+    from config import (SHARDING_CONFIG, supported_currencies, initialize_trade_info,
+                        load_trade_info_from_file, save_trade_info_to_file, float_safe)
+    map_file = SHARDING_CONFIG['map_file']
+    previous = None
+    if os.path.exists(map_file):
+        with open(map_file, 'r', encoding='utf-8') as f:
+            previous = json.load(f)
+
+    if previous and previous.get('workers') == workers and set(previous['assignment']) == set(supported_currencies) \
+            and all(os.path.exists(shard_file(k)) for k in range(workers)):
+        assignment = previous['assignment']
+    else:
+        if previous:
+            merge(previous['assignment'])
+            for shard in range(previous.get('workers', 0)):
+                for path in (shard_file(shard), os.path.splitext(shard_file(shard))[0] + '_pnl.json'):
+                    if os.path.exists(path):
+                        os.remove(path)
+        main_info = load_trade_info_from_file()
+        assignment = partition(main_info, supported_currencies, workers)
+        empty = initialize_trade_info()
+        for shard in range(workers):
+            info = {c: (main_info[c] if assignment[c] == shard else empty[c]) for c in supported_currencies}
+            save_trade_info_to_file(info, shard_file(shard))
+        with open(map_file, 'w', encoding='utf-8') as f:
+            json.dump({'workers': workers, 'assignment': assignment}, f, ensure_ascii=False, indent=2)
+        logging.info("幣種已重新分配到 %s 個分片", workers)
+
+    invested = {k: 0.0 for k in range(workers)}
+    for shard in range(workers):
+        info = load_trade_info_from_file(shard_file(shard))
+        invested[shard] = sum(float_safe(p.get('amount')) * float_safe(p.get('entry_price'))
+                              for c, shard_of in assignment.items() if shard_of == shard
+                              for p in info[c]['positions'])
+    return assignment, invested
+
+
+def worker(shard, currencies, conn, stop, options):
+    """
+    工作進程入口（spawn 啟動，環境變量在導入 config 之前設置）：
+    只對本分片的幣種執行交易週期，每個週期結束後歸還多餘額度並向協調器報告耗時
+    """
+    os.environ['TRADE_INFO_FILE'] = shard_file(shard)
+    os.environ['LOG_FILE'] = f"logs/trading_shard{shard}.jsonl"
+    if options.get('exchange_mode'):
+        os.environ['EXCHANGE_MODE'] = options['exchange_mode']
+    if os.environ.get('EXCHANGE_MODE') == 'record':
+        base, ext = os.environ.get('CASSETTE_FILE', 'logs/cassettes/exchange.jsonl.gz').split('.', 1)
+        os.environ['CASSETTE_FILE'] = f"{base}_shard{shard}.{ext}"
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # 由父進程統一處理中斷
+
+    from config import SHARDING_CONFIG
+    import recovery
+    from accounts import default_account
+    from market_data import get_tickers
+    from main import trade_strategy
+
+    account = default_account()
+    if options.get('recover', True):
+        recovery.recover(account, currencies=currencies)
+    account.budget = ShardBudget(conn, options['granted'], SHARDING_CONFIG['lease_chunk'])
+    symbols = [f"{currency}/USDT" for currency in currencies]
+    cycles = 0
+    timings = []
+    while not stop.is_set() and (not options['cycles'] or cycles < options['cycles']):
+        started = time.perf_counter()
+        try:
+            tickers = get_tickers(symbols)
+            prices = {s.split('/')[0]: float(t['last']) for s, t in tickers.items() if t and t.get('last') is not None}
+            trade_strategy(account=account, prices=prices, currencies=currencies)
+            account.budget.trim(account.exposure.portfolio_invested())
+        except Exception as e:
+            logging.error("分片 %s 交易週期執行錯誤: %s", shard, e)
+        cycles += 1
+        timings.append(time.perf_counter() - started)
+        conn.send(('report', {
+            'cycles': cycles,
+            'last_cycle': timings[-1],
+            'mean_cycle': sum(timings) / len(timings),
+            'invested': account.exposure.portfolio_invested(),
+            'granted': account.budget.granted,
+            'positions': account.exposure.portfolio_positions(),
+            'reserve_requests': account.budget.requests
+        }))
+        if options['cycles'] and cycles >= options['cycles']:
+            break
+        stop.wait(max(0.0, options['interval'] - timings[-1]))
+    conn.send(('done', cycles))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='分片運行交易引擎（多進程）')
+    parser.add_argument('--workers', type=int, help='工作進程數，預設為 SHARDING_CONFIG["workers"]')
+    parser.add_argument('--cycles', type=int, default=0, help='每個分片執行 N 個週期後退出，0 為持續運行')
+    parser.add_argument('--interval', type=float, help='週期間隔（秒），預設為 SYSTEM_CONFIG["update_interval"]')
+    parser.add_argument('--exchange', choices=sorted(EXCHANGE_MODES), help='live / paper / replay，預設沿用 EXCHANGE_MODE')
+    parser.add_argument('--no-recover', action='store_true', help='工作進程啟動時不從成交檢查點恢復持倉')
+    args = parser.parse_args(argv)
+    if args.exchange:
+        os.environ['EXCHANGE_MODE'] = EXCHANGE_MODES[args.exchange]
+
+    from config import SHARDING_CONFIG, SYSTEM_CONFIG, total_investment_limit
+    from log_setup import setup_logging
+    setup_logging()
+
+    workers = max(1, args.workers or SHARDING_CONFIG['workers'])
+    interval = SYSTEM_CONFIG['update_interval'] if args.interval is None else max(0.0, args.interval)
+    assignment, invested = prepare(workers)
+    coordinator = Coordinator(total_investment_limit, invested)
+
+    context = multiprocessing.get_context('spawn')
+    stop = context.Event()
+    connections = {}
+    processes = []
+    for shard in range(workers):
+        currencies = [c for c, k in assignment.items() if k == shard]
+        parent_conn, child_conn = context.Pipe()
+        options = {'cycles': args.cycles, 'interval': interval, 'granted': invested[shard],
+                   'exchange_mode': os.environ.get('EXCHANGE_MODE'), 'recover': not args.no_recover}
+        process = context.Process(target=worker, args=(shard, currencies, child_conn, stop, options),
+                                  name=f"shard-{shard}", daemon=True)
+        process.start()
+        connections[parent_conn] = shard
+        processes.append(process)
+        logging.info("分片 %s 已啟動（PID %s）: %s", shard, process.pid, ', '.join(currencies))
+
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    started = time.perf_counter()
+    last_merge = time.monotonic()
+    active = dict(connections)
+    try:
+        while active:
+            for conn in wait(list(active), timeout=1.0):
+                shard = active[conn]
+                try:
+                    message = conn.recv()
+                except EOFError:
+                    logging.error("分片 %s 已意外退出", shard)
+                    del active[conn]
+                    continue
+                if message[0] == 'done':
+                    del active[conn]
+                    continue
+                reply = coordinator.handle(shard, message)
+                if reply is not None:
+                    conn.send(reply)
+            if time.monotonic() - last_merge >= SHARDING_CONFIG['merge_interval']:
+                merge(assignment)
+                last_merge = time.monotonic()
+    except KeyboardInterrupt:
+        logging.info("已中斷，等待各分片結束當前週期")
+        stop.set()
+        for conn in list(active):
+            # 繼續處理額度申請直到分片退出，避免分片阻塞在等待回覆上
+            while active.get(conn) is not None and conn.poll(30):
+                message = conn.recv()
+                if message[0] == 'done':
+                    break
+                reply = coordinator.handle(active[conn], message)
+                if reply is not None:
+                    conn.send(reply)
+    finally:
+        stop.set()
+        for process in processes:
+            process.join(timeout=30)
+        merge(assignment)
+
+    elapsed = time.perf_counter() - started
+    print(f"\n{workers} 個分片運行 {elapsed:.1f} 秒，全局限額 {total_investment_limit}，剩餘額度 {coordinator.available():.2f}")
+    print(f"額度申請 {coordinator.counts['reserve']} 次（拒絕 {coordinator.counts['denied']}），歸還 {coordinator.counts['release']} 次")
+    for shard in range(workers):
+        report = coordinator.reports.get(shard, {})
+        print(f"分片 {shard}: 週期 {report.get('cycles', 0)}，平均耗時 {report.get('mean_cycle', 0):.3f} 秒，"
+              f"倉位 {report.get('positions', 0)}，已投資 {report.get('invested', 0):.2f} / 額度 {coordinator.granted[shard]:.2f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -82,6 +82,21 @@ function updateCurrencyTable(tradeInfo) {
     });
 }
 
+// 等待命令隊列中的任務完成（長輪詢，每次最多等待 20 秒）
+function waitForJob(jobId) {
+    return fetch(`/api/jobs/${jobId}?wait=20`)
+        .then(response => response.json())
+        .then(data => {
+            if (!data.success) {
+                throw new Error(data.error || '未知錯誤');
+            }
+            if (data.job.status === 'done' || data.job.status === 'failed') {
+                return data.job;
+            }
+            return waitForJob(jobId);
+        });
+}
+
 // 開始交易
 function startTrading(currency) {
     fetch(`/start_trading/${currency}`, {
@@ -92,16 +107,23 @@ function startTrading(currency) {
     })
     .then(response => response.json())
     .then(data => {
-        if (data.success) {
-            alert(data.message);  // 顯示包含布林通道下軌價格的訊息
-            updateDashboard();    // 更新儀表板數據
+        // 命令由交易引擎執行，請求只返回任務 ID
+        if (!data.success) {
+            throw new Error(data.error || '未知錯誤');
+        }
+        return waitForJob(data.job_id);
+    })
+    .then(job => {
+        if (job.status === 'done') {
+            alert(job.result.message);  // 顯示包含布林通道下軌價格的訊息
+            updateDashboard();          // 更新儀表板數據
         } else {
-            alert(`開始交易失敗: ${data.error || '未知錯誤'}`);
+            alert(`開始交易失敗: ${job.error || '未知錯誤'}`);
         }
     })
     .catch(error => {
         console.error('開始交易失敗:', error);
-        alert('開始交易失敗，請檢查網路連接');
+        alert(`開始交易失敗: ${error.message || '請檢查網路連接'}`);
     });
 }
 
@@ -111,5 +133,5 @@ document.addEventListener('DOMContentLoaded', function() {
     updateDashboard();
 });
 
-// 每60秒更新一次數據
+// 每60秒更新一次數據（後端緩存未過期時直接返回，過期時先返回舊數據並在後台刷新）
 setInterval(updateDashboard, 60000);
\ No newline at end of file
@@ -5,42 +5,60 @@ import numpy as np
 from datetime import datetime
 from config import *
 from utils import exchange,get_bollinger,calculate_volatility
-from strategies.exit_strategy import calculate_target_price
+from strategies.exit_strategy import calculate_target_price, resolve_fill
+from strategies import kernel
+from strategies import take_profit_orders
+from accounts import default_account
+import execution
+import gateway
+import recovery
 
 
-def open_position(currency, price, amount=30):
+def open_position(currency, price, amount=30, account=None):
     """
     實現建倉策略的具體邏輯
     - 首倉：價格跌破或觸及布林通道下軌。
     - 第 2-12 倉位：價格相對於前一倉位入場價格跌幅 ≥ 6%。
+    :param account: 交易帳戶，預設為主帳戶
     """
+    account = account or default_account()
+    info = account.trade_info
+    client = account.exchange
     try:       
         # 檢查交易所連接
-        if not exchange:
+        if not client:
             error_msg = f"{currency} 開倉失敗: 交易所未連接"
             logging.error(error_msg)
             return False, error_msg
         
+        # 上一張訂單結果未知、尚未對帳時不再下單，避免重複買入
+        if info[currency].get('pending_reconcile'):
+            error_msg = f"{currency} 有結果未知的訂單待對帳，暫停開倉"
+            logging.warning(error_msg)
+            return False, error_msg
+        
         # 檢查是否超過最大倉位數
-        if len(trade_info[currency]['positions']) >= max_positions:
+        if len(info[currency]['positions']) >= max_positions:
             error_msg = f"{currency} 已達到最大倉位數 {max_positions}"
             logging.info(error_msg)
             return False, error_msg
         
-        # 檢查總投資額是否超過限制
-        total_investment = sum([
-            sum([p['amount'] * p['entry_price'] for p in info['positions']])
-            for info in trade_info.values()
-        ])
-        if total_investment + amount > total_investment_limit:
+        # 檢查總投資額是否超過限制（使用增量維護的匯總，O(1)）
+        total_investment = account.exposure.portfolio_invested()
+        if account.budget is not None:
+            # 分片模式：只和本分片已分配的額度比較，不足時才向協調器申請
+            if not account.budget.ensure(total_investment + amount):
+                error_msg = f"全局投資額度不足: 本分片已投資 {total_investment:.2f}，無法再分配 {amount} USDT"
+                logging.info(error_msg)
+                return False, error_msg
+        elif total_investment + amount > total_investment_limit:
             error_msg = f"總投資額 {total_investment + amount} 超過限制 {total_investment_limit}"
             logging.info(error_msg)
             return False, error_msg
         
         # 檢查餘額是否足夠
         try:
-            balance = exchange.fetch_balance()
-            usdt_balance = balance.get('USDT', {}).get('free', 0)
+            usdt_balance = account.free('USDT')  # 帳戶餘額帳本，過期時才請求交易所
             if usdt_balance < amount:
                 error_msg = f"{currency} 餘額不足: 需要 {amount} USDT，當前餘額 {usdt_balance} USDT"
                 logging.warning(error_msg)
@@ -50,70 +68,65 @@ def open_position(currency, price, amount=30):
             logging.error(error_msg)
             return False, error_msg
         
-        # 獲取布林通道數據（1小時區間框架）
-        bollinger = get_bollinger(f"{currency}/USDT", timeframe='1h', period=20, deviation=2)
-        if not bollinger:
-            error_msg = f"{currency} 無法獲取布林通道數據"
-            logging.error(error_msg)
-            return False, error_msg
-        
-        lower_band = bollinger['lower']  # 布林通道下軌
+        positions = info[currency]['positions']
         current_price = price  # 當前價格
+        last_entry_price = positions[-1]['entry_price'] if positions else None
         
-        # 檢查是否為首倉
-        if len(trade_info[currency]['positions']) == 0:
-            # 首倉建倉條件：價格跌破或觸及布林通道下軌
-            if current_price <= lower_band:
-                entry_amount = amount / current_price
-                order = exchange.create_market_buy_order(f"{currency}/USDT", entry_amount)
-                trade_info[currency]['positions'].append({
-                    'entry_price': current_price,
-                    'amount': entry_amount,
-                    'target_price': calculate_target_price(currency, current_price),  # 計算止盈價格
-                    'profit': 0,
-                    'timestamp': datetime.now().timestamp() * 1000  # 設置當前時間戳
-                })
-                if order:
-                   save_trade_info_to_file(trade_info)  # 儲存到 JSON 文件
-                   logging.info(f"{currency} 首倉建立成功，價格: {current_price:.4f}")
-                else:
-                   logging.error(f"{currency} 首倉建立失敗")  
-            else:
-                logging.info(f"{currency} 價格未跌破布林通道下軌，等待開倉條件")
+        # 只有首倉需要布林通道下軌（1小時區間框架）
+        lower_band = None
+        if not positions:
+            bollinger = get_bollinger(f"{currency}/USDT", timeframe='1h', period=20, deviation=2)
+            if not bollinger:
+                error_msg = f"{currency} 無法獲取布林通道數據"
+                logging.error(error_msg)
+                return False, error_msg
+            lower_band = bollinger['lower']  # 布林通道下軌
+        
+        # 首倉：價格跌破或觸及布林通道下軌；第 2-12 倉位：價格跌幅 ≥ 6%（規則在策略核心中）
+        signal = kernel.entry_signal(current_price, lower_band, len(positions), last_entry_price)
+        if signal == kernel.NO_ENTRY:
+            if not positions:
+                logging.info("%s 價格未跌破布林通道下軌，等待開倉條件", currency)
                 return False, "等待開倉條件"
-        else:
-             # 第 2-12 倉位建倉條件：價格跌幅 ≥ 6%
-            last_position = trade_info[currency]['positions'][-1]
-            last_entry_price = last_position['entry_price']
-            price_drop = (last_entry_price - current_price) / last_entry_price * 100
-
-                     
-            # 根據貨幣的歷史波動率動態調整跌幅條件
-            #volatility = calculate_volatility(currency)
-            #dynamic_drop_threshold = max(6.0, volatility * 100)  # 最小跌幅為 6%
-            #if price_drop >= dynamic_drop_threshold:
-            
-            if price_drop >= 6.0:
-                entry_amount = amount / current_price
-                order = exchange.create_market_buy_order(f"{currency}/USDT", entry_amount)
-                trade_info[currency]['positions'].append({
-                    'entry_price': current_price,
-                    'amount': entry_amount,
-                    'target_price': calculate_target_price(currency, current_price),  # 計算止盈價格
-                    'profit': 0,
-                    'timestamp': datetime.now().timestamp() * 1000  # 設置當前時間戳
-                })
-                if order:
-                   save_trade_info_to_file(trade_info)  # 儲存到 JSON 文件
-                   logging.info(f"{currency} 新倉位建立成功，價格: {current_price:.4f}")
-                   return True,None
-                else:
-                   logging.error(f"{currency} 新倉位建立失敗")
-               
-                
-            else:
-                logging.info(f"{currency} 價格跌幅未達 6%，不建立新倉位")
-                return False, "價格跌幅未達 6%"
+            logging.info("%s 價格跌幅未達 %s%%，不建立新倉位", currency, strategy_params['ladder_drop_pct'])
+            return False, f"價格跌幅未達 {strategy_params['ladder_drop_pct']}%"
+        
+        label = "首倉" if signal == kernel.FIRST_ENTRY else "新倉位"
+        symbol = f"{currency}/USDT"
+        entry_amount = amount / current_price
+        ticket = execution.begin(symbol, 'buy', entry_amount, current_price, source='entry', account=account.name)
+        try:
+            order = ticket.submit(client.create_market_buy_order, symbol, entry_amount)
+        except gateway.OutcomeUnknown:
+            # 買單可能已成交：從成交記錄對帳，查到成交時回放為新倉位
+            if recovery.reconcile_unknown(account, currency):
+                return True, None
+            return False, f"{currency} {label}下單結果未知，已轉入對帳"
+        if not order:
+            logging.error("%s %s建立失敗", currency, label)
+            return False, f"{currency} {label}建立失敗"
+        
+        # 以實際成交數量與均價記錄倉位（市價單的成交價可能偏離下單前的價格）
+        entry_amount, entry_price = resolve_fill(order, symbol, entry_amount, current_price, client, ticket)
+        if entry_amount <= 0:
+            logging.warning("%s %s買單 %s 未成交", currency, label, order.get('id'))
+            return False, f"{currency} {label}未成交"
+        positions.append({
+            'entry_price': entry_price,
+            'amount': entry_amount,
+            'target_price': calculate_target_price(currency, entry_price),  # 計算止盈價格
+            'profit': 0,
+            'timestamp': datetime.now().timestamp() * 1000  # 設置當前時間戳
+        })
+        account.exposure.record_open(currency, entry_amount, entry_price)
+        if RESTING_TP_CONFIG['enabled']:
+            # 建倉後立即在交易所掛出止盈單，成交由掛單狀態同步記帳
+            take_profit_orders.place(currency, positions[-1], account)
+        account.adjust_free('USDT', -entry_amount * entry_price)
+        account.mark_applied(currency, order)
+        account.save()  # 儲存到 JSON 文件
+        logging.info("%s %s建立成功，價格: %.4f（決策價格 %.4f）", currency, label, entry_price, current_price)
+        return True, None
     except Exception as e:
         error_msg = f"{currency} 開倉操作錯誤: {str(e)}"
         logging.error(error_msg)
@@ -1,8 +1,13 @@
+import time
 import logging
 import ccxt
+import execution
+import gateway
 from datetime import datetime
 from config import *
 from utils import get_bollinger, exchange
+from accounts import default_account
+from strategies.kernel import take_profit_prices, exit_mask
 #from app import get_cached_price
 
 def calculate_target_price(currency, entry_price):
@@ -11,20 +16,183 @@ def calculate_target_price(currency, entry_price):
     - 各倉位以買入價格為基準，當價格漲幅 >= 2.5% 時自動賣出該倉位。
     """
     try:
-        logging.info(f"開始計算 {currency} 的止盈價格，入場價格: {entry_price}")
+        logging.debug("開始計算 %s 的止盈價格，入場價格: %s", currency, entry_price)
         
         # 檢查入場價格是否有效
         if not entry_price or entry_price <= 0:
-            logging.error(f"{currency} 入場價格無效: {entry_price}")
+            logging.error("%s 入場價格無效: %s", currency, entry_price)
             return None
         
-        # 計算止盈價格（漲幅 ≥ 2.5%）
-        target_price = entry_price * 1.03  # 3% 漲幅
-        logging.info(f"{currency} 的止盈價格設定為: {target_price:.4f}")
+        # 計算止盈價格（規則在策略核心中，漲幅 strategy_params['take_profit_pct']）
+        target_price = float(take_profit_prices([entry_price])[0])
+        logging.debug("%s 的止盈價格設定為: %.4f", currency, target_price)
         
         return target_price
     
     except Exception as e:
-        logging.error(f"{currency} 計算止盈價格時發生錯誤: {str(e)}")
+        logging.error("%s 計算止盈價格時發生錯誤: %s", currency, e)
         return None
-   
\ No newline at end of file
+
+
+def plan_exits(prices, account=None):
+    """
+    收集本週期所有達到止盈價格的倉位，按幣種合併（已有交易所端止盈掛單的倉位由掛單成交，不在此檢查）
+    :param prices: {currency: current_price}
+    :param account: 交易帳戶，預設為主帳戶
+    :return: {currency: {'price': 觸發價格, 'amount': 合併賣出數量, 'positions': [倉位, ...]}}
+    """
+    info = (account or default_account()).trade_info
+    plan = {}
+    for currency, current_price in prices.items():
+        if not current_price or currency not in info or info[currency].get('pending_reconcile'):
+            continue
+        positions = [p for p in info[currency]['positions'] if not p.get('tp_order')]
+        if not positions:
+            continue
+        hits = exit_mask([current_price] * len(positions),
+                         [float_safe(p.get('entry_price')) for p in positions],
+                         [float_safe(p.get('amount')) for p in positions])
+        triggered = [position for position, hit in zip(positions, hits) if hit]
+        if triggered:
+            plan[currency] = {
+                'price': current_price,
+                'amount': sum(float(p['amount']) for p in triggered),
+                'positions': triggered
+            }
+    return plan
+
+
+def resolve_fill(order, symbol, requested_amount, fallback_price, client=None, ticket=None):
+    """
+    取得訂單的實際成交數量與均價；市價單回報常只有訂單號，需要再查詢一次
+    只有交易所沒有返回成交數量（None）時才按請求數量記錄，確認成交 0 時返回 0
+    :param ticket: execution.begin 返回的執行記錄，提供時一併記錄成交均價、手續費與滑價
+    """
+    client = client or exchange
+    filled = order.get('filled') if order else None
+    average = order.get('average') if order else None
+    source = order
+    if (not filled or not average) and order and order.get('id'):
+        try:
+            fetched = client.fetch_order(order['id'], symbol)
+            if fetched.get('filled') is not None:
+                filled = fetched['filled']
+            average = fetched.get('average') or fetched.get('price') or average
+            if fetched.get('fee') or fetched.get('fees'):
+                source = fetched
+        except Exception as e:
+            logging.warning("%s 查詢訂單 %s 成交資訊失敗: %s", symbol, order['id'], e)
+    filled = float(requested_amount if filled is None else filled)
+    average = float(average or fallback_price)
+    if ticket is not None:
+        ticket.fill(filled, average, source)
+    return filled, average
+
+
+def _allocate_fill(account, currency, entry, filled_amount, fill_price, ts=None):
+    """
+    將合併訂單的成交按倉位順序分配回各倉位，計算每個倉位的收益
+    部分成交時，最後一個倉位只扣減已成交的數量
+    :param ts: 成交時間（秒），預設為現在，用於收益帳本分桶
+    """
+    info = account.trade_info
+    remaining = filled_amount
+    realized = 0.0
+    for position in entry['positions']:
+        if remaining <= 0:
+            break
+        amount = float(position['amount'])
+        sold = min(amount, remaining)
+        profit = (fill_price - position['entry_price']) * sold
+        realized += profit
+        remaining -= sold
+        if sold >= amount:
+            info[currency]['positions'].remove(position)
+        else:
+            position['amount'] = amount - sold
+        account.exposure.record_reduce(currency, sold, position['entry_price'], closed=sold >= amount)
+        logging.info(" %s 倉位 入場價 %.4f 賣出 %.6f @ %.4f, 收益 %.4f", currency, position['entry_price'], sold, fill_price, profit)
+    account.record_realized(currency, realized, ts)
+    return realized
+
+
+def execute_exit_plan(plan, use_batch=None, save=True, account=None):
+    """
+    執行止盈計劃：每個幣種只下一張市價賣單，開啟批量時所有幣種合併為一次批量下單請求
+    完成後只保存一次持倉文件（save=False 時由調用方統一保存）
+    :return: {currency: 實現收益}
+    """
+    if not plan:
+        return {}
+    account = account or default_account()
+    client = account.exchange
+    if use_batch is None:
+        use_batch = EXIT_CONFIG['batch_orders'] and client.has.get('createOrders')
+
+    currencies = list(plan.keys())
+    tickets = {currency: execution.begin(f"{currency}/USDT", 'sell', plan[currency]['amount'], plan[currency]['price'],
+                                         source='take_profit', account=account.name)
+               for currency in currencies}
+    orders = {}
+    unknown = []  # 下單結果未知的幣種，不能重新提交，改為從成交記錄對帳
+    if use_batch and len(currencies) > 1:
+        limit = EXIT_CONFIG['batch_limit']
+        for start in range(0, len(currencies), limit):
+            chunk = currencies[start:start + limit]
+            try:
+                submitted_at = time.time()
+                results = client.create_orders([
+                    {'symbol': f"{currency}/USDT", 'type': 'market', 'side': 'sell', 'amount': plan[currency]['amount']}
+                    for currency in chunk
+                ])
+                acked_at = time.time()
+                for currency, order in zip(chunk, results):
+                    if not order or order.get('id') is None or order.get('status') == 'rejected':
+                        # 批量下單可部分成功：被拒絕的子訂單沒有訂單號，改由下面的單筆下單重新提交
+                        logging.warning("%s 批量賣出子訂單被拒絕，改為單筆下單: %s",
+                                        currency, (order or {}).get('info'))
+                        continue
+                    orders[currency] = order
+                    tickets[currency].acknowledged(order, submitted_at, acked_at)
+            except gateway.OutcomeUnknown:
+                unknown.extend(chunk)
+            except Exception as e:
+                logging.error("批量賣出下單失敗，改為逐幣種下單: %s", e)
+
+    results = {}
+    for currency in currencies:
+        if currency in unknown:
+            continue
+        entry = plan[currency]
+        symbol = f"{currency}/USDT"
+        try:
+            order = orders.get(currency)
+            if order is None:
+                order = tickets[currency].submit(client.create_market_sell_order, symbol, entry['amount'])
+            if not order:
+                logging.error(" %s 合併賣出倉位失敗", currency)
+                continue
+            filled_amount, fill_price = resolve_fill(order, symbol, entry['amount'], entry['price'], client, tickets[currency])
+            if filled_amount <= 0:
+                logging.warning("%s 賣單 %s 未成交，倉位保持不變", currency, order.get('id'))
+                continue
+            results[currency] = _allocate_fill(account, currency, entry, filled_amount, fill_price)
+            account.mark_applied(currency, order)
+            logging.info(" %s 合併賣出 %s 個倉位，數量 %.6f @ %.4f，實現收益 %.4f", currency, len(entry['positions']), filled_amount, fill_price, results[currency])
+        except gateway.OutcomeUnknown:
+            unknown.append(currency)
+        except ccxt.InsufficientFunds as e:
+            logging.error(" %s 餘額不足: %s", currency, e)
+        except ccxt.NetworkError as e:
+            logging.error(" %s 網路錯誤: %s", currency, e)
+        except Exception as e:
+            logging.error(" %s 合併賣出倉位錯誤: %s", currency, e)
+
+    if unknown:
+        import recovery  # recovery 依賴本模組，在函數內導入避免循環導入
+        for currency in unknown:
+            recovery.reconcile_unknown(account, currency)
+
+    if results and save:
+        account.save()
+    return results
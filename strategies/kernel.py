@@ -0,0 +1,206 @@
+"""
+策略決策核心：只做數組進、數組/動作列表出的純計算，不請求交易所、不寫日誌、不修改狀態。
+實盤、模擬盤與離線回放都調用同一組規則：
+- 首倉：價格跌破或觸及布林通道下軌
+- 加倉（第 2-12 倉位）：價格相對上一倉位入場價格跌幅 ≥ ladder_drop_pct
+- 止盈：價格 ≥ 入場價格 × (1 + take_profit_pct)
+- 再平衡：第 min_positions 個之後、收益率超過 min_profit 的倉位按比例賣出
+"""
+import numpy as np
+from config import strategy_params, rebalance_params, max_positions, total_investment_limit, first_position_amount
+
+NO_ENTRY = 0
+FIRST_ENTRY = 1
+LADDER_ADD = 2
+
+ENTRY_REASONS = {FIRST_ENTRY: 'first_entry', LADDER_ADD: 'ladder_add'}
+
+# 百分比比較的容差（百分點）：恰好跌 ladder_drop_pct / 漲 take_profit_pct 的價格不因浮點誤差判為未達到
+PCT_TOLERANCE = 1e-9
+
+
+def take_profit_prices(entry_prices, take_profit_pct=None):
+    """止盈價格，入場價格無效（≤0）時為 NaN"""
+    pct = strategy_params['take_profit_pct'] if take_profit_pct is None else take_profit_pct
+    entry_prices = np.asarray(entry_prices, dtype=float)
+    return np.where(entry_prices > 0, entry_prices * (1 + pct / 100), np.nan)
+
+
+def entry_signals(prices, lower_bands, position_counts, last_entry_prices,
+                  position_limit=None, ladder_drop_pct=None):
+    """
+    每個交易對的建倉信號
+    :param prices: (n,) 當前價格
+    :param lower_bands: (n,) 布林通道下軌，不需要首倉判斷的交易對可為 NaN
+    :param position_counts: (n,) 當前倉位數
+    :param last_entry_prices: (n,) 最後一個倉位的入場價格，無倉位時為 NaN
+    :return: (n,) NO_ENTRY / FIRST_ENTRY / LADDER_ADD
+    """
+    drop_pct = strategy_params['ladder_drop_pct'] if ladder_drop_pct is None else ladder_drop_pct
+    limit = max_positions if position_limit is None else position_limit
+    prices = np.asarray(prices, dtype=float)
+    lower_bands = np.asarray(lower_bands, dtype=float)
+    counts = np.asarray(position_counts)
+    last_entries = np.asarray(last_entry_prices, dtype=float)
+
+    valid = prices > 0
+    first = valid & (counts == 0) & (prices <= lower_bands)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        drop = (last_entries - prices) / last_entries * 100
+    ladder = valid & (counts > 0) & (counts < limit) & (last_entries > 0) & (drop >= drop_pct - PCT_TOLERANCE)
+    return np.where(first, FIRST_ENTRY, np.where(ladder, LADDER_ADD, NO_ENTRY))
+
+
+def entry_signal(price, lower_band, position_count, last_entry_price):
+    """單個交易對的建倉信號（entry_signals 的標量版本）"""
+    return int(entry_signals([price], [np.nan if lower_band is None else lower_band], [position_count],
+                             [np.nan if last_entry_price is None else last_entry_price])[0])
+
+
+def exit_mask(prices, entry_prices, amounts, take_profit_pct=None):
+    """
+    每個倉位是否達到止盈（漲幅 ≥ take_profit_pct，入場價格無效或價格為 NaN 時為 False）
+    :param prices: (m,) 倉位所屬交易對的當前價格
+    :return: (m,) bool
+    """
+    pct = strategy_params['take_profit_pct'] if take_profit_pct is None else take_profit_pct
+    prices = np.asarray(prices, dtype=float)
+    entries = np.asarray(entry_prices, dtype=float)
+    amounts = np.asarray(amounts, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        gain = (prices - entries) / entries * 100
+        return (entries > 0) & (gain >= pct - PCT_TOLERANCE) & (amounts > 0)
+
+
+def rebalance_selection(amounts, entry_prices, marks, stored_profits, sell_ratio):
+    """
+    再平衡倉位篩選（只傳入第 min_positions 個之後的倉位）
+    :param marks: (m,) 最新價格，≤0 時沿用 stored_profits
+    :param sell_ratio: (m,) 賣出比例，由調用方提供（隨機數不在核心中產生）
+    :return: (selected, sell_amounts, profit_pct)
+    """
+    amounts = np.asarray(amounts, dtype=float)
+    entries = np.asarray(entry_prices, dtype=float)
+    marks = np.asarray(marks, dtype=float)
+    profits = np.where(marks > 0, (marks - entries) * amounts, np.asarray(stored_profits, dtype=float))
+    cost = amounts * entries
+    with np.errstate(divide='ignore', invalid='ignore'):
+        profit_pct = np.where(cost > 0, profits / cost * 100, np.nan)
+    sell_amounts = amounts * np.asarray(sell_ratio, dtype=float)
+    with np.errstate(invalid='ignore'):
+        selected = (
+            np.isfinite(profit_pct)
+            & (profit_pct > rebalance_params['min_profit'])
+            & (amounts > 0)
+            & (sell_amounts >= rebalance_params['min_amount'])
+        )
+    return selected, sell_amounts, profit_pct
+
+
+def evaluate(prices, lower_bands, active, position_symbols, entry_prices, amounts,
+             invested=0.0, amount=None, investment_limit=None):
+    """
+    一次評估所有交易對與倉位，返回本週期的動作列表
+
+    :param prices: (n,) 各交易對當前價格
+    :param lower_bands: (n,) 布林通道下軌
+    :param active: (n,) bool，允許建倉的交易對（正在交易或等待開倉）
+    :param position_symbols: (m,) 每個倉位所屬交易對的索引，同一交易對內按建倉順序排列
+    :param entry_prices: (m,) 入場價格
+    :param amounts: (m,) 持倉數量
+    :param invested: 當前總投資額，建倉受 investment_limit 限制
+    :return: [{'type': 'open', 'symbol': i, 'reason': ..., 'price': p, 'amount': USDT},
+              {'type': 'close', 'symbol': i, 'position': j, 'price': p}, ...]
+    """
+    amount = first_position_amount if amount is None else amount
+    limit = total_investment_limit if investment_limit is None else investment_limit
+    prices = np.asarray(prices, dtype=float)
+    n = len(prices)
+    position_symbols = np.asarray(position_symbols, dtype=int)
+    entry_prices = np.asarray(entry_prices, dtype=float)
+    m = len(position_symbols)
+
+    counts = np.bincount(position_symbols, minlength=n) if m else np.zeros(n, dtype=int)
+    last_index = np.full(n, -1)
+    if m:
+        np.maximum.at(last_index, position_symbols, np.arange(m))
+    last_entries = np.where(last_index >= 0, entry_prices[np.maximum(last_index, 0)] if m else np.nan, np.nan)
+
+    signals = entry_signals(prices, lower_bands, counts, last_entries)
+    signals = np.where(np.asarray(active, dtype=bool), signals, NO_ENTRY)
+    opening = np.flatnonzero(signals != NO_ENTRY)
+    # 按交易對順序分配剩餘投資額度
+    opening = opening[invested + amount * np.arange(1, len(opening) + 1) <= limit]
+
+    actions = [{'type': 'open', 'symbol': int(i), 'reason': ENTRY_REASONS[int(signals[i])],
+                'price': float(prices[i]), 'amount': amount} for i in opening]
+    if m:
+        closing = np.flatnonzero(exit_mask(prices[position_symbols], entry_prices, amounts))
+        actions.extend({'type': 'close', 'symbol': int(position_symbols[j]), 'position': int(j),
+                        'price': float(prices[position_symbols[j]])} for j in closing)
+    return actions
+
+
+def step_variants(prices, lower_bands, active, entries, units, counts, invested,
+                  ladder_drop_pct, take_profit_pct, position_limit, amount, investment_limit, fee_rate=0.0):
+    """
+    K 組參數在同一個行情快照上的一個週期，所有變體一次數組運算完成（原地更新倉位數組）
+    規則與實盤相同：先建倉（首倉觸及下軌 / 相對上一倉位跌幅 ≥ ladder_drop_pct），再檢查止盈
+
+    :param prices: (n,) 當前價格，無價格為 NaN
+    :param lower_bands: (n,) 布林通道下軌，不需要首倉判斷的交易對可為 NaN
+    :param active: (n,) bool，允許建倉的交易對
+    :param entries: (K, n, P) 入場價格，空倉位為 NaN，同一交易對按建倉順序排列
+    :param units: (K, n, P) 持倉數量
+    :param counts: (K, n) 倉位數
+    :param invested: (K,) 當前總投資額
+    :param ladder_drop_pct, take_profit_pct, position_limit, amount, investment_limit: (K,) 每組參數
+    :return: dict，(K,) 的 opened / closed / realized / fees 與 (K, n) 的 opened_mask
+    """
+    prices = np.asarray(prices, dtype=float)
+    K, n, P = entries.shape
+    valid_price = np.isfinite(prices) & (prices > 0)
+
+    # 建倉：上一倉位入場價格由倉位數取出
+    last = np.take_along_axis(entries, np.maximum(counts - 1, 0)[:, :, None], axis=2)[:, :, 0]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        drop = (last - prices) / last * 100
+        first = (counts == 0) & (prices <= np.asarray(lower_bands, dtype=float))
+    ladder = (counts > 0) & (counts < position_limit[:, None]) & (drop >= ladder_drop_pct[:, None] - PCT_TOLERANCE)
+    opening = (first | ladder) & valid_price & np.asarray(active, dtype=bool) & (counts < P)
+    # 按交易對順序分配每組參數剩餘的投資額度
+    opening &= invested[:, None] + amount[:, None] * np.cumsum(opening, axis=1) <= investment_limit[:, None]
+    kk, ii = np.nonzero(opening)
+    slots = counts[kk, ii]
+    entries[kk, ii, slots] = prices[ii]
+    units[kk, ii, slots] = amount[kk] / prices[ii]
+    counts += opening
+    opened = opening.sum(axis=1)
+    fees = opened * amount * fee_rate
+    invested = invested + opened * amount
+
+    # 止盈
+    with np.errstate(divide='ignore', invalid='ignore'):
+        gain = (prices[None, :, None] - entries) / entries * 100
+        hit = gain >= take_profit_pct[:, None, None] - PCT_TOLERANCE
+    proceeds = np.where(hit, units * prices[None, :, None], 0.0)
+    cost = np.where(hit, units * entries, 0.0)
+    closed = hit.sum(axis=(1, 2))
+    fees = fees + proceeds.sum(axis=(1, 2)) * fee_rate
+    realized = (proceeds - cost).sum(axis=(1, 2))
+    if closed.any():
+        # 平倉後保留剩餘倉位的建倉順序，空位移到末尾
+        entries[hit] = np.nan
+        units[hit] = 0.0
+        order = np.argsort(np.isnan(entries), axis=2, kind='stable')
+        entries[...] = np.take_along_axis(entries, order, axis=2)
+        units[...] = np.take_along_axis(units, order, axis=2)
+        counts -= hit.sum(axis=2)
+    return {
+        'opened': opened,
+        'closed': closed,
+        'realized': realized,
+        'fees': fees,
+        'invested': invested - cost.sum(axis=(1, 2)),
+        'opened_mask': opening
+    }
@@ -1,155 +1,250 @@
+import time
 import logging
 import numpy as np
 import ccxt
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 from config import *
 from utils import exchange
+from market_data import check_liquidity
+from strategies.exit_strategy import resolve_fill
+from accounts import default_account
+import execution
+import gateway
+import recovery
+from strategies.kernel import rebalance_selection
+from strategies import take_profit_orders
 
-def rebalance_positions(currency):
+
+def plan_rebalance(currencies=None, prices=None, account=None):
+    """
+    第一階段：一次性為所有幣種的倉位評分並生成再平衡計劃（純計算，不請求交易所）
+
+    Args:
+        currencies (list): 需要評估的幣種，預設為全部支援的幣種
+        prices (dict): {currency: 當前價格}，未提供時使用 trade_info 中的 current_price
+        account (Account): 交易帳戶，預設為主帳戶
+
+    Returns:
+        dict: {currency: {'price': 價格, 'sell_amount': 合併賣出數量, 'items': [倉位賣出明細, ...]}}
+    """
+    info = (account or default_account()).trade_info
+    currencies = currencies or supported_currencies
+    prices = prices or {}
+    min_positions = rebalance_params['min_positions']
+
+    # 收集所有幣種中第 min_positions 個之後的倉位，拼成一組數組統一計算
+    refs, currency_idx, position_idx, amounts, entries, profits, marks = [], [], [], [], [], [], []
+    eligible = [c for c in currencies if c in info and len(info[c]['positions']) >= min_positions
+                and not info[c].get('pending_reconcile')]
+    for ci, currency in enumerate(eligible):
+        price = float_safe(prices.get(currency) or info[currency].get('current_price'))
+        for i, position in enumerate(info[currency]['positions'][min_positions - 1:], start=min_positions - 1):
+            refs.append(position)
+            currency_idx.append(ci)
+            position_idx.append(i)
+            amounts.append(float_safe(position.get('amount')))
+            entries.append(float_safe(position.get('entry_price')))
+            profits.append(position.get('profit') if isinstance(position.get('profit'), (int, float)) else np.nan)
+            marks.append(price)
+
+    if not refs:
+        return {}
+
+    currency_idx = np.array(currency_idx)
+    # 有最新價格時按市價重算浮動收益，否則沿用倉位記錄的收益（篩選規則在策略核心中）
+    sell_ratio = np.random.uniform(*rebalance_params['sell_ratio_range'], size=len(refs))
+    selected, sell_amounts, profit_pct = rebalance_selection(amounts, entries, marks, profits, sell_ratio)
+    marks = np.asarray(marks, dtype=float)
+
+    plan = {}
+    for k in np.flatnonzero(selected):
+        currency = eligible[currency_idx[k]]
+        entry = plan.setdefault(currency, {'price': float(marks[k]), 'sell_amount': 0.0, 'items': []})
+        entry['sell_amount'] += float(sell_amounts[k])
+        entry['items'].append({
+            'position': refs[k],
+            'position_index': position_idx[k],
+            'sell_amount': float(sell_amounts[k]),
+            'sell_ratio': float(sell_ratio[k]),
+            'profit_pct': float(profit_pct[k])
+        })
+
+    for currency, entry in plan.items():
+        logging.info("%s 再平衡計劃: %s 個倉位，合併賣出 %.6f", currency, len(entry['items']), entry['sell_amount'])
+    return plan
+
+
+def _submit_rebalance_order(client, currency, entry, account_name=None):
+    """在工作線程中執行：流動性檢查與下單，只做 I/O，不修改 trade_info"""
+    symbol = f"{currency}/USDT"
+    decided_at = time.time()
+    ok, reason, snapshot = check_liquidity(
+        symbol, amount=entry['sell_amount'], side='sell',
+        min_quote_volume=MARKET_DATA_CONFIG['min_quote_volume']
+    )
+    if not ok:
+        logging.warning("%s，跳過 %s 再平衡", reason, currency)
+        return None
+    fallback_price = entry['price'] or snapshot['best_bid']
+    ticket = execution.begin(symbol, 'sell', entry['sell_amount'], fallback_price,
+                             source='rebalance', account=account_name, decided_at=decided_at)
+    order = ticket.submit(client.create_market_sell_order, symbol, entry['sell_amount'])
+    return order, resolve_fill(order, symbol, entry['sell_amount'], fallback_price, client, ticket)
+
+
+def _apply_rebalance_fill(account, currency, entry, filled_amount, fill_price):
+    """在調用線程中執行：將成交按計劃比例分配回各倉位並更新收益"""
+    info = account.trade_info
+    positions = info[currency]['positions']
+    realized_total = 0.0
+    for item in entry['items']:
+        position = item['position']
+        actual_amount = filled_amount * item['sell_amount'] / entry['sell_amount']
+        position['amount'] -= actual_amount
+        account.exposure.record_reduce(currency, actual_amount, position['entry_price'])
+        profit_realized = (fill_price - position['entry_price']) * actual_amount
+        position['profit'] -= profit_realized
+        realized_total += profit_realized
+
+        # 使用配置的收益分配比例補充前面倉位的虧損
+        rebalance_amount = profit_realized * rebalance_params['profit_share']
+        for j in range(rebalance_params['min_positions'] - 1):
+            if positions[j]['profit'] < 0:
+                positions[j]['profit'] += rebalance_amount
+                logging.info("%s 使用 %.2f USDT補充倉位 %s 的虧損", currency, rebalance_amount, j)
+                break
+
+        info[currency]['rebalance_history'].append({
+            'timestamp': datetime.now().isoformat(),
+            'position_index': item['position_index'],
+            'sell_amount': actual_amount,
+            'sell_price': fill_price,
+            'profit_realized': profit_realized,
+            'rebalance_amount': rebalance_amount
+        })
+        info[currency]['rebalance_count'] += 1
+
+    account.record_realized(currency, realized_total)
+    info[currency]['last_rebalance_time'] = datetime.now()
+    logging.info("%s 再平衡賣出 %.6f @ %.4f, 實現收益=%.2f, 總收益=%.2f",
+                 currency, filled_amount, fill_price, realized_total, info[currency]['total_profit'])
+    return realized_total
+
+
+def execute_rebalance_plan(plan, max_workers=None, account=None):
+    """
+    第二階段：按計劃並行下單（每個幣種一張賣單，並發數有上限），
+    所有成交回來後由調用線程統一更新狀態並只保存一次
+
+    Returns:
+        dict: {currency: 實現收益}
+    """
+    if not plan:
+        return {}
+    account = account or default_account()
+    if not account.exchange:
+        logging.error("再平衡失敗: 交易所未初始化")
+        return {}
+
+    # 賣出前先把涉及倉位的止盈掛單減去本次賣出數量，釋放被掛單佔用的基礎幣種
+    for currency in list(plan):
+        try:
+            for item in plan[currency]['items']:
+                position = item['position']
+                if position.get('tp_order'):
+                    take_profit_orders.resize(currency, position, position['amount'] - item['sell_amount'], account)
+        except Exception as e:
+            logging.error("%s 調整止盈掛單失敗，跳過本次再平衡: %s", currency, e)
+            del plan[currency]
+    if not plan:
+        return {}
+
+    max_workers = max_workers or rebalance_params['max_workers']
+    fills = {}
+    unknown = []  # 下單結果未知的幣種，成交分配完成後從成交記錄對帳
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(plan))) as executor:
+        futures = {currency: executor.submit(_submit_rebalance_order, account.exchange, currency, entry, account.name)
+                   for currency, entry in plan.items()}
+        for currency, future in futures.items():
+            try:
+                fill = future.result()
+                if fill:
+                    fills[currency] = fill
+            except gateway.OutcomeUnknown:
+                unknown.append(currency)
+            except ccxt.InsufficientFunds as e:
+                logging.error("%s 再平衡餘額不足: %s", currency, e)
+            except ccxt.NetworkError as e:
+                logging.error("%s 再平衡網路錯誤: %s", currency, e)
+            except Exception as e:
+                logging.error("%s 再平衡賣出失敗: %s", currency, e)
+
+    results = {}
+    for currency, (order, (filled_amount, fill_price)) in fills.items():
+        if filled_amount <= 0:
+            logging.warning("%s 再平衡賣單 %s 未成交", currency, order.get('id'))
+            continue
+        try:
+            results[currency] = _apply_rebalance_fill(account, currency, plan[currency], filled_amount, fill_price)
+            account.mark_applied(currency, order)
+        except Exception as e:
+            logging.error("%s 更新再平衡結果失敗: %s", currency, e)
+    for currency in unknown:
+        recovery.reconcile_unknown(account, currency)
+
+    # 止盈掛單數量與實際剩餘倉位對齊（部分成交或賣出失敗時）
+    for currency, entry in plan.items():
+        for item in entry['items']:
+            position = item['position']
+            if position.get('tp_order') and position in account.trade_info[currency]['positions']:
+                try:
+                    take_profit_orders.resize(currency, position, position['amount'], account)
+                except Exception as e:
+                    logging.error("%s 對齊止盈掛單數量失敗: %s", currency, e)
+
+    if results:
+        account.save()  # 整個計劃只儲存一次
+    return results
+
+
+def rebalance_all(prices=None, account=None):
+    """一次規劃並執行所有幣種的再平衡"""
+    return execute_rebalance_plan(plan_rebalance(prices=prices, account=account), account=account)
+
+
+def rebalance_positions(currency, account=None):
     """
     實現回補機制的具體邏輯
-    
+
     Args:
         currency (str): 貨幣代碼
-    
+        account (Account): 交易帳戶，預設為主帳戶
+
     Returns:
         bool: 再平衡是否成功
     """
+    account = account or default_account()
+    info = account.trade_info
     try:
-        if not exchange:
-            logging.error(f"{currency} 再平衡失敗: 交易所未初始化")
+        if not account.exchange:
+            logging.error("%s 再平衡失敗: 交易所未初始化", currency)
             return False
-            
-        positions = trade_info[currency]['positions']
-        if len(positions) < rebalance_params['min_positions']:
-            logging.info(f"{currency} 持倉數量不足{rebalance_params['min_positions']}個，無需再平衡")
+
+        if len(info[currency]['positions']) < rebalance_params['min_positions']:
+            logging.info("%s 持倉數量不足%s個，無需再平衡", currency, rebalance_params['min_positions'])
             return False
-            
-        logging.info(f"開始{currency}倉位再平衡")
-        rebalance_success = False
-        
-        # 從第5個倉位開始賣出
-        for i in range(rebalance_params['min_positions']-1, len(positions)):
-            position = positions[i]
-            
-            try:
-                if not isinstance(position['profit'], (int, float)) or np.isnan(position['profit']):
-                    logging.warning(f"{currency} 倉位 {i} 收益計算錯誤，跳過該倉位")
-                    continue
-                    
-                profit_percentage = (position['profit'] / (position['amount'] * position['entry_price'])) * 100
-                if profit_percentage <= rebalance_params['min_profit']:
-                    logging.info(f"{currency} 倉位 {i} 獲利{profit_percentage:.2f}%不足{rebalance_params['min_profit']}%，跳過該倉位")
-                    continue
-                    
-                if not isinstance(position['amount'], (int, float)) or position['amount'] <= 0:
-                    logging.warning(f"{currency} 倉位 {i} 持倉量異常，跳過該倉位")
-                    continue
-                
-                # 使用配置的賣出比例範圍
-                sell_ratio = np.random.uniform(*rebalance_params['sell_ratio_range'])
-                sell_amount = position['amount'] * sell_ratio
-                
-                if sell_amount < rebalance_params['min_amount']:
-                    logging.warning(f"{currency} 倉位 {i} 賣出量{sell_amount}小於最小交易量{rebalance_params['min_amount']}，跳過該倉位")
-                    continue
-                    
-                logging.info(f"{currency} 倉位 {i} 準備賣出 {sell_ratio*100:.1f}% 持倉，數量: {sell_amount:.4f}")
-                
-                # 檢查市場狀態
-                try: 
-                    # 使用最新價格
-                    ticker = exchange.fetch_ticker(f"{currency}/USDT")
-                    current_price = float(ticker['last'])
-                    
-                    # 檢查是否有足夠的市場深度
-                    orderbook = exchange.fetch_order_book(f"{currency}/USDT")
-                    best_bid = orderbook['bids'][0][0] if orderbook['bids'] else 0
-                    best_ask = orderbook['asks'][0][0] if orderbook['asks'] else float('inf')
-                    
-                    spread = (best_ask - best_bid) / best_bid * 100
-                    if spread > 1.0:  # 如果買賣差價超過1%
-                        logging.warning(f"{currency} 買賣差價過大({spread:.2f}%)，跳過該倉位")
-                        continue
-                        
-                    # 檢查24小時交易量
-                    if ticker['quoteVolume'] < 100000:  # 如果24小時交易量小於10萬USDT
-                        logging.warning(f"{currency} 24小時交易量過低({ticker['quoteVolume']:.2f} USDT)，跳過該倉位")
-                        continue
-                        
-                    logging.info(f"{currency} 市場檢查通過: 當前價格={current_price:.4f}, "
-                               f"買賣差價={spread:.2f}%, 24h交易量={ticker['quoteVolume']:.2f} USDT")
-                        
-                except Exception as e:
-                    logging.error(f"{currency} 檢查市場狀態失敗: {str(e)}")
-                    continue
-                
-                try:
-                    # 使用safe_api_call包裝下單操作
-                    order = exchange.create_market_sell_order(f"{currency}/USDT", sell_amount)
-                    actual_price = float(order['price'])
-                    actual_amount = float(order['amount'])
-                    
-                    position['amount'] -= actual_amount
-                    profit_realized = (actual_price - position['entry_price']) * actual_amount
-                    position['profit'] -= profit_realized
-                    
-                    logging.info(f"{currency} 倉位 {i} 賣出成功: 價格={actual_price:.4f}, "
-                               f"數量={actual_amount:.4f}, 實現收益={profit_realized:.2f}")
-                    
-                    # 使用配置的收益分配比例
-                    rebalance_amount = profit_realized * rebalance_params['profit_share']
-                    for j in range(rebalance_params['min_positions']-1):
-                        if positions[j]['profit'] < 0:
-                            positions[j]['profit'] += rebalance_amount
-                            logging.info(f"{currency} 使用 {rebalance_amount:.2f} USDT補充倉位 {j} 的虧損")
-                            break
-                    
-                    # 更新總收益
-                    trade_info[currency]['total_profit'] += profit_realized
-                    trade_info[currency]['daily_profit'] += profit_realized
-                    trade_info[currency]['monthly_profit'] += profit_realized
-                    
-                    
-                    # 記錄再平衡歷史
-                    rebalance_record = {
-                        'timestamp': datetime.now().isoformat(),
-                        'position_index': i,
-                        'sell_amount': actual_amount,
-                        'sell_price': actual_price,
-                        'profit_realized': profit_realized,
-                        'rebalance_amount': rebalance_amount
-                    }
-                    trade_info[currency]['rebalance_history'].append(rebalance_record)
-                    trade_info[currency]['last_rebalance_time'] = datetime.now()
-                    trade_info[currency]['rebalance_count'] += 1
-                     
-                    save_trade_info_to_file(trade_info)  # 儲存到 JSON 文件
-
-                    logging.info(f"{currency} 更新收益: 總收益={trade_info[currency]['total_profit']:.2f}, 日收益={trade_info[currency]['daily_profit']:.2f}")
-                    rebalance_success = True
-                    
-                except ccxt.InsufficientFunds as e:
-                    logging.error(f"{currency} 倉位 {i} 餘額不足: {str(e)}")
-                    continue
-                except ccxt.NetworkError as e:
-                    logging.error(f"{currency} 倉位 {i} 網路錯誤: {str(e)}")
-                    continue
-                except Exception as e:
-                    logging.error(f"{currency} 倉位 {i} 賣出失敗: {str(e)}")
-                    continue
-                    
-            except Exception as e:
-                logging.error(f"{currency} 倉位 {i} 處理錯誤: {str(e)}")
-                continue
-                
+
+        logging.info("開始%s倉位再平衡", currency)
+        rebalance_success = bool(execute_rebalance_plan(plan_rebalance([currency], account=account), account=account))
+
         if rebalance_success:
-            logging.info(f"{currency} 倉位再平衡完成，總計執行{trade_info[currency]['rebalance_count']}次再平衡")
+            logging.info("%s 倉位再平衡完成，總計執行%s次再平衡", currency, info[currency]['rebalance_count'])
         else:
-            logging.info(f"{currency} 本次再平衡未執行任何操作")
-            
+            logging.info("%s 本次再平衡未執行任何操作", currency)
+
         return rebalance_success
-        
+
     except Exception as e:
-        logging.error(f"{currency} 再平衡過程發生錯誤: {str(e)}")
+        logging.error("%s 再平衡過程發生錯誤: %s", currency, e)
         return False
\ No newline at end of file
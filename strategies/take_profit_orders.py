@@ -0,0 +1,263 @@
+"""
+交易所端止盈掛單：建倉後在 target_price 掛出限價賣單（或 OKX 止盈委託），成交延遲只取決於交易所撮合，
+有掛單的倉位不再由每個週期的價格輪詢檢查止盈。
+
+倉位的 tp_order 記錄掛單：{'id', 'mode', 'price', 'amount', 'placed_at'}
+- sync：每 sync_interval 秒請求一次未成交訂單列表，不在列表中的掛單再查詢一次最終狀態並記帳
+- resize：倉位數量變化（再平衡）時修改掛單數量，不支援修改時撤單重掛
+- release：賣出全部倉位前撤銷該幣種的所有掛單，撤單時已成交的部分先記帳
+"""
+import time
+import logging
+import ccxt
+import execution
+from config import RESTING_TP_CONFIG, RECOVERY_CONFIG, float_safe
+from accounts import default_account
+from strategies.exit_strategy import calculate_target_price, _allocate_fill
+
+# OKX 止盈委託的查詢與撤單需要指定委託類型
+_ALGO_PARAMS = {'trigger': True}
+_ALGO_OPEN_PARAMS = {'trigger': True, 'ordType': 'conditional'}
+_FINAL = ('closed', 'canceled', 'cancelled', 'expired', 'rejected')
+
+_last_sync = {}    # account.name -> 上次同步時間
+_retry_after = {}  # (account.name, currency, 倉位時間戳) -> 掛單失敗後可重試的時間
+
+
+def _params(mode):
+    return dict(_ALGO_PARAMS) if mode == 'algo' else {}
+
+
+def _precise(client, symbol, amount, price):
+    """按交易所精度取整（客戶端不支援時原樣返回）"""
+    try:
+        amount = float(client.amount_to_precision(symbol, amount))
+        if price is not None:
+            price = float(client.price_to_precision(symbol, price))
+    except (AttributeError, ccxt.BaseError):
+        pass
+    return amount, price
+
+
+def place(currency, position, account=None, amount=None):
+    """
+    為倉位掛出止盈單，成功時寫入 position['tp_order']
+    :param amount: 掛單數量，預設為倉位數量
+    :return: 交易所返回的訂單，失敗時返回 None（該倉位繼續由輪詢止盈）
+    """
+    account = account or default_account()
+    client = account.exchange
+    symbol = f"{currency}/USDT"
+    mode = RESTING_TP_CONFIG['mode']
+    target = float_safe(position.get('target_price')) or calculate_target_price(currency, float_safe(position.get('entry_price')))
+    amount, price = _precise(client, symbol, float_safe(position['amount'] if amount is None else amount), target)
+    if not target or amount <= 0:
+        return None
+    try:
+        if mode == 'algo':
+            order = client.create_order(symbol, 'market', 'sell', amount, None, {'takeProfitPrice': price})
+        else:
+            order = client.create_order(symbol, 'limit', 'sell', amount, price)
+    except Exception as e:
+        _retry_after[(account.name, currency, position.get('timestamp'))] = time.time() + RESTING_TP_CONFIG['retry_interval']
+        logging.warning("%s 止盈掛單失敗，該倉位改由輪詢止盈: %s", currency, e)
+        return None
+    position['tp_order'] = {'id': order['id'], 'mode': mode, 'price': price, 'amount': amount, 'placed_at': time.time()}
+    logging.info("%s 止盈掛單 %s: 賣出 %.6f @ %.6f（%s）", currency, order['id'], amount, price, mode)
+    return order
+
+
+def _fetch(client, currency, tp_order):
+    """
+    查詢掛單的當前狀態；查不到時從歷史訂單與成交記錄確定最終狀態
+    :return: 訂單，無法確定最終狀態時返回 None（保留 tp_order，下次同步重試）
+    """
+    try:
+        return client.fetch_order(tp_order['id'], f"{currency}/USDT", _params(tp_order['mode']))
+    except ccxt.OrderNotFound:
+        return _find_archived(client, currency, tp_order)
+
+
+def _find_archived(client, currency, tp_order):
+    """
+    OKX 的訂單成交或撤銷後會歸檔，fetch_order 返回不存在：先在已完成訂單中查找，
+    限價單再按成交記錄匯總（與重啟恢復相同的查詢方式）
+    """
+    symbol = f"{currency}/USDT"
+    since = int(tp_order['placed_at'] * 1000) - RECOVERY_CONFIG['overlap_seconds'] * 1000
+    if client.has.get('fetchClosedOrders'):
+        try:
+            for order in client.fetch_closed_orders(symbol, since, None, _params(tp_order['mode'])):
+                if order.get('id') == tp_order['id']:
+                    return order
+        except Exception as e:
+            logging.warning("%s 查詢已完成訂單失敗: %s", currency, e)
+    # 止盈委託觸發後的成交屬於另一個訂單號，只有限價單能按成交記錄匹配
+    if tp_order['mode'] == 'limit' and client.has.get('fetchMyTrades'):
+        try:
+            trades = [t for t in client.fetch_my_trades(symbol, since) if t.get('order') == tp_order['id']]
+        except Exception as e:
+            logging.warning("%s 查詢成交記錄失敗: %s", currency, e)
+            trades = []
+        if trades:
+            filled = sum(float_safe(t.get('amount')) for t in trades)
+            cost = sum(float_safe(t.get('cost')) or float_safe(t.get('amount')) * float_safe(t.get('price')) for t in trades)
+            return {'id': tp_order['id'], 'status': 'closed', 'filled': filled, 'average': cost / filled if filled else None,
+                    'lastTradeTimestamp': max(t['timestamp'] for t in trades)}
+    return None
+
+
+def _apply(account, currency, position, tp_order, order):
+    """掛單（部分）成交：按成交數量與均價減少倉位並記錄收益與成交品質，返回實現收益"""
+    symbol = f"{currency}/USDT"
+    filled = float_safe(order.get('filled'))
+    if not filled and order.get('status') == 'closed':
+        # 止盈委託觸發後的回報可能沒有成交數量，按委託數量記帳
+        filled = tp_order['amount']
+    average = float_safe(order.get('average')) or float_safe(order.get('price')) or tp_order['price']
+    if filled <= 0:
+        return 0.0
+    ticket = execution.begin(symbol, 'sell', tp_order['amount'], tp_order['price'], source='resting_take_profit',
+                             account=account.name, decided_at=tp_order['placed_at'])
+    ticket.acknowledged(order, tp_order['placed_at'], tp_order['placed_at'])
+    ticket.fill(filled, average, order)
+    ts = (order.get('lastTradeTimestamp') or order.get('timestamp') or time.time() * 1000) / 1000
+    realized = _allocate_fill(account, currency, {'positions': [position]}, filled, average, ts)
+    account.mark_applied(currency, order)
+    logging.info("%s 止盈掛單 %s 成交 %.6f @ %.6f，實現收益 %.4f", currency, tp_order['id'], filled, average, realized)
+    return realized
+
+
+def _settle(account, currency, position, order):
+    """
+    掛單已結束：按最終狀態記帳並清除 tp_order
+    已由重啟恢復回放過的訂單（在成交檢查點中）只清除記錄，不重複記帳
+    :return: 實現收益
+    """
+    tp_order = position['tp_order']
+    position['tp_order'] = None
+    applied = account.trade_info[currency].get('fill_checkpoint', {}).get('order_ids', [])
+    if tp_order['id'] in applied:
+        return 0.0
+    return _apply(account, currency, position, tp_order, order)
+
+
+def cancel(currency, position, account=None):
+    """
+    撤銷倉位的止盈掛單；撤單時已（部分）成交的數量先記帳
+    撤單失敗或無法確定最終狀態時拋出 ccxt 異常，掛單記錄保持不變
+    :return: 實現收益（未成交時為 0）
+    """
+    account = account or default_account()
+    tp_order = position.get('tp_order')
+    if not tp_order:
+        return 0.0
+    client = account.exchange
+    try:
+        client.cancel_order(tp_order['id'], f"{currency}/USDT", _params(tp_order['mode']))
+    except ccxt.OrderNotFound:
+        pass  # 已成交或已撤銷，以下面查詢的最終狀態為準
+    order = _fetch(client, currency, tp_order)
+    if order is None:
+        raise ccxt.ExchangeError(f"{currency} 止盈掛單 {tp_order['id']} 撤單後無法確定最終狀態")
+    if order.get('status') not in _FINAL:
+        raise ccxt.ExchangeError(f"{currency} 止盈掛單 {tp_order['id']} 撤單後狀態仍為 {order.get('status')}")
+    return _settle(account, currency, position, order)
+
+
+def resize(currency, position, amount, account=None):
+    """
+    把倉位的止盈掛單數量改為 amount：限價單且交易所支援時直接修改，否則撤單後按新數量重掛
+    :return: 撤單時已成交部分的實現收益
+    """
+    account = account or default_account()
+    tp_order = position.get('tp_order')
+    if not tp_order:
+        return 0.0
+    client = account.exchange
+    symbol = f"{currency}/USDT"
+    amount, _ = _precise(client, symbol, amount, None)
+    if abs(amount - tp_order['amount']) <= 1e-12:
+        return 0.0
+    if tp_order['mode'] == 'limit' and amount > 0 and client.has.get('editOrder'):
+        try:
+            order = client.edit_order(tp_order['id'], symbol, 'limit', 'sell', amount, tp_order['price'])
+            tp_order.update(id=order.get('id') or tp_order['id'], amount=amount)
+            logging.info("%s 止盈掛單 %s 數量改為 %.6f", currency, tp_order['id'], amount)
+            return 0.0
+        except Exception as e:
+            logging.warning("%s 修改止盈掛單失敗，改為撤單重掛: %s", currency, e)
+    realized = cancel(currency, position, account)
+    if position in account.trade_info[currency]['positions'] and amount > 0:
+        place(currency, position, account, amount=min(amount, position['amount']))
+    return realized
+
+
+def release(currency, account=None):
+    """撤銷該幣種所有倉位的止盈掛單（賣出全部倉位前調用），返回撤單時已成交部分的實現收益"""
+    account = account or default_account()
+    return sum(cancel(currency, position, account)
+               for position in list(account.trade_info[currency]['positions']) if position.get('tp_order'))
+
+
+def sync(account=None, currencies=None, force=False):
+    """
+    同步止盈掛單狀態（按 sync_interval 節流）：一次請求未成交訂單，不在其中的掛單查詢最終狀態並記帳；
+    啟用時為沒有掛單的倉位補掛（建倉時掛單失敗、重啟恢復回放的倉位、啟用前已有的倉位）
+    :return: {'settled': 結束的掛單數, 'placed': 新掛單數, 'realized': 實現收益}
+    """
+    account = account or default_account()
+    report = {'settled': 0, 'placed': 0, 'realized': 0.0}
+    now = time.time()
+    if not force and now - _last_sync.get(account.name, 0.0) < RESTING_TP_CONFIG['sync_interval']:
+        return report
+    _last_sync[account.name] = now
+    client = account.exchange
+    info = account.trade_info
+    currencies = [c for c in (currencies or info) if c in info]
+
+    tracked = [(currency, position) for currency in currencies
+               for position in info[currency]['positions'] if position.get('tp_order')]
+    if tracked:
+        open_ids = None
+        if client.has.get('fetchOpenOrders'):
+            try:
+                modes = {position['tp_order']['mode'] for _, position in tracked}
+                open_ids = set()
+                for mode in modes:
+                    params = dict(_ALGO_OPEN_PARAMS) if mode == 'algo' else {}
+                    open_ids.update(order['id'] for order in client.fetch_open_orders(None, None, None, params))
+            except Exception as e:
+                logging.warning("[%s] 獲取未成交訂單失敗，逐個查詢止盈掛單: %s", account.name, e)
+                open_ids = None
+        for currency, position in tracked:
+            tp_order = position['tp_order']
+            if open_ids is not None and tp_order['id'] in open_ids:
+                continue
+            try:
+                order = _fetch(client, currency, tp_order)
+                if order is None:
+                    logging.warning("%s 止盈掛單 %s 無法確定最終狀態，下次同步重試", currency, tp_order['id'])
+                    continue
+                if order.get('status') not in _FINAL:
+                    continue
+                report['realized'] += _settle(account, currency, position, order)
+                report['settled'] += 1
+            except Exception as e:
+                logging.error("%s 同步止盈掛單 %s 失敗: %s", currency, tp_order['id'], e)
+
+    if RESTING_TP_CONFIG['enabled']:
+        for currency in currencies:
+            for position in list(info[currency]['positions']):
+                key = (account.name, currency, position.get('timestamp'))
+                if position.get('tp_order') or _retry_after.get(key, 0.0) > now:
+                    continue
+                if place(currency, position, account):
+                    _retry_after.pop(key, None)
+                    report['placed'] += 1
+
+    if report['settled'] or report['placed']:
+        account.save()
+        logging.info("[%s] 止盈掛單同步: 結束 %s，新掛 %s，實現收益 %.4f",
+                     account.name, report['settled'], report['placed'], report['realized'])
+    return report
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# 策略核心測試不連網：以模擬交易所模式載入 config，不需要 API 憑證
+os.environ.setdefault('EXCHANGE_MODE', 'fake')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
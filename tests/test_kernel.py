@@ -0,0 +1,192 @@
+"""策略核心規則測試：只調用 strategies.kernel 的純函數，不需要交易所"""
+import numpy as np
+import pytest
+
+from strategies import kernel
+from strategies.kernel import NO_ENTRY, FIRST_ENTRY, LADDER_ADD
+
+NAN = np.nan
+
+
+# ---- 建倉信號 ----
+
+def test_first_entry_at_or_below_lower_band():
+    signals = kernel.entry_signals([99.0, 100.0, 101.0], [100.0, 100.0, 100.0], [0, 0, 0], [NAN, NAN, NAN])
+    assert signals.tolist() == [FIRST_ENTRY, FIRST_ENTRY, NO_ENTRY]
+
+
+def test_first_entry_only_without_positions():
+    # 已有倉位時觸及下軌不是首倉，只按加倉規則判斷
+    assert kernel.entry_signal(90.0, 100.0, 1, 91.0) == NO_ENTRY
+
+
+@pytest.mark.parametrize('last, price', [(100.0, 94.0), (0.7, 0.658), (33.3, 31.302), (3000.0, 2820.0)])
+def test_ladder_add_at_exactly_six_percent(last, price):
+    assert kernel.entry_signal(price, None, 1, last) == LADDER_ADD
+
+
+def test_ladder_add_below_six_percent():
+    assert kernel.entry_signal(94.01, None, 1, 100.0) == NO_ENTRY
+
+
+def test_ladder_add_respects_position_limit():
+    signals = kernel.entry_signals([90.0, 90.0], [NAN, NAN], [11, 12], [100.0, 100.0], position_limit=12)
+    assert signals.tolist() == [LADDER_ADD, NO_ENTRY]
+
+
+def test_nan_band_and_nan_price_never_enter():
+    signals = kernel.entry_signals([50.0, NAN, NAN, 0.0], [NAN, 100.0, NAN, 100.0], [0, 0, 1, 0], [NAN, NAN, 100.0, NAN])
+    assert signals.tolist() == [NO_ENTRY] * 4
+    assert kernel.entry_signal(50.0, None, 0, None) == NO_ENTRY
+
+
+# ---- 止盈 ----
+
+@pytest.mark.parametrize('entry, price', [(100.0, 103.0), (0.1, 0.103), (1.1, 1.133), (0.07, 0.0721), (2.2, 2.266)])
+def test_take_profit_at_exactly_three_percent(entry, price):
+    assert kernel.exit_mask([price], [entry], [1.0]).tolist() == [True]
+
+
+def test_take_profit_below_three_percent():
+    assert kernel.exit_mask([102.99], [100.0], [1.0]).tolist() == [False]
+
+
+def test_take_profit_ignores_nan_price_invalid_entry_and_empty_amount():
+    mask = kernel.exit_mask([NAN, 200.0, 200.0, 200.0], [100.0, 0.0, NAN, 100.0], [1.0, 1.0, 1.0, 0.0])
+    assert mask.tolist() == [False, False, False, False]
+
+
+# ---- 再平衡篩選 ----
+
+def test_rebalance_selection_uses_marks_and_falls_back_to_stored_profit():
+    from config import rebalance_params
+    above = rebalance_params['min_profit'] + 1
+    amount = max(rebalance_params['min_amount'] * 10, 1.0)
+    selected, sell_amounts, profit_pct = kernel.rebalance_selection(
+        [amount, amount, amount], [100.0, 100.0, 100.0], [100.0 + above, 100.0, 0.0],
+        [0.0, 0.0, amount * above], [0.5, 0.5, 0.5])
+    assert selected.tolist() == [True, False, True]
+    assert sell_amounts.tolist() == pytest.approx([amount * 0.5] * 3)
+    assert profit_pct[0] == pytest.approx(above)
+
+
+# ---- evaluate ----
+
+def test_evaluate_cuts_off_entries_in_symbol_order_at_investment_limit():
+    actions = kernel.evaluate([90.0, 90.0, 90.0], [100.0, 100.0, 100.0], [True, True, True], [], [], [],
+                              invested=940.0, amount=30.0, investment_limit=1000.0)
+    assert [a['symbol'] for a in actions if a['type'] == 'open'] == [0, 1]
+
+
+def test_evaluate_skips_inactive_symbols_and_reports_closes():
+    actions = kernel.evaluate([90.0, 110.0], [100.0, 100.0], [False, True], [1, 1], [120.0, 100.0], [1.0, 1.0])
+    assert actions == [{'type': 'close', 'symbol': 1, 'position': 1, 'price': 110.0}]
+
+
+# ---- step_variants ----
+
+def _book(entries, P, K=1):
+    """(K, n, P) 的倉位數組，每組參數從相同的倉位出發"""
+    n = len(entries)
+    book_entries = np.full((K, n, P), NAN)
+    book_units = np.zeros((K, n, P))
+    counts = np.zeros((K, n), dtype=np.int64)
+    for i, row in enumerate(entries):
+        book_entries[:, i, :len(row)] = row
+        book_units[:, i, :len(row)] = [30.0 / e for e in row]
+        counts[:, i] = len(row)
+    return book_entries, book_units, counts
+
+
+def _params(K=1, ladder=6.0, take_profit=3.0, limit=5, amount=30.0, investment_limit=3000.0):
+    return (np.full(K, ladder), np.full(K, take_profit), np.full(K, limit, dtype=np.int64),
+            np.full(K, amount), np.full(K, investment_limit))
+
+
+def test_step_variants_compacts_slots_after_closes():
+    entries, units, counts = _book([[90.0, 120.0, 110.0, 100.0]], P=5)
+    invested = np.array([120.0])
+    result = kernel.step_variants(np.array([100.0]), np.array([NAN]), np.array([True]), entries, units, counts,
+                                  invested, *_params())
+    assert result['closed'].tolist() == [1]
+    assert result['opened'].tolist() == [0]
+    assert counts.tolist() == [[3]]
+    assert entries[0, 0, :3].tolist() == [120.0, 110.0, 100.0]
+    assert np.isnan(entries[0, 0, 3:]).all()
+    assert units[0, 0, :3].tolist() == pytest.approx([30.0 / 120, 30.0 / 110, 30.0 / 100])
+    assert units[0, 0, 3:].tolist() == [0.0, 0.0]
+    assert result['realized'][0] == pytest.approx(30.0 / 90 * 10)
+
+    # 下一次加倉寫入壓縮後的第一個空位，並以最後一個倉位的入場價格計算跌幅
+    result = kernel.step_variants(np.array([94.0]), np.array([NAN]), np.array([True]), entries, units, counts,
+                                  result['invested'], *_params())
+    assert result['opened'].tolist() == [1]
+    assert counts.tolist() == [[4]]
+    assert entries[0, 0, :4].tolist() == [120.0, 110.0, 100.0, 94.0]
+
+
+def test_step_variants_investment_limit_cutoff_per_variant():
+    entries, units, counts = _book([[], [], []], P=5, K=2)
+    ladder, take_profit, limit, amount, _ = _params(K=2)
+    result = kernel.step_variants(np.array([90.0, 90.0, 90.0]), np.array([100.0, 100.0, 100.0]),
+                                  np.array([True, True, True]), entries, units, counts, np.array([940.0, 0.0]),
+                                  ladder, take_profit, limit, amount, np.array([1000.0, 1000.0]))
+    assert result['opened_mask'].tolist() == [[True, True, False], [True, True, True]]
+    assert result['invested'].tolist() == [1000.0, 90.0]
+
+
+def test_step_variants_nan_price_and_band():
+    entries, units, counts = _book([[100.0], []], P=5)
+    result = kernel.step_variants(np.array([NAN, 50.0]), np.array([NAN, NAN]), np.array([True, True]),
+                                  entries, units, counts, np.array([30.0]), *_params())
+    assert result['opened'].tolist() == [0]
+    assert result['closed'].tolist() == [0]
+    assert counts.tolist() == [[1, 0]]
+
+
+# ---- evaluate 與 step_variants 一致 ----
+
+@pytest.mark.parametrize('seed', range(20))
+def test_evaluate_and_step_variants_make_the_same_decisions(seed):
+    from config import strategy_params, max_positions
+    rng = np.random.default_rng(seed)
+    n, P, amount, limit = 8, max_positions, 30.0, 600.0
+    rows = []
+    for _ in range(n):
+        entry = rng.uniform(50, 150)
+        row = []
+        for _ in range(rng.integers(0, 5)):
+            row.append(round(entry, 2))
+            entry *= rng.uniform(0.85, 1.0)
+        rows.append(row)
+    prices = np.array([rng.uniform(0.85, 1.1) * (row[-1] if row else 100.0) for row in rows])
+    bands = rng.uniform(80, 110, n)
+    prices[rng.random(n) < 0.1] = NAN
+    bands[rng.random(n) < 0.2] = NAN
+    active = rng.random(n) < 0.8
+    invested = float(sum(30.0 for row in rows for _ in row))
+
+    symbols = [i for i, row in enumerate(rows) for _ in row]
+    flat_entries = [e for row in rows for e in row]
+    flat_amounts = [30.0 / e for e in flat_entries]
+    actions = kernel.evaluate(prices, bands, active, symbols, flat_entries, flat_amounts,
+                              invested=invested, amount=amount, investment_limit=limit)
+    opens = sorted(a['symbol'] for a in actions if a['type'] == 'open')
+    closes = {a['position'] for a in actions if a['type'] == 'close'}
+
+    entries, units, counts = _book(rows, P)
+    params = _params(ladder=strategy_params['ladder_drop_pct'], take_profit=strategy_params['take_profit_pct'],
+                     limit=max_positions, amount=amount, investment_limit=limit)
+    result = kernel.step_variants(prices, bands, active, entries, units, counts, np.array([invested]), *params)
+
+    assert np.flatnonzero(result['opened_mask'][0]).tolist() == opens
+    assert int(result['closed'][0]) == len(closes)
+    # 每個交易對剩下的倉位 = 原倉位去掉 evaluate 平倉的倉位（保持順序）+ 本週期新建倉位
+    position = 0
+    for i, row in enumerate(rows):
+        kept = [e for j, e in enumerate(row, start=position) if j not in closes]
+        position += len(row)
+        if i in opens:
+            kept.append(prices[i])
+        assert counts[0, i] == len(kept)
+        assert entries[0, i, :len(kept)].tolist() == pytest.approx(kept)
@@ -0,0 +1,68 @@
+"""全市場掃描的覆蓋範圍：每次掃描的K線請求不超過預算，未緩存的交易對在後續掃描中輪流補齊"""
+import math
+import time
+
+import pytest
+
+import scanner
+from config import SCANNER_CONFIG, MARKET_DATA_CONFIG, indicator_params
+
+
+class _Exchange:
+    """只提供掃描用到的批量行情與K線，所有K線都屬於當前週期"""
+
+    markets = {}
+
+    def __init__(self, n):
+        volume = MARKET_DATA_CONFIG['min_quote_volume'] * 10
+        self.tickers = {f"C{i}/USDT": {'last': 100.0, 'bid': 100.0, 'ask': 100.01, 'quoteVolume': volume + i}
+                        for i in range(n)}
+        self.ohlcv_calls = 0
+
+    def fetch_tickers(self):
+        return self.tickers
+
+    def fetch_ohlcv(self, symbol, timeframe='1h', limit=21):
+        self.ohlcv_calls += 1
+        frame = scanner._TIMEFRAME_MS[timeframe]
+        start = int(time.time() * 1000) // frame * frame - (limit - 1) * frame
+        return [[start + k * frame, 100.0, 101.0, 99.0, 100.0 + k % 3, 1.0] for k in range(limit)]
+
+
+@pytest.fixture
+def universe(monkeypatch):
+    def build(n):
+        client = _Exchange(n)
+        monkeypatch.setattr(scanner, 'exchange', client)
+        monkeypatch.setitem(SCANNER_CONFIG, 'exclude', [])
+        scanner._closes_cache.clear()
+        return client
+    yield build
+    scanner._closes_cache.clear()
+
+
+def test_each_scan_stays_within_budget_and_coverage_grows(universe):
+    budget = SCANNER_CONFIG['ohlcv_budget']
+    n = budget * 2 + 5
+    client = universe(n)
+    expected_scans = math.ceil(n / budget)
+    for scan in range(1, expected_scans + 1):
+        calls = client.ohlcv_calls
+        results = scanner.scan_universe(force=True)
+        stats = scanner.last_scan_stats()
+        assert client.ohlcv_calls - calls <= budget
+        assert stats['cached'] == len(results) == min(n, scan * budget)
+        assert stats['scans_to_cover'] == expected_scans - scan
+    # 所有交易對都已有當前週期的K線，下一次掃描不再發出K線請求
+    calls = client.ohlcv_calls
+    scanner.scan_universe(force=True)
+    assert client.ohlcv_calls == calls
+    assert scanner.last_scan_stats()['scored'] == n
+
+
+def test_scores_need_a_full_bollinger_window(universe):
+    universe(3)
+    results = scanner.scan_universe(force=True)
+    period = indicator_params['bollinger']['period']
+    assert all(len(scanner._closes_cache[r['symbol']]['closes']) >= period + 1 for r in results)
+    assert len(results) == 3
@@ -1,14 +1,28 @@
 import ccxt
 import logging
 import time
-from config import okx_api_key, okx_secret_key, okx_passphrase, SYSTEM_CONFIG
+from config import okx_api_key, okx_secret_key, okx_passphrase, SYSTEM_CONFIG, CASSETTE_CONFIG
 import numpy as np
-from functools import lru_cache
+import candles
+import gateway
+import cassette
+import fake_exchange
 
 def initialize_exchange(max_retries=3, base_delay=2):
     """
     初始化交易所連接，包含重試機制和速率限制
+    CASSETTE_CONFIG['mode'] 為 record 時錄製所有請求，為 replay 時從錄製文件回放
     """
+    if CASSETTE_CONFIG['mode'] in ('replay', 'fake'):
+        if CASSETTE_CONFIG['mode'] == 'replay':
+            client = cassette.ReplayExchange(CASSETTE_CONFIG['path'], CASSETTE_CONFIG['speed'])
+        else:
+            client = fake_exchange.FakeExchange(latency=CASSETTE_CONFIG['fake_latency'])
+        exchange_instance = gateway.wrap(client, scope='main')
+        markets = exchange_instance.load_markets()
+        exchange_instance.markets = {symbol: market for symbol, market in markets.items() if market['type'] == 'spot'}
+        return exchange_instance
+
     if not all([okx_api_key, okx_secret_key, okx_passphrase]):
         logging.error("缺少交易所API憑證")
         return None
@@ -16,9 +30,9 @@ def initialize_exchange(max_retries=3, base_delay=2):
     for attempt in range(max_retries):
         try:
             delay = base_delay * (2 ** attempt)
-            logging.info(f"開始第 {attempt + 1} 次嘗試初始化交易所連接")
+            logging.info("開始第 %s 次嘗試初始化交易所連接", attempt + 1)
 
-            exchange_instance = ccxt.okx({
+            client = ccxt.okx({
                 'apiKey': okx_api_key,
                 'secret': okx_secret_key,
                 'password': okx_passphrase,
@@ -34,88 +48,66 @@ def initialize_exchange(max_retries=3, base_delay=2):
                     'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
                 }
             })
+            if CASSETTE_CONFIG['mode'] == 'record':
+                client = cassette.RecordingExchange(client, CASSETTE_CONFIG['path'])
+            exchange_instance = gateway.wrap(client, scope='main')
 
-            # 使用安全的API調用方式載入市場
-            markets = safe_api_call(exchange_instance.load_markets)
+            # 所有請求經由 gateway（驗證、重試、熔斷）
+            markets = exchange_instance.load_markets()
 
             # 過濾掉非現貨市場
             spot_markets = {symbol: market for symbol, market in markets.items() if market['type'] == 'spot'}
             exchange_instance.markets = spot_markets
 
             # 測試API連接
-            status = safe_api_call(exchange_instance.fetch_status)
+            status = exchange_instance.fetch_status()
 
             if status['status'] == 'ok':
                 logging.info("交易所連接成功")
                 return exchange_instance
             else:
-                logging.warning(f"交易所狀態異常: {status['status']}")
+                logging.warning("交易所狀態異常: %s", status['status'])
 
         except ccxt.NetworkError as e:
             if attempt < max_retries - 1:
-                logging.warning(f"網路錯誤，{delay}秒後重試: {str(e)}")
+                logging.warning("網路錯誤，%s秒後重試: %s", delay, e)
                 time.sleep(delay)
             else:
-                logging.error(f"網路錯誤，達到最大重試次數: {str(e)}")
+                logging.error("網路錯誤，達到最大重試次數: %s", e)
                 return None
 
         except Exception as e:
-            logging.error(f"初始化交易所時發生錯誤: {str(e)}")
+            logging.error("初始化交易所時發生錯誤: %s", e)
             if attempt < max_retries - 1:
-                logging.info(f"將在{delay}秒後重試")
+                logging.info("將在%s秒後重試", delay)
                 time.sleep(delay)
             else:
                 return None
 
 def safe_api_call(func, *args, **kwargs):
     """
-    安全的API調用封裝，包含數據驗證
+    安全的API調用封裝：數據驗證、重試、超時與熔斷統一由 gateway 處理
     """
-    max_retries = SYSTEM_CONFIG['max_retries']
-    retry_delay = SYSTEM_CONFIG['retry_delay']
-
-    for attempt in range(max_retries):
-        try:
-            time.sleep(1)  # 添加小延遲
-            result = func(*args, **kwargs)
-
-            # 如果是 load_markets 或 fetch_status，直接返回結果
-            if func.__name__ in ['load_markets', 'fetch_status']:
-                return result
+    if getattr(func, 'routed', False):
+        return func(*args, **kwargs)  # 已經是經由 gateway 的方法
+    return gateway.call(func.__name__, func, *args, **kwargs)
 
-            # 如果是 OHLCV 數據，檢查格式
-            if isinstance(result, list) and all(isinstance(candle, list) and len(candle) >= 5 for candle in result):
-                return result
-            else:
-                logging.error(f"API調用返回了非預期格式的數據: {result}")
-                raise Exception("Malformed data received from API")
-
-        except ccxt.RateLimitExceeded as e:
-            if attempt < max_retries - 1:
-                delay = retry_delay * (2 ** attempt)
-                logging.warning(f"達到速率限制，{delay}秒後重試: {str(e)}")
-                time.sleep(delay)
-            else:
-                raise
-        except ccxt.NetworkError as e:
-            if attempt < max_retries - 1:
-                delay = retry_delay * (2 ** attempt)
-                logging.warning(f"網路錯誤，{delay}秒後重試: {str(e)}")
-                time.sleep(delay)
-            else:
-                raise
-        except Exception as e:
-            logging.error(f"API調用錯誤: {str(e)}")
-            raise
+def fetch_ohlcv(symbol, timeframe='1h', limit=100):
+    """
+    獲取K線：優先由本地報價構建的 1 分鐘K線重採樣，只有本地數據覆蓋不到的部分才請求交易所
+    """
+    def _rest(since, count):
+        return exchange.fetch_ohlcv(symbol, timeframe=timeframe, since=since, limit=count)
+    return candles.get_ohlcv(symbol, timeframe, limit, _rest)
 
 def get_rsi(symbol, timeframe='4h', periods=14):
     """
     計算指定交易對的 RSI
     """
     try:
-        ohlcv = safe_api_call(exchange.fetch_ohlcv, symbol, timeframe=timeframe, limit=periods + 20)
+        ohlcv = fetch_ohlcv(symbol, timeframe=timeframe, limit=periods + 20)
         if not ohlcv:
-            logging.warning(f"無法獲取 {symbol} 的OHLCV數據")
+            logging.warning("無法獲取 %s 的OHLCV數據", symbol)
             return None
 
         # 確保 OHLCV 數據格式正確
@@ -126,12 +118,12 @@ def get_rsi(symbol, timeframe='4h', periods=14):
                 if isinstance(close_price, (int, float)):
                     closes.append(float(close_price))
                 else:
-                    logging.warning(f"無效的收盤價數據: {close_price}")
+                    logging.warning("無效的收盤價數據: %s", close_price)
             else:
-                logging.warning(f"無效的 OHLCV 數據格式: {candle}")
+                logging.warning("無效的 OHLCV 數據格式: %s", candle)
 
         if len(closes) < periods:
-            logging.warning(f"不足夠的數據來計算 {symbol} 的 RSI")
+            logging.warning("不足夠的數據來計算 %s 的 RSI", symbol)
             return None
 
         # 計算 RSI
@@ -154,13 +146,13 @@ def get_rsi(symbol, timeframe='4h', periods=14):
 
         return rsi[-1]
     except ccxt.NetworkError as e:
-        logging.error(f"在獲取 {symbol} 的 RSI 時發生網路錯誤: {str(e)}")
+        logging.error("在獲取 %s 的 RSI 時發生網路錯誤: %s", symbol, e)
         return None
     except ccxt.ExchangeError as e:
-        logging.error(f"在獲取 {symbol} 的 RSI 時發生交易所錯誤: {str(e)}")
+        logging.error("在獲取 %s 的 RSI 時發生交易所錯誤: %s", symbol, e)
         return None
     except Exception as e:
-        logging.error(f"計算 {symbol} 的 RSI 時發生錯誤: {str(e)}")
+        logging.error("計算 %s 的 RSI 時發生錯誤: %s", symbol, e)
         return None
 
 def get_macd(symbol, timeframe='4h', fast_period=12, slow_period=26, signal_period=9):
@@ -168,9 +160,9 @@ def get_macd(symbol, timeframe='4h', fast_period=12, slow_period=26, signal_peri
     計算 MACD 指標
     """
     try:
-        ohlcv = safe_api_call(exchange.fetch_ohlcv, symbol, timeframe=timeframe, limit=slow_period + 50)
+        ohlcv = fetch_ohlcv(symbol, timeframe=timeframe, limit=slow_period + 50)
         if not ohlcv:
-            logging.warning(f"無法獲取 {symbol} 的OHLCV數據以計算MACD")
+            logging.warning("無法獲取 %s 的OHLCV數據以計算MACD", symbol)
             return None
 
         # 確保 OHLCV 數據格式正確
@@ -181,12 +173,12 @@ def get_macd(symbol, timeframe='4h', fast_period=12, slow_period=26, signal_peri
                 if isinstance(close_price, (int, float)):
                     closes.append(float(close_price))
                 else:
-                    logging.warning(f"無效的收盤價數據: {close_price}")
+                    logging.warning("無效的收盤價數據: %s", close_price)
             else:
-                logging.warning(f"無效的 OHLCV 數據格式: {candle}")
+                logging.warning("無效的 OHLCV 數據格式: %s", candle)
 
         if len(closes) < slow_period:
-            logging.warning(f"不足夠的數據來計算 {symbol} 的 MACD")
+            logging.warning("不足夠的數據來計算 %s 的 MACD", symbol)
             return None
 
         # 計算 MACD
@@ -197,17 +189,16 @@ def get_macd(symbol, timeframe='4h', fast_period=12, slow_period=26, signal_peri
         histogram = macd_line - signal_line
         return {'macd': macd_line, 'signal': signal_line, 'histogram': histogram}
     except ccxt.NetworkError as e:
-        logging.error(f"在獲取 {symbol} 的 MACD 時發生網路錯誤: {str(e)}")
+        logging.error("在獲取 %s 的 MACD 時發生網路錯誤: %s", symbol, e)
         return None
     except ccxt.ExchangeError as e:
-        logging.error(f"在獲取 {symbol} 的 MACD 時發生交易所錯誤: {str(e)}")
+        logging.error("在獲取 %s 的 MACD 時發生交易所錯誤: %s", symbol, e)
         return None
     except Exception as e:
-        logging.error(f"計算 {symbol} 的 MACD 時發生錯誤: {str(e)}")
+        logging.error("計算 %s 的 MACD 時發生錯誤: %s", symbol, e)
         return None
 
 
-@lru_cache(maxsize=128)  # 使用緩存機制，避免重複計算
 def get_bollinger(symbol, timeframe='1h', period=20, deviation=2):
     """
     計算 Bollinger Bands
@@ -218,12 +209,12 @@ def get_bollinger(symbol, timeframe='1h', period=20, deviation=2):
     :return: 包含上軌、中軌、下軌的字典
     """
     try:
-        logging.info(f"開始計算 {symbol} 的 Bollinger Bands，時間框架: {timeframe}，週期: {period}，偏差: {deviation}")
+        logging.info("開始計算 %s 的 Bollinger Bands，時間框架: %s，週期: %s，偏差: %s", symbol, timeframe, period, deviation)
         
         # 獲取 OHLCV 數據
-        ohlcv = safe_api_call(exchange.fetch_ohlcv, symbol, timeframe=timeframe, limit=period + 20)
+        ohlcv = fetch_ohlcv(symbol, timeframe=timeframe, limit=period + 20)
         if not ohlcv:
-            logging.warning(f"無法獲取 {symbol} 的OHLCV數據以計算 Bollinger Bands")
+            logging.warning("無法獲取 %s 的OHLCV數據以計算 Bollinger Bands", symbol)
             return {}
         
         # 提取收盤價數據
@@ -234,13 +225,13 @@ def get_bollinger(symbol, timeframe='1h', period=20, deviation=2):
                 if isinstance(close_price, (int, float)) and not np.isnan(close_price):  # 排除 NaN 或無效值
                     closes.append(float(close_price))
                 else:
-                    logging.warning(f"無效的收盤價數據: {close_price}")
+                    logging.warning("無效的收盤價數據: %s", close_price)
             else:
-                logging.warning(f"無效的 OHLCV 數據格式: {candle}")
+                logging.warning("無效的 OHLCV 數據格式: %s", candle)
         
         # 檢查數據是否足夠
         if len(closes) < period:
-            logging.warning(f"不足夠的數據來計算 {symbol} 的 Bollinger Bands")
+            logging.warning("不足夠的數據來計算 %s 的 Bollinger Bands", symbol)
             return {}
         
         # 計算 Bollinger Bands
@@ -249,20 +240,20 @@ def get_bollinger(symbol, timeframe='1h', period=20, deviation=2):
         upper_band = sma + deviation * std
         lower_band = sma - deviation * std
         
-        logging.info(f"成功計算 {symbol} 的 Bollinger Bands: 上軌={upper_band:.4f}, 中軌={sma:.4f}, 下軌={lower_band:.4f}")
+        logging.info("成功計算 %s 的 Bollinger Bands: 上軌=%.4f, 中軌=%.4f, 下軌=%.4f", symbol, upper_band, sma, lower_band)
         return {'upper': upper_band, 'middle': sma, 'lower': lower_band}
     
     except ccxt.NetworkError as e:
-        logging.error(f"在獲取 {symbol} 的 Bollinger Bands 時發生網路錯誤: {str(e)}")
+        logging.error("在獲取 %s 的 Bollinger Bands 時發生網路錯誤: %s", symbol, e)
         return {}
     except ccxt.ExchangeError as e:
-        logging.error(f"在獲取 {symbol} 的 Bollinger Bands 時發生交易所錯誤: {str(e)}")
+        logging.error("在獲取 %s 的 Bollinger Bands 時發生交易所錯誤: %s", symbol, e)
         return {}
     except ValueError as e:
-        logging.error(f"在處理 {symbol} 的 OHLCV 數據時發生值錯誤: {str(e)}")
+        logging.error("在處理 %s 的 OHLCV 數據時發生值錯誤: %s", symbol, e)
         return {}
     except Exception as e:
-        logging.error(f"計算 {symbol} 的 Bollinger Bands 時發生未知錯誤: {str(e)}")
+        logging.error("計算 %s 的 Bollinger Bands 時發生未知錯誤: %s", symbol, e)
         return {}
 
 def get_volatility(symbol, timeframe='1h', period=20):
@@ -270,9 +261,9 @@ def get_volatility(symbol, timeframe='1h', period=20):
     計算年化波動率
     """
     try:
-        ohlcv = safe_api_call(exchange.fetch_ohlcv, symbol, timeframe=timeframe, limit=period + 20)
+        ohlcv = fetch_ohlcv(symbol, timeframe=timeframe, limit=period + 20)
         if not ohlcv:
-            logging.warning(f"無法獲取 {symbol} 的OHLCV數據以計算波動率")
+            logging.warning("無法獲取 %s 的OHLCV數據以計算波動率", symbol)
             return None
 
         # 確保 OHLCV 數據格式正確
@@ -283,12 +274,12 @@ def get_volatility(symbol, timeframe='1h', period=20):
                 if isinstance(close_price, (int, float)):
                     closes.append(float(close_price))
                 else:
-                    logging.warning(f"無效的收盤價數據: {close_price}")
+                    logging.warning("無效的收盤價數據: %s", close_price)
             else:
-                logging.warning(f"無效的 OHLCV 數據格式: {candle}")
+                logging.warning("無效的 OHLCV 數據格式: %s", candle)
 
         if len(closes) < period:
-            logging.warning(f"不足夠的數據來計算 {symbol} 的波動率")
+            logging.warning("不足夠的數據來計算 %s 的波動率", symbol)
             return None
 
         # 計算年化波動率
@@ -296,13 +287,13 @@ def get_volatility(symbol, timeframe='1h', period=20):
         annualized_volatility = np.std(log_returns) * np.sqrt(365 * 24)  # 假設每小時採樣
         return annualized_volatility
     except ccxt.NetworkError as e:
-        logging.error(f"在獲取 {symbol} 的波動率時發生網路錯誤: {str(e)}")
+        logging.error("在獲取 %s 的波動率時發生網路錯誤: %s", symbol, e)
         return None
     except ccxt.ExchangeError as e:
-        logging.error(f"在獲取 {symbol} 的波動率時發生交易所錯誤: {str(e)}")
+        logging.error("在獲取 %s 的波動率時發生交易所錯誤: %s", symbol, e)
         return None
     except Exception as e:
-        logging.error(f"計算 {symbol} 的波動率時發生錯誤: {str(e)}")
+        logging.error("計算 %s 的波動率時發生錯誤: %s", symbol, e)
         return None
 
 
@@ -316,15 +307,15 @@ def calculate_volatility(currency: str, timeframe='1d', period=20) -> float:
     """
     try:
         # 獲取 OHLCV 數據
-        ohlcv = safe_api_call(exchange.fetch_ohlcv, f"{currency}/USDT", timeframe=timeframe, limit=period + 1)
+        ohlcv = fetch_ohlcv(f"{currency}/USDT", timeframe=timeframe, limit=period + 1)
         if not ohlcv or len(ohlcv) < period:
-            logging.warning(f"無法獲取足夠的 {currency} OHLCV 數據以計算波動率")
+            logging.warning("無法獲取足夠的 %s OHLCV 數據以計算波動率", currency)
             return 0.0
         
         # 提取收盤價數據
         closes = [float(candle[4]) for candle in ohlcv if isinstance(candle, list) and len(candle) >= 5]
         if len(closes) < period:
-            logging.warning(f"不足夠的 {currency} 收盤價數據以計算波動率")
+            logging.warning("不足夠的 %s 收盤價數據以計算波動率", currency)
             return 0.0
         
         # 計算每日收益率（對數收益率）
@@ -332,17 +323,17 @@ def calculate_volatility(currency: str, timeframe='1d', period=20) -> float:
         
         # 計算波動率（標準差）
         volatility = np.std(log_returns) * np.sqrt(len(closes))  # 年化波動率
-        logging.info(f"{currency} 的波動率: {volatility:.4f}")
+        logging.info("%s 的波動率: %.4f", currency, volatility)
         return volatility
     
     except ccxt.NetworkError as e:
-        logging.error(f"在獲取 {currency} 的波動率時發生網路錯誤: {str(e)}")
+        logging.error("在獲取 %s 的波動率時發生網路錯誤: %s", currency, e)
         return 0.0
     except ccxt.ExchangeError as e:
-        logging.error(f"在獲取 {currency} 的波動率時發生交易所錯誤: {str(e)}")
+        logging.error("在獲取 %s 的波動率時發生交易所錯誤: %s", currency, e)
         return 0.0
     except Exception as e:
-        logging.error(f"計算 {currency} 的波動率時發生未知錯誤: {str(e)}")
+        logging.error("計算 %s 的波動率時發生未知錯誤: %s", currency, e)
         return 0.0
 
 
@@ -354,7 +345,7 @@ try:
     if exchange is None:
         logging.error("無法初始化交易所連接")
 except Exception as e:
-    logging.error(f"初始化交易所時發生錯誤: {str(e)}")
+    logging.error("初始化交易所時發生錯誤: %s", e)
     exchange = None
 
 # 導出實例